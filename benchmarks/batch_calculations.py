@@ -0,0 +1,114 @@
+# benchmarks/batch_calculations.py
+#
+# Compares the scalar LoanDecision.calculate_dscr / calculate_ccr loop with
+# the NumPy batch versions on synthetic applications, and checks that both
+# give the same results, including the zero-rate, zero-term and zero-debt
+# edge cases.
+#
+#   python benchmarks/batch_calculations.py [--applications 200000]
+import os
+import sys
+import time
+import math
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from services.calculations import LoanDecision
+from services.batch_calculations import calculate_dscr_batch, calculate_ccr_batch
+
+# (income, debt payments, amount, term, rate) and (collateral, outstanding, amount)
+DSCR_EDGE_CASES = [
+    (3000, 1200, 100000, 20, 0.0),     # no interest
+    (3000, 0, 100000, 20, 0.05),       # no existing debt
+    (3000, 1200, 100000, 0, 0.05),     # no term
+    (3000, 0, 0, 0, 0.05),             # nothing to pay
+    (3000, 0, 0, 10, 0.0),             # nothing to pay, no interest
+    (0, 1200, 50000, 5, 0.03),         # no income
+    (3000, 1200, 100000, 20, -0.01),   # negative rate falls back to linear
+    (-500, 1200, 100000, 20, 0.05),    # negative income
+]
+CCR_EDGE_CASES = [
+    (200000, 0, 100000),
+    (200000, 50000, 0),
+    (200000, 0, 0),
+    (0, 0, 100000),
+    (200000, -100000, 50000),
+]
+
+
+def synthetic(n: int, rng):
+    income = rng.uniform(0, 15000, n).round(2)
+    debt = rng.choice([0.0, 1.0], n, p=[0.3, 0.7]) * rng.uniform(0, 50000, n).round(2)
+    amount = rng.integers(1000, 500000, n).astype(float)
+    term = rng.integers(0, 31, n).astype(float)
+    rate = rng.choice([0.0, 0.02, 0.035, 0.05, 0.07], n)
+    collateral = rng.uniform(0, 800000, n).round(2)
+    outstanding = rng.choice([0.0, 1.0], n, p=[0.5, 0.5]) * rng.uniform(0, 300000, n).round(2)
+    return income, debt, amount, term, rate, collateral, outstanding
+
+
+def same(a: float, b: float) -> bool:
+    if math.isinf(a) or math.isinf(b):
+        return a == b
+    return math.isclose(a, b, rel_tol=1e-12, abs_tol=1e-12)
+
+
+def check_edge_cases():
+    ok = True
+    for args in DSCR_EDGE_CASES:
+        scalar = LoanDecision.calculate_dscr(*args[:3], int(args[3]), args[4])
+        batch = float(calculate_dscr_batch(*args)[()])
+        if not same(scalar, batch):
+            print(f"  DSCR mismatch for {args}: scalar={scalar} batch={batch}")
+            ok = False
+    for args in CCR_EDGE_CASES:
+        scalar = LoanDecision.calculate_ccr(*args)
+        batch = float(calculate_ccr_batch(*args)[()])
+        if not same(scalar, batch):
+            print(f"  CCR mismatch for {args}: scalar={scalar} batch={batch}")
+            ok = False
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scalar vs NumPy batch DSCR/CCR")
+    parser.add_argument("--applications", type=int, default=200000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    income, debt, amount, term, rate, collateral, outstanding = synthetic(args.applications, rng)
+
+    started = time.perf_counter()
+    scalar_dscr = [
+        LoanDecision.calculate_dscr(income[i], debt[i], amount[i], int(term[i]), rate[i])
+        for i in range(args.applications)
+    ]
+    scalar_ccr = [
+        LoanDecision.calculate_ccr(collateral[i], outstanding[i], amount[i])
+        for i in range(args.applications)
+    ]
+    scalar_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    batch_dscr = calculate_dscr_batch(income, debt, amount, term, rate)
+    batch_ccr = calculate_ccr_batch(collateral, outstanding, amount)
+    batch_s = time.perf_counter() - started
+
+    mismatches = sum(not same(a, b) for a, b in zip(scalar_dscr, batch_dscr.tolist()))
+    mismatches += sum(not same(a, b) for a, b in zip(scalar_ccr, batch_ccr.tolist()))
+    edge_ok = check_edge_cases()
+
+    print(f"{args.applications} applications")
+    print(f"scalar loop: {scalar_s * 1000:9.1f} ms")
+    print(f"numpy batch: {batch_s * 1000:9.1f} ms  ({scalar_s / batch_s:.0f}x)")
+    print(f"mismatches:  {mismatches}")
+    print(f"edge cases:  {'identical' if edge_ok else 'MISMATCH'}")
+    if mismatches or not edge_ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+# benchmarks/decision_engine.py
+#
+# Micro-benchmarks for the loan decision path: the DSCR/CCR calculations,
+# the validation helpers of routes/loan.py and the decision rules, one by one
+# and combined the way loan_submit runs them (without the I/O). Inputs are
+# synthetic applications from a seeded generator, covering every loan type
+# and subtype including invalid ones, so runs are reproducible.
+#
+# Reported per benchmark: ops/sec (the median over --processes fresh
+# interpreters of the best of --repeat runs of at least --min-time seconds
+# each), peak bytes allocated per call and memory blocks still held per call
+# afterwards (tracemalloc). --save stores the results as the baseline; later
+# runs compare against it and exit with 1 when a benchmark is slower, or
+# allocates more, than the baseline by more than --threshold. Timings only
+# compare on the same machine, so save the baseline before making a change
+# and run again after it, on a machine that is otherwise idle.
+#
+#   python benchmarks/decision_engine.py [--ops 20000] [--processes 5] [--only dscr] [--save]
+import os
+import sys
+import gc
+import json
+import math
+import time
+import random
+import logging
+import argparse
+import platform
+import statistics
+import subprocess
+import tracemalloc
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.calculations import LoanDecision
+from services.decision_rules import Ruleset
+from routes.loan import validate_boni_score, validate_dscr_score, validate_immediate_loan, validate_building_loan
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "decision_engine.json")
+
+LOAN_CASES = [
+    ("Sofortkredit", "annuitaet"),
+    ("Sofortkredit", "tilgung"),
+    ("Sofortkredit", "endfaellig"),
+    ("Baudarlehen", "annuitaet"),
+]
+
+
+class SyntheticApplication(NamedTuple):
+    loan_type: str
+    loan_subtype: str
+    requested_amount: int
+    repayment_amount: int
+    term_in_years: int
+    boni_score: float
+    available_income: float = 0.0
+    total_debt_payments: float = 0.0
+    collateral_value: float = 0.0
+    total_outstanding_debt: float = 0.0
+
+
+def synthetic_applications(n: int, loan_type: str, loan_subtype: str, seed: int) -> List[SyntheticApplication]:
+    # Roughly one in ten applications breaks a validation rule (amount, term,
+    # Bonität), so the error paths are part of the mix
+    rng = random.Random(f"{seed}:{loan_type}:{loan_subtype}")
+    applications = []
+    for _ in range(n):
+        boni = round(rng.uniform(520, 999), 2)
+        if loan_type == "Sofortkredit":
+            amount = rng.randrange(1000, 44000, 100)
+            years = rng.choice([1, 2, 3, 4, 5, 5, 3, 2, 6])
+            repayment = max(1, amount // (years * 12)) if loan_subtype == "tilgung" else 0
+            applications.append(SyntheticApplication(loan_type, loan_subtype, amount, repayment, years, boni))
+        else:
+            amount = rng.randrange(50000, 800000, 1000)
+            applications.append(SyntheticApplication(
+                loan_type, loan_subtype, amount, 0, rng.randint(5, 22), boni,
+                available_income=round(rng.uniform(1500, 15000), 2),
+                total_debt_payments=round(rng.choice([0.0, rng.uniform(0, 30000)]), 2),
+                collateral_value=round(rng.uniform(0, 1500000), 2),
+                total_outstanding_debt=round(rng.choice([0.0, rng.uniform(0, 300000)]), 2),
+            ))
+    return applications
+
+
+def decide(app: SyntheticApplication, ruleset: Ruleset) -> Optional[dict]:
+    # loan_submit's steps between reading the form and storing the result
+    try:
+        validate_boni_score(app.boni_score, ruleset)
+        if app.loan_type == "Sofortkredit":
+            validate_immediate_loan(app.loan_subtype, app.requested_amount, app.repayment_amount, app.term_in_years)
+            dscr, ccr = 0.0, 0.0
+        else:
+            term = validate_building_loan(app.loan_subtype, app.term_in_years)
+            dscr = LoanDecision.calculate_dscr(app.available_income, app.total_debt_payments, app.requested_amount, term)
+            ccr = LoanDecision.calculate_ccr(app.collateral_value, app.total_outstanding_debt, app.requested_amount)
+            validate_dscr_score(dscr, ruleset)
+        return LoanDecision(app.boni_score, dscr, ccr, app.loan_type, ruleset).evaluate()
+    except ValueError:
+        return None
+
+
+def expect_errors(fn: Callable) -> Callable:
+    # Invalid applications raise ValueError; loan_submit turns that into a page
+    def call(*args):
+        try:
+            return fn(*args)
+        except ValueError:
+            return None
+    return call
+
+
+class Benchmark(NamedTuple):
+    name: str
+    call: Callable          # one operation, call(*arguments)
+    arguments: List[tuple]  # prepared up front, so only the call is measured
+
+
+def build_benchmarks(ops: int, seed: int) -> List[Benchmark]:
+    ruleset = Ruleset()
+    data = {case: synthetic_applications(ops, *case, seed=seed) for case in LOAN_CASES}
+    building = data[("Baudarlehen", "annuitaet")]
+    every_case = [app for apps in data.values() for app in apps[:ops // len(LOAN_CASES)]]
+
+    benchmarks = [
+        Benchmark("calculate_dscr", LoanDecision.calculate_dscr, [
+            (a.available_income, a.total_debt_payments, a.requested_amount, a.term_in_years) for a in building]),
+        Benchmark("calculate_ccr", LoanDecision.calculate_ccr, [
+            (a.collateral_value, a.total_outstanding_debt, a.requested_amount) for a in building]),
+        Benchmark("validate_boni_score", expect_errors(validate_boni_score), [(a.boni_score, ruleset) for a in every_case]),
+    ]
+    for loan_type, subtype in LOAN_CASES:
+        apps = data[(loan_type, subtype)]
+        if loan_type == "Sofortkredit":
+            benchmarks.append(Benchmark(f"validate_immediate_loan[{subtype}]", expect_errors(validate_immediate_loan), [
+                (a.loan_subtype, a.requested_amount, a.repayment_amount, a.term_in_years) for a in apps]))
+        else:
+            benchmarks.append(Benchmark("validate_building_loan", expect_errors(validate_building_loan), [
+                (a.loan_subtype, a.term_in_years) for a in apps]))
+    for loan_type in ("Sofortkredit", "Baudarlehen"):
+        dscr = 0.0 if loan_type == "Sofortkredit" else 1.6
+        benchmarks.append(Benchmark(
+            f"evaluate[{loan_type}]",
+            lambda boni, dscr, ccr, loan_type: LoanDecision(boni, dscr, ccr, loan_type, ruleset).evaluate(),
+            [(a.boni_score, dscr, 0.9, loan_type) for a in data[(loan_type, "annuitaet")]]
+        ))
+    for loan_type, subtype in LOAN_CASES:
+        benchmarks.append(Benchmark(f"decision_path[{loan_type}/{subtype}]", decide,
+                                    [(a, ruleset) for a in data[(loan_type, subtype)]]))
+    return benchmarks
+
+
+def ops_per_sec(benchmark: Benchmark, repeat: int, min_time: float) -> float:
+    # Best of `repeat` runs; each run goes over the inputs as often as needed
+    # to last min_time, so short benchmarks aren't dominated by timer noise
+    call, arguments = benchmark.call, benchmark.arguments
+
+    def run(loops: int) -> float:
+        started = time.perf_counter()
+        for _ in range(loops):
+            for args in arguments:
+                call(*args)
+        return time.perf_counter() - started
+
+    loops = max(1, math.ceil(min_time / max(run(1), 1e-9)))
+    best = min(run(loops) for _ in range(repeat))
+    return loops * len(arguments) / best
+
+
+def allocations(benchmark: Benchmark, sample: int = 500) -> Dict[str, float]:
+    # Peak bytes while one call runs, and blocks the call leaves allocated
+    # (its result, caches); gc is off so collections don't blur the counts
+    call, arguments = benchmark.call, benchmark.arguments[:sample]
+    results = [None] * (2 * len(arguments))
+    gc.disable()
+    tracemalloc.start()
+    try:
+        peak_total = 0
+        for i, args in enumerate(arguments):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            results[i] = call(*args)
+            peak_total += tracemalloc.get_traced_memory()[1] - before
+        blocks_before = sys.getallocatedblocks()
+        for i, args in enumerate(arguments, start=len(arguments)):
+            results[i] = call(*args)
+        blocks = sys.getallocatedblocks() - blocks_before
+    finally:
+        tracemalloc.stop()
+        gc.enable()
+    return {"alloc_bytes": peak_total / len(arguments), "blocks": blocks / len(arguments)}
+
+
+def machine() -> str:
+    return f"{platform.python_implementation()} {platform.python_version()} {platform.machine()} {platform.system()}"
+
+
+def compare(results: Dict[str, dict], baseline: dict, threshold: float) -> List[str]:
+    regressions = []
+    for name, result in results.items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        if result["ops_per_sec"] < base["ops_per_sec"] * (1 - threshold):
+            regressions.append(f"{name}: {result['ops_per_sec']:,.0f} ops/s, baseline {base['ops_per_sec']:,.0f}")
+        # A few bytes of slack: small allocations are rounded by the allocator
+        if result["alloc_bytes"] > base["alloc_bytes"] * (1 + threshold) + 16:
+            regressions.append(f"{name}: {result['alloc_bytes']:.0f} B/op allocated, baseline {base['alloc_bytes']:.0f}")
+    return regressions
+
+
+def timings_in_worker(args) -> Dict[str, float]:
+    # ops/s of every selected benchmark, measured in a fresh interpreter
+    command = [
+        sys.executable, os.path.abspath(__file__), "--worker",
+        "--ops", str(args.ops), "--repeat", str(args.repeat), "--min-time", str(args.min_time),
+        "--seed", str(args.seed), "--only", args.only
+    ]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the loan decision path")
+    parser.add_argument("--ops", type=int, default=20000, help="applications per benchmark")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--min-time", type=float, default=0.1, help="seconds per timed run")
+    parser.add_argument("--processes", type=int, default=5, help="worker processes; ops/s is their median")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--only", default="", help="run benchmarks whose name contains this")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown / extra allocation, 0.2 = 20%%")
+    parser.add_argument("--save", action="store_true", help="store this run as the baseline")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Measure the computation, not log output
+    logging.disable(logging.CRITICAL)
+    benchmarks = [b for b in build_benchmarks(args.ops, args.seed) if args.only in b.name]
+
+    if args.worker:
+        print(json.dumps({b.name: ops_per_sec(b, args.repeat, args.min_time) for b in benchmarks}))
+        return
+
+    # Speed differs noticeably from one interpreter process to the next
+    # (memory layout, hash seeds), so timings are the median over several
+    runs = [timings_in_worker(args) for _ in range(args.processes)]
+
+    results = {}
+    print(f"{'benchmark':42s} {'ops/s':>12s} {'spread':>8s} {'B/op':>8s} {'blocks/op':>10s}")
+    for benchmark in benchmarks:
+        timings = [run[benchmark.name] for run in runs]
+        median = statistics.median(timings)
+        result = {"ops_per_sec": median, **allocations(benchmark)}
+        results[benchmark.name] = result
+        spread = (max(timings) - min(timings)) / median
+        print(f"{benchmark.name:42s} {median:12,.0f} {spread:8.0%} {result['alloc_bytes']:8.0f} {result['blocks']:10.2f}")
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"machine": machine(), "ops": args.ops, "seed": args.seed, "results": results}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline saved to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print("No baseline yet, store one with --save")
+        return
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline["machine"] != machine():
+        print(f"Note: baseline was taken on {baseline['machine']}, this is {machine()}; ops/s are not comparable")
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"Regressions beyond {args.threshold:.0%}:")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+    print(f"No regressions beyond {args.threshold:.0%} against the baseline")
+
+
+if __name__ == "__main__":
+    main()
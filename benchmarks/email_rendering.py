@@ -0,0 +1,112 @@
+# benchmarks/email_rendering.py
+#
+# Cost of producing a mail. Per mail: the old HTML-only rendering, the same
+# features done per render (CSS inlined and text part converted on every
+# mail) and the precompiled templates EmailService uses now. Per process:
+# compiling all templates cold and from the bytecode cache. With --workers,
+# a bulk batch rendered in-process and by the render worker pool.
+#
+#   python benchmarks/email_rendering.py [--mails 2000] [--workers 0]
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, select_autoescape
+from services.email_service import email_service
+from services.email_rendering import InlineCssLoader, PlainTextLoader, inline_css, html_to_text
+
+def sample_emails():
+    return [
+        email_service.loan_status_email("kunde@example.com", "Erika", "01.02.2025", "Baudarlehen", "abgelehnt", "DSCR zu niedrig"),
+        email_service.loan_status_email("kunde@example.com", "Max", "03.02.2025", "Sofortkredit", "angenommen"),
+        email_service.password_reset_email("kunde@example.com", "Erika", "https://kreditbank.example/reset_password?token=abc"),
+        email_service.welcome_email("kunde@example.com", "Max"),
+    ]
+
+def message(email, html_content, text_content=None) -> str:
+    msg = MIMEMultipart("alternative")
+    msg["Subject"] = email.subject
+    msg["To"] = email.to_address
+    if text_content is not None:
+        msg.attach(MIMEText(text_content, "plain", "utf-8"))
+    msg.attach(MIMEText(html_content, "html", "utf-8"))
+    return msg.as_string()
+
+def per_mail(name, produce, emails, rounds: int):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for email in emails:
+            produce(email)
+    micros = (time.perf_counter() - started) / (rounds * len(emails)) * 1e6
+    print(f"  {name:36s} {micros:8.0f} us/mail")
+
+def compile_all(loader_class, cache_dir):
+    env = Environment(
+        loader=loader_class(email_service.templates_dir),
+        autoescape=select_autoescape(['html', 'xml']),
+        bytecode_cache=FileSystemBytecodeCache(cache_dir) if cache_dir else None
+    )
+    started = time.perf_counter()
+    for name in env.list_templates():
+        if name.endswith(".html"):
+            env.get_template(name)
+    return (time.perf_counter() - started) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description="Email rendering cost")
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--mails", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=0)
+    args = parser.parse_args()
+
+    emails = sample_emails()
+    plain_env = Environment(loader=FileSystemLoader(email_service.templates_dir), autoescape=select_autoescape(['html', 'xml']))
+    email_service.precompile()
+
+    def html_only(email):
+        return message(email, plain_env.get_template(f"{email.template}.html").render(**email.context))
+
+    def converted_per_render(email):
+        rendered = plain_env.get_template(f"{email.template}.html").render(**email.context)
+        return message(email, inline_css(rendered), html_to_text(rendered))
+
+    print("Per mail (MIME message included):")
+    per_mail("HTML only (before)", html_only, emails, args.rounds)
+    per_mail("inline CSS + text part per render", converted_per_render, emails, args.rounds)
+    per_mail("precompiled (EmailService.render)", lambda email: email_service.render(email).as_string(), emails, args.rounds)
+
+    print("Compiling all templates in a new process:")
+    cache_dir = tempfile.mkdtemp()
+    try:
+        for loader_class in (InlineCssLoader, PlainTextLoader):
+            cold = compile_all(loader_class, None)
+            compile_all(loader_class, cache_dir)
+            cached = compile_all(loader_class, cache_dir)
+            print(f"  {loader_class.__name__:18s} cold {cold:6.1f} ms, from bytecode cache {cached:6.1f} ms")
+            shutil.rmtree(cache_dir)
+            os.makedirs(cache_dir)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    if args.workers:
+        batch = [emails[i % len(emails)] for i in range(args.mails)]
+        print(f"Bulk batch of {len(batch)} mails:")
+        for workers in (0, args.workers):
+            email_service.render_workers, email_service.render_pool_min = workers, 1
+            email_service.render_many(batch[:workers * 2])  # start the pool outside the timing
+            started = time.perf_counter()
+            email_service.render_many(batch)
+            seconds = time.perf_counter() - started
+            label = f"{workers} render workers" if workers else "in-process"
+            print(f"  {label:20s} {len(batch) / seconds:8.0f} mails/s")
+        email_service.close()
+
+if __name__ == "__main__":
+    main()
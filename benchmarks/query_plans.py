@@ -0,0 +1,182 @@
+# benchmarks/query_plans.py
+#
+# Shows the SQLite query plan and timing of the hot per-endpoint queries on a
+# database built like an old install (no secondary indexes), then again after
+# running the migrations from migrations.py.
+#
+#   python benchmarks/query_plans.py [--applications 50000] [--repeat 50]
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, event, text, or_, and_
+from sqlalchemy.orm import sessionmaker
+from db import Base
+from models import Person, Application, File, Notification, PasswordResetToken
+from services.reset_tokens import hash_token
+from migrations import MIGRATIONS, run_migrations
+
+LOAN_TYPES = ["Sofortkredit", "Baudarlehen"]
+STATUSES = ["in bearbeitung", "angenommen", "abgelehnt", "Warten auf Auszahlung"]
+
+
+def build_legacy_schema(engine):
+    Base.metadata.create_all(bind=engine)
+    # Old installs only had the primary key indexes, drop everything else
+    legacy = {f"ix_{table}_id" for table in Base.metadata.tables}
+    with engine.begin() as conn:
+        indexes = conn.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'ix_%'"
+        )).scalars().all()
+        for name in indexes:
+            if name not in legacy:
+                conn.execute(text(f"DROP INDEX {name}"))
+
+
+def seed(session, n_applications: int):
+    rng = random.Random(42)
+    n_customers = max(1, n_applications // 5)
+    n_staff = 20
+
+    def person(i, person_type):
+        return Person(
+            salutation="Herr", first_name=f"Vorname{i}", second_name=f"Nachname{i}",
+            street="Hauptstraße", house_number=str(i), zip_code="10115", city="Berlin",
+            country="Deutschland", person_type=person_type, email=f"user{i}@example.com",
+            password_hash="x"
+        )
+
+    people = [person(i, "employee" if i < n_staff // 2 else "manager") for i in range(n_staff)]
+    people += [person(i, "customer") for i in range(n_staff, n_staff + n_customers)]
+    session.add_all(people)
+    session.flush()
+    staff_ids = [p.id for p in people[:n_staff]]
+    customer_ids = [p.id for p in people[n_staff:]]
+
+    start = datetime(2023, 1, 1)
+    applications = []
+    for i in range(n_applications):
+        applications.append(Application(
+            person_id=rng.choice(customer_ids),
+            loan_type=rng.choice(LOAN_TYPES),
+            loan_subtype="annuitaet",
+            requested_amount=rng.randint(1000, 500000),
+            term_in_years=rng.randint(1, 20),
+            status=rng.choice(STATUSES),
+            created_at=start + timedelta(minutes=i),
+            handled_by_id=rng.choice(staff_ids) if rng.random() < 0.7 else None,
+            needs_manager_approval=rng.random() < 0.2,
+        ))
+    session.add_all(applications)
+    session.flush()
+
+    for p in people[::50]:
+        session.add(PasswordResetToken(token_hash=hash_token(f"token{p.id}"), person_id=p.id,
+                                       expires_at=start + timedelta(hours=1)))
+    for app in applications[::3]:
+        session.add(File(file_name="lohn.pdf", file_type="application/pdf", sha256="0" * 64,
+                         application_id=app.id, person_id=app.person_id))
+    for i in range(n_applications):
+        session.add(Notification(recipient_id=rng.choice(staff_ids), message="Hinweis",
+                                 is_read=rng.random() < 0.8, created_at=start + timedelta(minutes=i)))
+    session.commit()
+    return staff_ids, customer_ids
+
+
+def endpoint_queries(session, staff_ids, customer_ids):
+    last = session.query(Application).order_by(Application.id.desc()).first()
+    return {
+        "/dashboard (customer)": lambda: session.query(Application).filter(
+            Application.person_id == customer_ids[0]
+        ).order_by(Application.created_at.desc()).all(),
+        "/dashboard (staff page)": lambda: session.query(Application).order_by(
+            Application.created_at.desc(), Application.id.desc()
+        ).limit(51).all(),
+        "/dashboard (staff page, status filter)": lambda: session.query(Application).filter(
+            Application.status == "in bearbeitung",
+            or_(Application.created_at < last.created_at,
+                and_(Application.created_at == last.created_at, Application.id < last.id))
+        ).order_by(Application.created_at.desc(), Application.id.desc()).limit(51).all(),
+        "/dashboard (staff page, handler filter)": lambda: session.query(Application).filter(
+            Application.handled_by_id == staff_ids[0]
+        ).order_by(Application.created_at.desc(), Application.id.desc()).limit(51).all(),
+        "/dashboard (notifications)": lambda: session.query(Notification).filter(
+            Notification.recipient_id == staff_ids[0], Notification.is_read == False
+        ).order_by(Notification.created_at.desc()).all(),
+        "/dashboard (managers)": lambda: session.query(Person).filter(
+            Person.person_type == "manager"
+        ).all(),
+        "/upload (files)": lambda: session.query(File.id, File.file_name).filter(
+            File.application_id == last.id
+        ).all(),
+        "/reset_password (token)": lambda: session.query(PasswordResetToken).filter_by(
+            token_hash=hash_token("token1001")
+        ).first(),
+    }
+
+
+def measure(engine, session, queries, repeat):
+    results = {}
+    for name, run in queries.items():
+        captured = []
+        listener = lambda conn, cursor, statement, params, context, many: captured.append((statement, params))
+        event.listen(engine, "before_cursor_execute", listener)
+        run()
+        event.remove(engine, "before_cursor_execute", listener)
+        statement, params = captured[-1]
+
+        raw = engine.raw_connection()
+        try:
+            plan = raw.cursor().execute(f"EXPLAIN QUERY PLAN {statement}", params).fetchall()
+        finally:
+            raw.close()
+
+        session.expunge_all()
+        started = time.perf_counter()
+        for _ in range(repeat):
+            run()
+            session.expunge_all()
+        elapsed_ms = (time.perf_counter() - started) / repeat * 1000
+        results[name] = (elapsed_ms, [row[-1] for row in plan])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-endpoint query plans before and after migrations")
+    parser.add_argument("--applications", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        build_legacy_schema(engine)
+        session = sessionmaker(bind=engine)()
+        staff_ids, customer_ids = seed(session, args.applications)
+        queries = endpoint_queries(session, staff_ids, customer_ids)
+
+        before = measure(engine, session, queries, args.repeat)
+        run_migrations(engine)
+        with engine.begin() as conn:
+            conn.execute(text("ANALYZE"))
+        after = measure(engine, session, queries, args.repeat)
+        session.close()
+        engine.dispose()
+
+    print(f"{args.applications} applications, {args.repeat} runs per query, "
+          f"migrations 1..{MIGRATIONS[-1][0]}\n")
+    for name in queries:
+        before_ms, before_plan = before[name]
+        after_ms, after_plan = after[name]
+        print(f"{name}: {before_ms:.2f} ms -> {after_ms:.2f} ms")
+        print(f"  before: {' | '.join(before_plan)}")
+        print(f"  after:  {' | '.join(after_plan)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# benchmarks/smtp_delivery.py
+#
+# Messages per second against a local SMTP sink (aiosmtpd, accepts any login
+# and throws the mails away): a new connection per mail as EmailService used
+# to do, the connection pool one mail at a time, and the pool sending batches
+# over one session. The sink runs without TLS, so against a real server with
+# STARTTLS the gap is larger still.
+#
+#   pip install aiosmtpd
+#   python benchmarks/smtp_delivery.py [--messages 500] [--batch-size 20]
+import os
+import sys
+import time
+import logging
+import smtplib
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.email_service import email_service, OutboundEmail
+from services.smtp_pool import SmtpConnectionPool
+
+USERNAME, PASSWORD = "bench@kreditbank.local", "bench"
+
+class CountingHandler:
+    def __init__(self):
+        self.received = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        self.received += 1
+        return "250 OK"
+
+def start_sink(port: int):
+    from aiosmtpd.controller import Controller
+    from aiosmtpd.smtp import AuthResult
+
+    def accept_any(server, session, envelope, mechanism, auth_data):
+        return AuthResult(success=True)
+
+    # The sink's own log is one line per login
+    logging.getLogger("mail.log").setLevel(logging.ERROR)
+    handler = CountingHandler()
+    controller = Controller(
+        handler, hostname="127.0.0.1", port=port,
+        authenticator=accept_any, auth_require_tls=False
+    )
+    controller.start()
+    return controller, handler
+
+def build_messages(n: int):
+    email = OutboundEmail("kunde@example.com", "Kreditbank - Update zu Ihrem Kreditantrag", "loan_status", {
+        "first_name": "Erika", "application_date": "01.02.2025", "loan_type": "Baudarlehen",
+        "status": "angenommen", "reason": "Genehmigung empfohlen"
+    })
+    message = email_service.render(email).as_string()
+    return [(USERNAME, [f"kunde{i}@example.com"], message) for i in range(n)]
+
+def connection_per_message(port: int, messages):
+    for from_address, to_addresses, message in messages:
+        server = smtplib.SMTP("127.0.0.1", port)
+        try:
+            server.login(USERNAME, PASSWORD)
+            server.sendmail(from_address, to_addresses, message)
+        finally:
+            server.quit()
+
+def pooled_one_by_one(pool: SmtpConnectionPool, messages):
+    for from_address, to_addresses, message in messages:
+        pool.send(from_address, to_addresses, message)
+
+def pooled_batches(pool: SmtpConnectionPool, messages, batch_size: int):
+    for start in range(0, len(messages), batch_size):
+        errors = pool.send_many(messages[start:start + batch_size])
+        if any(errors):
+            raise next(e for e in errors if e)
+
+def main():
+    parser = argparse.ArgumentParser(description="SMTP delivery throughput against a local sink")
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--port", type=int, default=8025)
+    args = parser.parse_args()
+
+    controller, handler = start_sink(args.port)
+    try:
+        messages = build_messages(args.messages)
+        pool = SmtpConnectionPool("127.0.0.1", args.port, USERNAME, PASSWORD, use_tls=False, size=1, max_messages=0)
+        cases = [
+            ("connection per message", lambda: connection_per_message(args.port, messages)),
+            ("pool, one by one", lambda: pooled_one_by_one(pool, messages)),
+            (f"pool, batches of {args.batch_size}", lambda: pooled_batches(pool, messages, args.batch_size)),
+        ]
+        print(f"{len(messages)} messages of {len(messages[0][2])} bytes")
+        baseline = None
+        for name, run in cases:
+            received = handler.received
+            started = time.perf_counter()
+            run()
+            seconds = time.perf_counter() - started
+            assert handler.received - received == len(messages), "sink did not receive every message"
+            rate = len(messages) / seconds
+            baseline = baseline or rate
+            print(f"  {name:28s} {rate:9.0f} msg/s  ({rate / baseline:.1f}x)")
+        pool.close()
+    finally:
+        controller.stop()
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,124 @@
 # db.py
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from config import (
+    DB_URL, DB_ASYNC_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE,
+    DB_CONNECT_TIMEOUT, DB_ECHO, SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS,
+    SQLITE_BUSY_TIMEOUT, SQLITE_MMAP_SIZE, SQLITE_CACHE_SIZE
+)
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 db_path = os.path.join(BASE_DIR, "test.db")
-DATABASE_URL = f"sqlite:///{db_path}"
+DATABASE_URL = DB_URL or f"sqlite:///{db_path}"
 
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False},
-)
+SQLITE_JOURNAL_MODES = {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"}
+SQLITE_SYNCHRONOUS_MODES = {"OFF", "NORMAL", "FULL", "EXTRA"}
+
+def is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    journal_mode = SQLITE_JOURNAL_MODE.upper()
+    synchronous = SQLITE_SYNCHRONOUS.upper()
+    if journal_mode not in SQLITE_JOURNAL_MODES:
+        raise ValueError(f"Invalid sqlite_journal_mode: {SQLITE_JOURNAL_MODE}")
+    if synchronous not in SQLITE_SYNCHRONOUS_MODES:
+        raise ValueError(f"Invalid sqlite_synchronous: {SQLITE_SYNCHRONOUS}")
+
+    cursor = dbapi_connection.cursor()
+    try:
+        # WAL lets the dashboard keep reading while uploads and decisions write
+        cursor.execute(f"PRAGMA journal_mode={journal_mode}")
+        cursor.execute(f"PRAGMA synchronous={synchronous}")
+        cursor.execute(f"PRAGMA busy_timeout={int(SQLITE_BUSY_TIMEOUT)}")
+        cursor.execute(f"PRAGMA mmap_size={int(SQLITE_MMAP_SIZE)}")
+        cursor.execute(f"PRAGMA cache_size={int(SQLITE_CACHE_SIZE)}")
+    finally:
+        cursor.close()
+
+# Async drivers for the request handlers that use AsyncSession
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+def get_async_url(url: str = DATABASE_URL) -> str:
+    if DB_ASYNC_URL:
+        return DB_ASYNC_URL
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for database backend '{backend}', set async_url")
+    return parsed.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+def pool_args(url: str) -> dict:
+    # In-memory SQLite lives in a single connection, no pool to size
+    if is_sqlite(url) and make_url(url).database in (None, "", ":memory:"):
+        return {}
+    args = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+    }
+    if not is_sqlite(url):
+        args.update(pool_recycle=DB_POOL_RECYCLE, pool_pre_ping=True)
+    return args
+
+def build_engine(url: str = DATABASE_URL):
+    if is_sqlite(url):
+        engine = create_engine(
+            url,
+            echo=DB_ECHO,
+            connect_args={
+                "check_same_thread": False,
+                "timeout": SQLITE_BUSY_TIMEOUT / 1000,
+            },
+            **pool_args(url),
+        )
+        event.listen(engine, "connect", apply_sqlite_pragmas)
+        return engine
+
+    # Database server (PostgreSQL etc.) - real connection pool
+    return create_engine(
+        url,
+        echo=DB_ECHO,
+        connect_args={"connect_timeout": DB_CONNECT_TIMEOUT},
+        **pool_args(url),
+    )
+
+def build_async_engine(url: str = None):
+    url = url or get_async_url()
+    if is_sqlite(url):
+        engine = create_async_engine(
+            url,
+            echo=DB_ECHO,
+            connect_args={"timeout": SQLITE_BUSY_TIMEOUT / 1000},
+            **pool_args(url),
+        )
+        event.listen(engine.sync_engine, "connect", apply_sqlite_pragmas)
+        return engine
+
+    return create_async_engine(
+        url,
+        echo=DB_ECHO,
+        connect_args={"timeout": DB_CONNECT_TIMEOUT},
+        **pool_args(url),
+    )
+
+engine = build_engine()
+async_engine = build_async_engine()
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False: attributes stay readable after commit without an implicit (sync) reload
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 def init_db():
     from models import Person, Application, File, Notification
+    from migrations import run_migrations
     Base.metadata.create_all(bind=engine)
+    # Bring databases created by older versions up to the current schema
+    run_migrations(engine)
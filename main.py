@@ -1,4 +1,6 @@
 import os
+import math
+import asyncio
 import time
 import sass
 import logging
@@ -11,24 +13,26 @@ from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
 from routes.admin import router as admin_router
 from db import init_db
-from routes.utils import get_db, get_current_user 
+from routes.utils import get_db, get_current_user, rate_limit_account
 from routes.auth import router as auth_router
 from routes.dashboard import router as dashboard_router
 from routes.loan import router as loan_router
 from routes.files import router as files_router
 from routes.about_us import router as about_us_router
 from routes.home import router as home_router
+from services.password_hasher import password_hasher, PasswordHasherBusy
+from services.rate_limiter import RateLimitMiddleware, rate_limiter
+from services.reset_tokens import purge_reset_tokens_periodically
+from services.decision_rules import decision_rules, reload_decision_rules_periodically
+from services.credit_scores import credit_scores, CreditScoreUnavailable
+from services.log_pipeline import setup_logging
+from services.email_service import email_service
+from services.email_outbox import email_outbox, purge_email_outbox_periodically
+from config import RESET_TOKEN_PURGE_INTERVAL, DECISION_RULES_RELOAD_INTERVAL, EMAIL_OUTBOX_PURGE_INTERVAL
 from contextlib import asynccontextmanager
 
-# Configure logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler("app.log")
-    ]
-)
+# Configure logging: level, file and sampling from App.ini, written by a background thread
+log_listener = setup_logging()
 logger = logging.getLogger(__name__)
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -74,6 +78,19 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         logger.error(f"Database initialization error: {str(e)}")
     
+    # Compile the decision rules now; an invalid [DECISION_RULES] section stops the start
+    decision_rules.reload(force=True)
+    
+    # Inline CSS into and compile the email templates once, before the first mail
+    try:
+        email_service.precompile()
+    except Exception as e:
+        logger.error(f"Email template compilation error: {str(e)}")
+    
+    # Pick the bcrypt cost for this machine when configured as "auto"
+    if password_hasher.auto_rounds:
+        password_hasher.calibrate()
+    
     # Compile SCSS to CSS
     if os.path.exists(SASS_IN):
         try:
@@ -86,15 +103,37 @@ async def lifespan(app: FastAPI):
     scss_observer = start_scss_watcher()
     logger.info("SCSS watcher started")
     
+    # Remove expired password reset tokens in the background
+    reset_token_purge = asyncio.create_task(purge_reset_tokens_periodically(RESET_TOKEN_PURGE_INTERVAL))
+    # Pick up changed decision rules from App.ini without a restart
+    decision_rules_reload = asyncio.create_task(reload_decision_rules_periodically(DECISION_RULES_RELOAD_INTERVAL))
+    
+    # Send queued emails; without SMTP they stay in the outbox until it is configured
+    if email_service.is_configured:
+        email_outbox.start()
+    email_outbox_purge = asyncio.create_task(purge_email_outbox_periodically(EMAIL_OUTBOX_PURGE_INTERVAL))
+    
     yield  # This is where the application runs
     
     # Shutdown code - this runs when the application stops
     logger.info("Shutting down application...")
     
+    reset_token_purge.cancel()
+    decision_rules_reload.cancel()
+    email_outbox_purge.cancel()
+    email_outbox.stop()
+    email_service.close()
+    
     if scss_observer:
         scss_observer.stop()
         scss_observer.join()
         logger.info("SCSS watcher stopped")
+    
+    password_hasher.executor.shutdown(wait=False)
+    await credit_scores.close()
+    
+    # Flush queued log records
+    log_listener.stop()
 
 # Create the FastAPI app with the lifespan context manager
 app = FastAPI(title="Kreditbank Application", lifespan=lifespan)
@@ -117,17 +156,17 @@ app.include_router(home_router)
 @app.get("/", response_class=HTMLResponse)
 def root(request: Request, db: Session = Depends(get_db)):
     # Check if user is logged in
-    user = get_current_user(request, db)
-    logger.debug(f"Root endpoint - User: {user.id if user else None}")
+    user = get_current_user(request, db, request.cookies.get("session_id"))
+    logger.debug("Root endpoint - User: %s", user.id if user else None)
     
     if user:
         # If user is admin or employee, redirect to dashboard
         if user.person_type in ["admin", "employee"]:
-            logger.debug(f"Redirecting admin/employee to dashboard")
+            logger.debug("Redirecting admin/employee to dashboard")
             return RedirectResponse(url="/dashboard", status_code=303)
         # If user is customer, redirect to home
         else:
-            logger.debug(f"Redirecting customer to home")
+            logger.debug("Redirecting customer to home")
             return RedirectResponse(url="/home", status_code=303)
     else:
         # For non-logged in users, redirect to home
@@ -150,10 +189,46 @@ async def server_error_exception_handler(request: Request, exc):
         {"request": request, "error_code": 500, "message": "Interner Serverfehler", "user": None}
     )
 
-# Add middleware to log all requests
-@app.middleware("http")
+@app.exception_handler(PasswordHasherBusy)
+async def password_hasher_busy_handler(request: Request, exc):
+    # Login burst: answer right away instead of queueing without bound
+    return templates.TemplateResponse(
+        "error.html",
+        {"request": request, "error_code": 503, "message": "Zu viele Anfragen gleichzeitig. Bitte versuchen Sie es in Kürze erneut.", "user": None},
+        status_code=503,
+        headers={"Retry-After": "1"}
+    )
+
+@app.exception_handler(CreditScoreUnavailable)
+async def credit_score_unavailable_handler(request: Request, exc):
+    # No Bonität, no decision: the customer can simply submit again later
+    return templates.TemplateResponse(
+        "error.html",
+        {"request": request, "error_code": 503, "message": "Die Bonitätsprüfung ist derzeit nicht erreichbar. Bitte versuchen Sie es später erneut.", "user": None},
+        status_code=503,
+        headers={"Retry-After": "30"}
+    )
+
+def rate_limited_response(request: Request, retry_after: float):
+    return templates.TemplateResponse(
+        "error.html",
+        {"request": request, "error_code": 429, "message": "Zu viele Versuche. Bitte warten Sie einen Moment und versuchen Sie es erneut.", "user": None},
+        status_code=429,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+    )
+
+# Throttle login, registration, password reset and loan submission
+app.add_middleware(
+    RateLimitMiddleware,
+    limiter=rate_limiter,
+    on_limited=rate_limited_response,
+    account_resolver=rate_limit_account
+)
+
+# Request tracing. Only installed when debug logging is on, since the
+# middleware itself costs time on every request.
 async def log_requests(request: Request, call_next):
-    logger.debug(f"Request: {request.method} {request.url}")
+    logger.debug("Request: %s %s", request.method, request.url)
     
     # Log cookies (partially redacted for security)
     cookies = request.cookies
@@ -165,12 +240,15 @@ async def log_requests(request: Request, call_next):
         else:
             safe_cookies[key] = value
     
-    logger.debug(f"Request cookies: {safe_cookies}")
+    logger.debug("Request cookies: %s", safe_cookies)
     
     # Process the request
     response = await call_next(request)
     
     # Log the response status
-    logger.debug(f"Response status: {response.status_code}")
+    logger.debug("Response status: %s", response.status_code)
     
-    return response
\ No newline at end of file
+    return response
+
+if logger.isEnabledFor(logging.DEBUG):
+    app.middleware("http")(log_requests)
\ No newline at end of file
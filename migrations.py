@@ -0,0 +1,236 @@
+# migrations.py
+import sqlite3
+import hashlib
+import logging
+from datetime import datetime
+from sqlalchemy import inspect, text
+
+logger = logging.getLogger(__name__)
+
+# create_all() only creates missing tables, it never touches tables that already
+# exist. Every schema change to an existing table (new index, new column) is
+# therefore added here as a numbered migration. Migrations run in order, once,
+# and must be safe to run against a database that create_all() just built.
+#
+# Long-running data migrations (e.g. moving file blobs out of the database) run
+# on startup too; to run them ahead of a deploy use: python migrations.py
+
+def _create_hot_path_indexes(conn):
+    statements = [
+        "CREATE INDEX IF NOT EXISTS ix_person_person_type ON person (person_type)",
+        "CREATE INDEX IF NOT EXISTS ix_applications_created_at ON applications (created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_applications_person_created ON applications (person_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_applications_status_created ON applications (status, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_applications_handler_created ON applications (handled_by_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_files_application_id ON files (application_id)",
+        "CREATE INDEX IF NOT EXISTS ix_files_person_id ON files (person_id)",
+        "CREATE INDEX IF NOT EXISTS ix_notifications_recipient_unread ON notifications (recipient_id, is_read, created_at)",
+    ]
+    for statement in statements:
+        conn.execute(text(statement))
+
+def _iter_sqlite_blob(raw_conn, rowid, chunk_size):
+    # Incremental blob I/O: never holds the whole document in memory
+    with raw_conn.blobopen("files", "file_data", rowid, readonly=True) as blob:
+        while True:
+            chunk = blob.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+def _move_file_blobs_to_storage(conn):
+    from services.file_storage import file_storage, CHUNK_SIZE
+
+    columns = {c["name"] for c in inspect(conn).get_columns("files")}
+    if "file_data" not in columns:
+        # Created by a version that already keeps documents in the file store
+        return
+
+    if "sha256" not in columns:
+        conn.execute(text("ALTER TABLE files ADD COLUMN sha256 VARCHAR(64)"))
+
+    is_sqlite = conn.dialect.name == "sqlite"
+    raw_conn = conn.connection.driver_connection
+    ids = conn.execute(text(
+        "SELECT id FROM files WHERE sha256 IS NULL AND file_data IS NOT NULL ORDER BY id"
+    )).scalars().all()
+
+    for count, file_id in enumerate(ids, start=1):
+        if is_sqlite and hasattr(raw_conn, "blobopen"):
+            stored = file_storage.save(_iter_sqlite_blob(raw_conn, file_id, CHUNK_SIZE))
+        else:
+            data = conn.execute(text("SELECT file_data FROM files WHERE id = :id"), {"id": file_id}).scalar()
+            stored = file_storage.save_bytes(bytes(data))
+        conn.execute(text("UPDATE files SET sha256 = :sha256 WHERE id = :id"),
+                     {"sha256": stored.sha256, "id": file_id})
+        if count % 100 == 0:
+            logger.info(f"Moved {count}/{len(ids)} file blobs to storage")
+
+    # Drop the blob column. SQLite cannot drop a NOT NULL column in place, so rebuild the table.
+    if is_sqlite:
+        conn.execute(text(
+            "CREATE TABLE files_new ("
+            "id INTEGER NOT NULL PRIMARY KEY, "
+            "file_name VARCHAR NOT NULL, "
+            "file_type VARCHAR NOT NULL, "
+            "sha256 VARCHAR(64) NOT NULL, "
+            "application_id INTEGER NOT NULL REFERENCES applications (id), "
+            "person_id INTEGER NOT NULL REFERENCES person (id))"
+        ))
+        conn.execute(text(
+            "INSERT INTO files_new (id, file_name, file_type, sha256, application_id, person_id) "
+            "SELECT id, file_name, file_type, sha256, application_id, person_id FROM files"
+        ))
+        conn.execute(text("DROP TABLE files"))
+        conn.execute(text("ALTER TABLE files_new RENAME TO files"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_files_id ON files (id)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_files_application_id ON files (application_id)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_files_person_id ON files (person_id)"))
+    else:
+        conn.execute(text("ALTER TABLE files DROP COLUMN file_data"))
+        conn.execute(text("ALTER TABLE files ALTER COLUMN sha256 SET NOT NULL"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_files_sha256 ON files (sha256)"))
+    logger.info(f"Moved {len(ids)} file blobs out of the database")
+
+def _add_file_metadata_columns(conn):
+    from services.file_storage import file_storage
+
+    columns = {c["name"] for c in inspect(conn).get_columns("files")}
+    if "size" not in columns:
+        conn.execute(text("ALTER TABLE files ADD COLUMN size INTEGER"))
+    if "uploaded_at" not in columns:
+        conn.execute(text("ALTER TABLE files ADD COLUMN uploaded_at TIMESTAMP"))
+
+    # Backfill sizes from the file store; the upload time of old files is unknown
+    rows = conn.execute(text("SELECT id, sha256 FROM files WHERE size IS NULL")).all()
+    for file_id, sha256 in rows:
+        try:
+            size = file_storage.size(sha256)
+        except (FileNotFoundError, ValueError):
+            logger.warning(f"File {file_id}: content {sha256} missing from file store")
+            continue
+        conn.execute(text("UPDATE files SET size = :size WHERE id = :id"), {"size": size, "id": file_id})
+
+def _add_person_role_version(conn):
+    columns = {c["name"] for c in inspect(conn).get_columns("person")}
+    if "role_version" not in columns:
+        conn.execute(text("ALTER TABLE person ADD COLUMN role_version INTEGER NOT NULL DEFAULT 0"))
+
+def _move_reset_tokens_to_own_table(conn):
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_password_reset_tokens_token_hash "
+        "ON password_reset_tokens (token_hash)"
+    ))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_password_reset_tokens_expires_at ON password_reset_tokens (expires_at)"
+    ))
+
+    columns = {c["name"] for c in inspect(conn).get_columns("person")}
+    if "reset_token" not in columns:
+        return
+
+    # Carry over links that are still valid, hashed like new tokens
+    rows = conn.execute(text(
+        "SELECT id, reset_token, reset_token_expiration FROM person "
+        "WHERE reset_token IS NOT NULL AND reset_token_expiration > :now"
+    ), {"now": datetime.now()}).all()
+    for person_id, token, expires_at in rows:
+        conn.execute(text(
+            "INSERT INTO password_reset_tokens (token_hash, person_id, expires_at) VALUES (:hash, :person_id, :expires_at)"
+        ), {"hash": hashlib.sha256(token.encode("utf-8")).hexdigest(), "person_id": person_id, "expires_at": expires_at})
+
+    conn.execute(text("DROP INDEX IF EXISTS ix_person_reset_token"))
+    if conn.dialect.name == "sqlite" and sqlite3.sqlite_version_info < (3, 35):
+        # No DROP COLUMN before SQLite 3.35; the columns stay, unused and empty
+        conn.execute(text("UPDATE person SET reset_token = NULL, reset_token_expiration = NULL"))
+    else:
+        conn.execute(text("ALTER TABLE person DROP COLUMN reset_token"))
+        conn.execute(text("ALTER TABLE person DROP COLUMN reset_token_expiration"))
+    logger.info(f"Moved {len(rows)} open password reset tokens to password_reset_tokens")
+
+def _add_application_score_inputs(conn):
+    columns = {c["name"] for c in inspect(conn).get_columns("applications")}
+    for name in ("available_income", "total_debt_payments", "collateral_value", "total_outstanding_debt"):
+        if name not in columns:
+            conn.execute(text(f"ALTER TABLE applications ADD COLUMN {name} FLOAT"))
+
+def _add_application_ruleset_version(conn):
+    columns = {c["name"] for c in inspect(conn).get_columns("applications")}
+    if "ruleset_version" not in columns:
+        conn.execute(text("ALTER TABLE applications ADD COLUMN ruleset_version VARCHAR(64)"))
+
+def _make_application_created_at_not_null(conn):
+    # Rows without a date sorted last in the dashboard (NULL is smallest in
+    # SQLite); the earliest possible date keeps them there
+    backfilled = conn.execute(text(
+        "UPDATE applications SET created_at = :epoch WHERE created_at IS NULL"
+    ), {"epoch": datetime(1970, 1, 1)}).rowcount
+    if backfilled:
+        logger.warning(f"Set created_at of {backfilled} applications without one to 1970-01-01")
+
+    if conn.dialect.name == "sqlite":
+        # SQLite can't add NOT NULL to an existing column without rebuilding
+        # the table, the triggers enforce it instead
+        for event in ("INSERT", "UPDATE OF created_at"):
+            name = "trg_applications_created_at_" + event.split()[0].lower()
+            conn.execute(text(
+                f"CREATE TRIGGER IF NOT EXISTS {name} BEFORE {event} ON applications "
+                "WHEN NEW.created_at IS NULL "
+                "BEGIN SELECT RAISE(ABORT, 'applications.created_at may not be NULL'); END"
+            ))
+    else:
+        conn.execute(text("ALTER TABLE applications ALTER COLUMN created_at SET NOT NULL"))
+
+# (version, description, function) - append only, never renumber
+MIGRATIONS = [
+    (1, "Indexes for hot query predicates", _create_hot_path_indexes),
+    (2, "Move file blobs into the content-addressed file store", _move_file_blobs_to_storage),
+    (3, "Store file size and upload time as columns", _add_file_metadata_columns),
+    (4, "Role version for signed session tokens", _add_person_role_version),
+    (5, "Hashed password reset tokens in their own table", _move_reset_tokens_to_own_table),
+    (6, "Keep DSCR/CCR inputs on applications", _add_application_score_inputs),
+    (7, "Record the decision ruleset on applications", _add_application_ruleset_version),
+    (8, "Applications always have a creation date", _make_application_created_at_not_null),
+]
+
+def _ensure_version_table(conn):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, "
+        "description VARCHAR NOT NULL, "
+        "applied_at TIMESTAMP NOT NULL)"
+    ))
+
+def get_schema_version(engine) -> int:
+    with engine.begin() as conn:
+        _ensure_version_table(conn)
+        version = conn.execute(text("SELECT MAX(version) FROM schema_migrations")).scalar()
+    return version or 0
+
+def run_migrations(engine, target_version: int = None) -> int:
+    current = get_schema_version(engine)
+    applied = 0
+
+    for version, description, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        if target_version is not None and version > target_version:
+            break
+
+        # Each migration commits together with its version row
+        with engine.begin() as conn:
+            migrate(conn)
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, description, applied_at) VALUES (:v, :d, :t)"),
+                {"v": version, "d": description, "t": datetime.utcnow()}
+            )
+        logger.info(f"Applied migration {version}: {description}")
+        applied += 1
+
+    return applied
+
+if __name__ == "__main__":
+    from db import engine, init_db
+    logging.basicConfig(level=logging.INFO)
+    init_db()
+    print(f"Schema version is now {get_schema_version(engine)}")
@@ -1,5 +1,5 @@
 # models.py
-from sqlalchemy import Column, Float, Integer, String, ForeignKey, LargeBinary, DateTime, Boolean
+from sqlalchemy import Column, Float, Integer, String, ForeignKey, DateTime, Boolean, Index
 from sqlalchemy.orm import relationship
 from db import Base
 from datetime import datetime
@@ -17,11 +17,11 @@ class Person(Base):
     zip_code = Column(String, nullable=False)
     city = Column(String, nullable=False)
     country = Column(String, nullable=False)
-    person_type = Column(String, nullable=False)  # admin / employee / customer
+    person_type = Column(String, nullable=False, index=True)  # admin / employee / customer
     email = Column(String, unique=True, nullable=False)
     password_hash = Column(String, nullable=False)
-    reset_token = Column(String, nullable=True)
-    reset_token_expiration = Column(DateTime, nullable=True)
+    # Bumped on role changes; signed session tokens issued before are revoked
+    role_version = Column(Integer, nullable=False, default=0, server_default="0")
 
     # A Person can have many Applications
     applications = relationship(
@@ -41,6 +41,13 @@ class Person(Base):
 
 class Application(Base):
     __tablename__ = "applications"
+    __table_args__ = (
+        # Customer dashboard: own applications, newest first
+        Index("ix_applications_person_created", "person_id", "created_at"),
+        # Staff dashboard filters combined with the (created_at, id) keyset
+        Index("ix_applications_status_created", "status", "created_at"),
+        Index("ix_applications_handler_created", "handled_by_id", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     person_id = Column(Integer, ForeignKey("person.id"), nullable=False)
@@ -50,7 +57,8 @@ class Application(Base):
     term_in_years = Column(Integer, nullable=False)
     repayment_amount = Column(Integer, nullable=True)
     status = Column(String, default="in_process")
-    created_at = Column(DateTime, default=datetime.utcnow)
+    # NOT NULL: the dashboard's keyset pagination uses it as the cursor
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
     decided_at = Column(DateTime, nullable=True)
     # The user who handled this request (admin or employee)
     handled_by_id = Column(Integer, ForeignKey("person.id"), nullable=True)
@@ -64,6 +72,13 @@ class Application(Base):
     manager_approved = Column(Boolean, nullable=True)  # True=approved, False=rejected, None=pending
     approval_note = Column(String, nullable=True)
     has_offer = Column(Boolean, default=False)
+    # Baudarlehen inputs behind dscr/ccr, kept so they can be recalculated
+    available_income = Column(Float, nullable=True)
+    total_debt_payments = Column(Float, nullable=True)
+    collateral_value = Column(Float, nullable=True)
+    total_outstanding_debt = Column(Float, nullable=True)
+    # Decision ruleset that scored the application (see decision_rulesets)
+    ruleset_version = Column(String(64), nullable=True)
     
     # Relationships
     person = relationship(
@@ -90,10 +105,13 @@ class File(Base):
     id = Column(Integer, primary_key=True, index=True)
     file_name = Column(String, nullable=False)
     file_type = Column(String, nullable=False)
-    file_data = Column(LargeBinary, nullable=False)
+    # Content lives in services.file_storage, keyed by this digest
+    sha256 = Column(String(64), nullable=False, index=True)
+    size = Column(Integer, nullable=True)
+    uploaded_at = Column(DateTime, default=datetime.utcnow)
 
-    application_id = Column(Integer, ForeignKey("applications.id"), nullable=False)
-    person_id = Column(Integer, ForeignKey("person.id"), nullable=False)
+    application_id = Column(Integer, ForeignKey("applications.id"), nullable=False, index=True)
+    person_id = Column(Integer, ForeignKey("person.id"), nullable=False, index=True)
 
     # Relationship back to Application
     application = relationship("Application", back_populates="files")
@@ -102,8 +120,19 @@ class File(Base):
     person = relationship("Person", back_populates="files")
 
 
+# Columns needed to list files; listings never have to touch the file store
+FILE_METADATA_COLUMNS = (
+    File.id, File.file_name, File.file_type, File.size,
+    File.uploaded_at, File.sha256, File.application_id, File.person_id
+)
+
+
 class Notification(Base):
     __tablename__ = "notifications"
+    __table_args__ = (
+        # Unread notifications per recipient, newest first
+        Index("ix_notifications_recipient_unread", "recipient_id", "is_read", "created_at"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     recipient_id = Column(Integer, ForeignKey("person.id"), nullable=False)
@@ -122,4 +151,76 @@ Person.received_notifications = relationship(
     "Notification", 
     foreign_keys="[Notification.recipient_id]", 
     back_populates="recipient"
-)
\ No newline at end of file
+)
+
+
+class UserSession(Base):
+    __tablename__ = "sessions"
+
+    id = Column(String(64), primary_key=True)
+    person_id = Column(Integer, ForeignKey("person.id"), nullable=False, index=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class SessionRevocation(Base):
+    # Revoked signed session tokens: a single token (logout) or every token of
+    # a person below a role version (role change). Rows are only needed until
+    # the revoked tokens would have expired anyway.
+    __tablename__ = "session_revocations"
+
+    id = Column(Integer, primary_key=True)
+    token_id = Column(String(32), nullable=True)
+    person_id = Column(Integer, ForeignKey("person.id"), nullable=True)
+    role_version = Column(Integer, nullable=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class RateLimitBucket(Base):
+    # Shared token buckets for the "database" rate limit backend
+    __tablename__ = "rate_limit_buckets"
+
+    bucket_key = Column(String(255), primary_key=True)
+    tokens = Column(Float, nullable=False)
+    updated_at = Column(Float, nullable=False, index=True)  # epoch seconds
+
+
+class PasswordResetToken(Base):
+    # Only the SHA-256 of the token is stored; the token itself is in the
+    # e-mailed link. A row is deleted when used, expired rows are purged.
+    __tablename__ = "password_reset_tokens"
+
+    id = Column(Integer, primary_key=True)
+    token_hash = Column(String(64), nullable=False, unique=True, index=True)
+    person_id = Column(Integer, ForeignKey("person.id"), nullable=False, index=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class DecisionRuleset(Base):
+    # Thresholds behind every ruleset version that has been in use
+    __tablename__ = "decision_rulesets"
+
+    version = Column(String(64), primary_key=True)
+    thresholds = Column(String, nullable=False)  # JSON
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class EmailOutbox(Base):
+    # Mails waiting for delivery. A row is added in the same transaction as
+    # the change it reports and sent by the outbox workers; next_attempt_at is
+    # also the lease of the worker currently sending it.
+    __tablename__ = "email_outbox"
+    __table_args__ = (
+        Index("ix_email_outbox_status_next_attempt", "status", "next_attempt_at"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    to_address = Column(String(255), nullable=False)
+    subject = Column(String(255), nullable=False)
+    template = Column(String(64), nullable=False)
+    context = Column(String, nullable=True)  # JSON, cleared once sent
+    status = Column(String(16), nullable=False, default="pending")  # pending, sent, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    last_error = Column(String(500), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
@@ -3,7 +3,8 @@ from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
 
-from routes.utils import get_db, require_login
+from routes.utils import get_db, require_login, change_role, revoke_role_sessions
+from services.identity_cache import UserIdentity
 from models import Person
 
 router = APIRouter()
@@ -13,7 +14,7 @@ templates = Jinja2Templates(directory="templates")
 def admin_user_list(
     request: Request,
     db: Session = Depends(get_db),
-    user: Person = Depends(require_login)
+    user: UserIdentity = Depends(require_login)
 ):
     # Only an admin can manage other users
     if user.person_type != "admin":
@@ -35,7 +36,7 @@ def update_role(
     person_id: int = Form(...),
     new_role: str = Form(...),
     db: Session = Depends(get_db),
-    user: Person = Depends(require_login)
+    user: UserIdentity = Depends(require_login)
 ):
     if user.person_type != "admin":
         return RedirectResponse(url="/dashboard", status_code=303)
@@ -49,8 +50,9 @@ def update_role(
         return RedirectResponse(url="/admin/users", status_code=303)
 
     # Update role
-    person.person_type = new_role
+    change_role(person, new_role)
     db.commit()
     db.refresh(person)
+    revoke_role_sessions(person)
 
     return RedirectResponse(url="/admin/users", status_code=303)
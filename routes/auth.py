@@ -1,15 +1,18 @@
-import bcrypt
-import secrets
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime
 from fastapi import APIRouter, Request, Form, Depends, HTTPException
 from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
+from sqlalchemy import delete, func, select
 from sqlalchemy.orm import Session
-import uuid
-from models import Person
-from routes.utils import get_db, create_session_cookie, clear_session_cookie, sessions
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from models import Person, PasswordResetToken
+from routes.utils import get_db, get_async_db, create_session_cookie, clear_session_cookie, clear_session, forget_identity
 from services.email_service import email_service
+from services.email_outbox import enqueue_email
+from services.password_hasher import password_hasher, PasswordHasherBusy
+from services.reset_tokens import issue_reset_token, reset_token_query
 logger = logging.getLogger(__name__)
 
 
@@ -22,7 +25,7 @@ def get_register(request: Request):
     return templates.TemplateResponse("register.html", {"request": request, "user": None})
 
 @router.post("/register", response_class=HTMLResponse)
-def post_register(
+async def post_register(
     request: Request,
     salutation: str = Form(...),
     title: str = Form(""),
@@ -35,12 +38,12 @@ def post_register(
     country: str = Form(...),
     email: str = Form(...),
     password: str = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     logger.info(f"Registration attempt for email: {email}")
     
     # Check if email already exists
-    existing = db.query(Person).filter_by(email=email).first()
+    existing = (await db.execute(select(Person).where(Person.email == email))).scalars().first()
     if existing:
         logger.warning(f"Registration failed: Email {email} already exists")
         return templates.TemplateResponse(
@@ -49,7 +52,7 @@ def post_register(
         )
 
     # Count how many users we already have
-    count_users = db.query(Person).count()
+    count_users = await db.scalar(select(func.count(Person.id)))
     if count_users == 0:
         # first user => admin
         person_type = "admin"
@@ -59,7 +62,9 @@ def post_register(
 
     # Hash password
     try:
-        hashed_pw = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt())
+        hashed_pw = await password_hasher.hash(password)
+    except PasswordHasherBusy:
+        raise
     except Exception as e:
         logger.error(f"Password hashing error: {str(e)}")
         return templates.TemplateResponse(
@@ -80,35 +85,27 @@ def post_register(
         country=country,
         person_type=person_type,
         email=email,
-        password_hash=hashed_pw.decode("utf-8")
+        password_hash=hashed_pw
     )
     
     try:
         db.add(new_person)
-        db.commit()
-        db.refresh(new_person)
+        # Welcome email goes out with the account, or not at all
+        enqueue_email(db, email_service.welcome_email(to_address=email, first_name=first_name))
+        await db.commit()
+        await db.refresh(new_person)
         logger.info(f"User registered successfully: {new_person.id} (type: {person_type})")
     except Exception as e:
         logger.error(f"Database error during registration: {str(e)}")
-        db.rollback()
+        await db.rollback()
         return templates.TemplateResponse(
             "register.html",
             {"request": request, "error": "Datenbankfehler. Bitte versuchen Sie es später erneut.", "user": None}
         )
 
-    # Send welcome email
-    try:
-        email_service.send_welcome_email(
-            to_address=email,
-            first_name=first_name
-        )
-        logger.info(f"Welcome email sent to {email}")
-    except Exception as e:
-        logger.error(f"Failed to send welcome email: {str(e)}")
-
     # Create response and session
     response = RedirectResponse(url="/", status_code=303)
-    create_session_cookie(response, new_person.id)
+    await run_in_threadpool(create_session_cookie, response, new_person.id, new_person.role_version)
     
     cookie_value = response.headers.get("set-cookie", "")
     logger.debug(f"Registration cookie header: {cookie_value}")
@@ -120,22 +117,19 @@ def get_login(request: Request):
     return templates.TemplateResponse("login.html", {"request": request, "user": None})
 
 @router.post("/login", response_class=HTMLResponse)
-def post_login(
+async def post_login(
     request: Request,
     email: str = Form(...),
     password: str = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     logger.info(f"Login attempt for email: {email}")
     
-    # Clear existing sessions for debugging
-    session_id = request.cookies.get("session_id")
-    if session_id and session_id in sessions:
-        logger.debug(f"Removing existing session on login: {session_id}")
-        del sessions[session_id]
+    # Drop the session this browser had before logging in again
+    await run_in_threadpool(clear_session, request)
     
     # Find the user
-    person = db.query(Person).filter_by(email=email).first()
+    person = (await db.execute(select(Person).where(Person.email == email))).scalars().first()
     if not person:
         logger.warning(f"Login failed: User with email {email} not found")
         return templates.TemplateResponse(
@@ -145,13 +139,15 @@ def post_login(
 
     # Check password
     try:
-        pw_matched = bcrypt.checkpw(password.encode("utf-8"), person.password_hash.encode("utf-8"))
+        pw_matched = await password_hasher.verify(password, person.password_hash)
         if not pw_matched:
             logger.warning(f"Login failed: Incorrect password for user {email}")
             return templates.TemplateResponse(
                 "login.html",
                 {"request": request, "error": "Passwort oder E-Mail-Adresse falsch.", "user": None}
             )
+    except PasswordHasherBusy:
+        raise
     except Exception as e:
         logger.error(f"Password check error for {email}: {str(e)}")
         return templates.TemplateResponse(
@@ -161,36 +157,24 @@ def post_login(
 
     # Login successful
     logger.info(f"Login successful for user {person.id} ({email}), type: {person.person_type}")
+
+    # Upgrade hashes made with an older bcrypt cost while we have the password
+    if password_hasher.needs_rehash(person.password_hash):
+        try:
+            person.password_hash = await password_hasher.hash(password)
+            await db.commit()
+            logger.info(f"Rehashed password of user {person.id} with cost {password_hasher.rounds}")
+        except Exception as e:
+            # The login itself succeeded, try again next time
+            logger.warning(f"Password rehash skipped for user {person.id}: {str(e)}")
+            await db.rollback()
     
     # Create a response that redirects to root
     response = RedirectResponse(url="/", status_code=303)
-    
-    # Create a session directly here for debugging
-    session_id = str(uuid.uuid4())
-    expires = datetime.now() + timedelta(days=7)
-    
-    # Store session
-    sessions[session_id] = {
-        "user_id": person.id,
-        "expires": expires
-    }
-    
-    # Format for HTTP
-    http_expires = expires.strftime("%a, %d %b %Y %H:%M:%S GMT")
-    
-    # Set cookie directly
-    response.set_cookie(
-        key="session_id", 
-        value=session_id, 
-        httponly=True,
-        expires=http_expires,
-        path="/",
-        samesite="lax"
-    )
+    session_id = await run_in_threadpool(create_session_cookie, response, person.id, person.role_version)
     
     # Debug the cookie
     logger.debug(f"Login created session {session_id} for user {person.id}")
-    logger.debug(f"Sessions after login: {sessions}")
     cookie_value = response.headers.get("set-cookie", "")
     logger.debug(f"Login cookie header: {cookie_value}")
     
@@ -223,28 +207,22 @@ def post_forgot_password(
             {"request": request, "message": "Falls die E-Mail-Adresse in unserem System registriert ist, wurde eine E-Mail zum Zurücksetzen des Passworts gesendet.", "user": None}
         )
 
-    # Generate secure token
-    token = secrets.token_urlsafe(32)
-    person.reset_token = token
-    person.reset_token_expiration = datetime.now() + timedelta(hours=1)
-    db.commit()
-    logger.info(f"Password reset token generated for user {person.id}")
+    # Generate secure token, only its hash is stored
+    token = issue_reset_token(db, person.id)
 
     # Create reset URL
     host = request.headers.get("host", "localhost:8000")
     scheme = request.headers.get("x-forwarded-proto", "http")
     reset_link = f"{scheme}://{host}/reset_password?token={token}"
     
-    # Send password reset email
-    try:
-        email_service.send_password_reset_email(
-            to_address=person.email,
-            first_name=person.first_name,
-            reset_link=reset_link
-        )
-        logger.info(f"Password reset email sent to {email}")
-    except Exception as e:
-        logger.error(f"Failed to send password reset email: {str(e)}")
+    # Queue the password reset email with the token
+    enqueue_email(db, email_service.password_reset_email(
+        to_address=person.email,
+        first_name=person.first_name,
+        reset_link=reset_link
+    ))
+    db.commit()
+    logger.info(f"Password reset token generated and email queued for user {person.id}")
 
     return templates.TemplateResponse(
         "forgot_password.html",
@@ -252,66 +230,47 @@ def post_forgot_password(
     )
 
 @router.get("/reset_password", response_class=HTMLResponse)
-def get_reset_password(request: Request, token: str):
+def get_reset_password(request: Request, token: str, db: Session = Depends(get_db)):
     logger.info(f"Password reset page accessed with token: {token[:8]}...")
     
     # Validate token
-    db = next(get_db())
-    person = db.query(Person).filter_by(reset_token=token).first()
+    reset = db.execute(reset_token_query(token)).scalars().first()
     
-    if not person or not person.reset_token_expiration:
+    if not reset:
         logger.warning(f"Invalid reset token: {token[:8]}...")
         return templates.TemplateResponse(
             "reset_error.html", 
             {"request": request, "error": "Ungültiger oder abgelaufener Token", "user": None}
         )
     
-    now = datetime.now()
-    expiration = person.reset_token_expiration
-    
-    # Convert both to naive UTC datetimes if needed
-    if hasattr(now, 'tzinfo') and now.tzinfo:
-        now = now.replace(tzinfo=None)
-    if hasattr(expiration, 'tzinfo') and expiration.tzinfo:
-        expiration = expiration.replace(tzinfo=None)
-        
-    if now > expiration:
+    if datetime.now() > reset.expires_at:
         logger.warning(f"Expired reset token: {token[:8]}...")
         return templates.TemplateResponse(
             "reset_error.html", 
             {"request": request, "error": "Token abgelaufen", "user": None}
         )
     
-    logger.info(f"Valid reset token for user {person.id}")    
+    logger.info(f"Valid reset token for user {reset.person_id}")    
     return templates.TemplateResponse("reset_password.html", {"request": request, "token": token, "user": None})
 
 @router.post("/reset_password", response_class=HTMLResponse)
-def post_reset_password(
+async def post_reset_password(
     request: Request,
     token: str = Form(...),
     new_password: str = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     logger.info(f"Password reset attempt with token: {token[:8]}...")
     
-    person = db.query(Person).filter_by(reset_token=token).first()
-    if not person or not person.reset_token_expiration:
+    reset = (await db.execute(reset_token_query(token))).scalars().first()
+    if not reset:
         logger.warning(f"Invalid reset token on submit: {token[:8]}...")
         return templates.TemplateResponse(
             "reset_password.html",
             {"request": request, "error": "Ungültiger Token", "token": token, "user": None}
         )
 
-    now = datetime.now()
-    expiration = person.reset_token_expiration
-    
-    # Convert both to naive UTC datetimes if needed
-    if hasattr(now, 'tzinfo') and now.tzinfo:
-        now = now.replace(tzinfo=None)
-    if hasattr(expiration, 'tzinfo') and expiration.tzinfo:
-        expiration = expiration.replace(tzinfo=None)
-        
-    if now > expiration:
+    if datetime.now() > reset.expires_at:
         logger.warning(f"Expired reset token on submit: {token[:8]}...")
         return templates.TemplateResponse(
             "reset_password.html",
@@ -320,52 +279,33 @@ def post_reset_password(
 
     # Update password
     try:
-        hashed_pw = bcrypt.hashpw(new_password.encode("utf-8"), bcrypt.gensalt())
-        person.password_hash = hashed_pw.decode("utf-8")
-        person.reset_token = None
-        person.reset_token_expiration = None
-        db.commit()
-        logger.info(f"Password reset successful for user {person.id}")
-        
-        # Send confirmation email
-        try:
-            email_service.send_password_changed_email(
-                to_address=person.email,
-                first_name=person.first_name
+        person = await db.get(Person, reset.person_id)
+        person.password_hash = await password_hasher.hash(new_password)
+        # Single use: of two concurrent submits only the one deleting the row wins
+        claimed = (await db.execute(delete(PasswordResetToken).where(PasswordResetToken.id == reset.id))).rowcount
+        if not claimed:
+            await db.rollback()
+            logger.warning(f"Reset token already used: {token[:8]}...")
+            return templates.TemplateResponse(
+                "reset_password.html",
+                {"request": request, "error": "Ungültiger Token", "token": token, "user": None}
             )
-            logger.info(f"Password changed email sent to {person.email}")
-        except Exception as e:
-            logger.error(f"Failed to send password changed email: {str(e)}")
+        # Confirmation email
+        enqueue_email(db, email_service.password_changed_email(to_address=person.email, first_name=person.first_name))
+        await db.commit()
+        forget_identity(person.id)
+        logger.info(f"Password reset successful for user {person.id}")
         
         # Auto-login
         response = RedirectResponse(url="/dashboard", status_code=303)
         
-        # Create session directly
-        session_id = str(uuid.uuid4())
-        expires = datetime.now() + timedelta(days=7)
-        
-        # Store session
-        sessions[session_id] = {
-            "user_id": person.id,
-            "expires": expires
-        }
-        
-        # Format for HTTP
-        http_expires = expires.strftime("%a, %d %b %Y %H:%M:%S GMT")
-        
-        # Set cookie directly
-        response.set_cookie(
-            key="session_id", 
-            value=session_id, 
-            httponly=True,
-            expires=http_expires,
-            path="/",
-            samesite="lax"
-        )
+        session_id = await run_in_threadpool(create_session_cookie, response, person.id, person.role_version)
         
         logger.debug(f"Password reset: created session {session_id} for user {person.id}")
         return response
         
+    except PasswordHasherBusy:
+        raise
     except Exception as e:
         logger.error(f"Password reset error: {str(e)}")
         return templates.TemplateResponse(
@@ -2,21 +2,76 @@ import logging
 from fastapi import APIRouter, Request, Depends, Form, HTTPException, status
 from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, or_, select
+from sqlalchemy.orm import Session, selectinload, load_only
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 
-from models import Application, Person, Notification, File
-from routes.utils import get_db, require_login
+from models import Application, Person, Notification, File, FILE_METADATA_COLUMNS
+from routes.utils import get_db, get_async_db, require_login, require_login_async, change_role, revoke_role_sessions
+from services.identity_cache import UserIdentity
 from services.email_service import email_service
+from services.email_outbox import enqueue_email
 from services.calculations import LoanDecision
+from services.decision_rules import decision_rules
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 templates = Jinja2Templates(directory="templates")
 
-def process_application_for_display(app: Application, db: Session) -> Dict[str, Any]:
+# Staff dashboard pagination
+DASHBOARD_PAGE_SIZE = 50
+DASHBOARD_MAX_PAGE_SIZE = 200
+
+def with_display_relations(query):
+    # Eager-load everything process_application_for_display touches, so a page
+    # of applications costs a fixed number of queries instead of several per row
+    return query.options(
+        selectinload(Application.person),
+        selectinload(Application.handled_by),
+        selectinload(Application.files).load_only(*FILE_METADATA_COLUMNS),
+    )
+
+def safe_float(value) -> Optional[float]:
+    # Scores as stored: bonitaet is a string column, old rows may hold anything
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return None
+
+def queue_loan_status_email(db: Session, app: Application, reason: Optional[str]):
+    # Added to the caller's transaction; sent by the outbox workers after commit.
+    # A problem with the mail is logged, it must not cost the decision itself.
+    try:
+        person = db.query(Person).filter(Person.id == app.person_id).first()
+        if not person:
+            return
+        enqueue_email(db, email_service.loan_status_email(
+            to_address=person.email,
+            first_name=person.first_name,
+            application_date=app.created_at.strftime("%d.%m.%Y") if app.created_at else "",
+            loan_type=app.loan_type,
+            status=app.status,
+            reason=reason
+        ))
+        logger.info(f"Queued loan status email to {person.email}")
+    except Exception as e:
+        logger.error(f"Could not queue loan status email for application {app.id}: {str(e)}")
+
+async def get_manager_display_name(db: AsyncSession) -> Optional[str]:
+    # Manager decisions are attributed to the first manager on record
+    manager = (await db.execute(
+        select(Person).where(Person.person_type == "manager").order_by(Person.id).limit(1)
+    )).scalars().first()
+    if not manager:
+        return None
+    return f"{manager.first_name} {manager.second_name} (Manager)"
+
+def process_application_for_display(app: Application, manager_name: Optional[str] = None) -> Dict[str, Any]:
     # Map status to CSS classes for visual styling
     status_class_mapping = {
         "angenommen": "accepted",
@@ -46,19 +101,18 @@ def process_application_for_display(app: Application, db: Session) -> Dict[str,
     elif app.decision == "pending":
         decision_display = "Ausstehend"
     
-    # Get customer info
-    customer = db.query(Person).filter(Person.id == app.person_id).first()
+    # Get customer info (eager-loaded via with_display_relations)
+    customer = app.person
     customer_name = f"{customer.first_name} {customer.second_name}" if customer else "Unbekannt"
     
     # Get handler info if available
     handler_name = "Nicht zugewiesen"
-    if app.handled_by_id:
-        handler = db.query(Person).filter(Person.id == app.handled_by_id).first()
-        if handler:
-            handler_name = f"{handler.first_name} {handler.second_name}"
+    handler = app.handled_by
+    if handler:
+        handler_name = f"{handler.first_name} {handler.second_name}"
     
     # Get files
-    files = db.query(File).filter(File.application_id == app.id).all()
+    files = app.files
     
     # Determine if application needs manager approval based on thresholds
     needs_manager_approval = getattr(app, 'needs_manager_approval', False)
@@ -66,21 +120,9 @@ def process_application_for_display(app: Application, db: Session) -> Dict[str,
     # For employee view, check thresholds to show the appropriate buttons
     requires_manager_check = False
     if app.status == "in bearbeitung" and not needs_manager_approval:
-        if hasattr(app, 'bonitaet') and app.bonitaet is not None:
-            try:
-                boni_score = float(app.bonitaet)
-                if boni_score < 670:
-                    requires_manager_check = True
-            except (ValueError, TypeError):
-                pass
-        
-        if hasattr(app, 'dscr') and app.dscr is not None and not requires_manager_check:
-            try:
-                dscr = float(app.dscr)
-                if dscr < 1.4:
-                    requires_manager_check = True
-            except (ValueError, TypeError):
-                pass
+        requires_manager_check = decision_rules.current().needs_manager_approval(
+            safe_float(app.bonitaet), safe_float(app.dscr)
+        )
     
     # Check if the application is approved and an offer can be created
     is_approved = app.status == "angenommen"
@@ -90,14 +132,9 @@ def process_application_for_display(app: Application, db: Session) -> Dict[str,
     decision_maker_name = None
     if app.decided_at and app.handled_by_id:
         if app.manager_approved is not None:  # Manager made the decision
-            managers = db.query(Person).filter(Person.person_type == "manager").all()
-            for manager in managers:
-                decision_maker_name = f"{manager.first_name} {manager.second_name} (Manager)"
-                break
-        else:  # Employee made the decision
-            employee = db.query(Person).filter(Person.id == app.handled_by_id).first()
-            if employee:
-                decision_maker_name = f"{employee.first_name} {employee.second_name} (Mitarbeiter)"
+            decision_maker_name = manager_name
+        elif handler:  # Employee made the decision
+            decision_maker_name = f"{handler.first_name} {handler.second_name} (Mitarbeiter)"
     
     return {
         "id": app.id,
@@ -127,39 +164,144 @@ def process_application_for_display(app: Application, db: Session) -> Dict[str,
         "can_create_offer": can_create_offer
     }
 
-def get_unread_notifications(db: Session, user_id: int) -> List[Notification]:
-    return db.query(Notification).filter(
+async def get_unread_notifications(db: AsyncSession, user_id: int) -> List[Notification]:
+    result = await db.execute(select(Notification).where(
         Notification.recipient_id == user_id,
         Notification.is_read == False
-    ).order_by(Notification.created_at.desc()).all()
+    ).order_by(Notification.created_at.desc()))
+    return result.scalars().all()
+
+def encode_cursor(app: Application) -> str:
+    # Cursor is the (created_at, id) key of the last row on the page
+    return f"{app.created_at.isoformat()}_{app.id}"
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[datetime, int]]:
+    if not cursor:
+        return None
+    try:
+        created_at, app_id = cursor.rsplit("_", 1)
+        return datetime.fromisoformat(created_at), int(app_id)
+    except ValueError:
+        logger.warning(f"Ignoring malformed dashboard cursor: {cursor}")
+        return None
+
+def parse_dashboard_filters(
+    status: Optional[str],
+    loan_type: Optional[str],
+    needs_manager_approval: Optional[str],
+    handler_id: Optional[str]
+) -> Dict[str, Any]:
+    # Empty form fields mean "no filter"
+    filters = {}
+    if status:
+        filters["status"] = status
+    if loan_type:
+        filters["loan_type"] = loan_type
+    if needs_manager_approval in ("true", "false"):
+        filters["needs_manager_approval"] = needs_manager_approval == "true"
+    if handler_id:
+        if handler_id == "none":
+            filters["handler_id"] = None
+        elif handler_id.isdigit():
+            filters["handler_id"] = int(handler_id)
+    return filters
+
+def apply_dashboard_filters(query, filters: Dict[str, Any]):
+    if "status" in filters:
+        query = query.filter(Application.status == filters["status"])
+    if "loan_type" in filters:
+        query = query.filter(Application.loan_type == filters["loan_type"])
+    if "needs_manager_approval" in filters:
+        if filters["needs_manager_approval"]:
+            query = query.filter(Application.needs_manager_approval == True)
+        else:
+            query = query.filter(or_(
+                Application.needs_manager_approval == False,
+                Application.needs_manager_approval.is_(None)
+            ))
+    if "handler_id" in filters:
+        if filters["handler_id"] is None:
+            query = query.filter(Application.handled_by_id.is_(None))
+        else:
+            query = query.filter(Application.handled_by_id == filters["handler_id"])
+    return query
+
+async def get_application_page(
+    db: AsyncSession,
+    filters: Dict[str, Any],
+    cursor: Optional[str],
+    page_size: int
+) -> Tuple[List[Application], Optional[str]]:
+    # Keyset pagination over (created_at desc, id desc): each page seeks
+    # directly past the previous one, so the cost is bounded by page_size
+    query = apply_dashboard_filters(select(Application), filters)
+
+    key = decode_cursor(cursor)
+    if key:
+        created_at, app_id = key
+        query = query.filter(or_(
+            Application.created_at < created_at,
+            and_(Application.created_at == created_at, Application.id < app_id)
+        ))
+
+    rows = (await db.execute(with_display_relations(query).order_by(
+        Application.created_at.desc(),
+        Application.id.desc()
+    ).limit(page_size + 1))).scalars().all()
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(rows[-1])
+    return rows, next_cursor
+
+async def get_handler_options(db: AsyncSession) -> List[Dict[str, Any]]:
+    handlers = (await db.execute(select(Person).where(
+        Person.person_type.in_(["employee", "manager", "director"])
+    ).order_by(Person.second_name, Person.first_name))).scalars().all()
+    return [{"id": h.id, "name": f"{h.first_name} {h.second_name}"} for h in handlers]
 
 @router.get("/dashboard", response_class=HTMLResponse)
-def get_dashboard(
+async def get_dashboard(
     request: Request,
-    db: Session = Depends(get_db),
-    user: Person = Depends(require_login)
+    status: Optional[str] = None,
+    loan_type: Optional[str] = None,
+    needs_manager_approval: Optional[str] = None,
+    handler_id: Optional[str] = None,
+    cursor: Optional[str] = None,
+    page_size: int = DASHBOARD_PAGE_SIZE,
+    db: AsyncSession = Depends(get_async_db),
+    user: UserIdentity = Depends(require_login_async)
 ):
     try:
+        filters = {}
+        next_cursor = None
+        handler_options = []
+        page_size = max(1, min(page_size, DASHBOARD_MAX_PAGE_SIZE))
+
         # Get appropriate applications based on user type
         if user.person_type == "admin":
             # Admin sees all applications for reference but focuses on user management
             applications = []
-            users = db.query(Person).all()
+            users = (await db.execute(select(Person))).scalars().all()
         elif user.person_type in ["employee", "manager", "director"]:
-            # Staff see all applications
-            applications = db.query(Application).order_by(Application.created_at.desc()).all()
+            # Staff see one filtered page of applications at a time
+            filters = parse_dashboard_filters(status, loan_type, needs_manager_approval, handler_id)
+            applications, next_cursor = await get_application_page(db, filters, cursor, page_size)
+            handler_options = await get_handler_options(db)
             users = []
         else:  # customer
             # Customers only see their own applications
-            applications = db.query(Application).filter(
-                Application.person_id == user.id
-            ).order_by(Application.created_at.desc()).all()
+            applications = (await db.execute(with_display_relations(
+                select(Application).where(Application.person_id == user.id)
+            ).order_by(Application.created_at.desc()))).scalars().all()
             users = []
         
         # Process applications for display
         processed_apps = []
         if user.person_type != "admin":
-            processed_apps = [process_application_for_display(app, db) for app in applications]
+            manager_name = await get_manager_display_name(db)
+            processed_apps = [process_application_for_display(app, manager_name) for app in applications]
         
         # Process users for admin view
         processed_users = []
@@ -182,7 +324,7 @@ def get_dashboard(
                 })
         
         # Get unread notifications
-        notifications = get_unread_notifications(db, user.id)
+        notifications = await get_unread_notifications(db, user.id)
         
         # Render the appropriate dashboard template
         return templates.TemplateResponse(
@@ -193,7 +335,17 @@ def get_dashboard(
                 "applications": processed_apps,
                 "users": processed_users,
                 "notifications": notifications,
-                "unread_count": len(notifications)
+                "unread_count": len(notifications),
+                "filters": {
+                    "status": status or "",
+                    "loan_type": loan_type or "",
+                    "needs_manager_approval": needs_manager_approval or "",
+                    "handler_id": handler_id or ""
+                },
+                "handler_options": handler_options,
+                "is_first_page": not cursor,
+                "next_cursor": next_cursor,
+                "page_size": page_size
             }
         )
     except Exception as e:
@@ -209,7 +361,7 @@ def process_loan_decision(
     application_id: int = Form(...),
     decision: str = Form(...),
     db: Session = Depends(get_db),
-    user: Person = Depends(require_login)
+    user: UserIdentity = Depends(require_login)
 ):
     # Only employees can make loan decisions
     if user.person_type != "employee":
@@ -222,26 +374,10 @@ def process_loan_decision(
         logger.warning(f"Application {application_id} not found")
         raise HTTPException(status_code=404, detail="Antrag nicht gefunden")
 
-    # Check if application requires manager approval based on thresholds
-    needs_approval = False
-    
-    # Check boni score
-    if hasattr(app_obj, 'bonitaet') and app_obj.bonitaet is not None:
-        try:
-            boni_score = float(app_obj.bonitaet)
-            if boni_score < 670:
-                needs_approval = True
-        except (ValueError, TypeError):
-            pass
-    
-    # Check DSCR
-    if hasattr(app_obj, 'dscr') and app_obj.dscr is not None:
-        try:
-            dscr = float(app_obj.dscr)
-            if dscr < 1.4:
-                needs_approval = True
-        except (ValueError, TypeError):
-            pass
+    # Check if application requires manager approval under the current rules
+    needs_approval = decision_rules.current().needs_manager_approval(
+        safe_float(app_obj.bonitaet), safe_float(app_obj.dscr)
+    )
     
     # If needs approval, redirect to manager approval process instead
     if needs_approval:
@@ -270,25 +406,11 @@ def process_loan_decision(
     
     logger.info(f"Application {app_obj.id} decision by {user.id}: {app_obj.status}")
     
+    # Email notification, committed with the decision
+    queue_loan_status_email(db, app_obj, app_obj.reason)
+    
     db.commit()
     db.refresh(app_obj)
-    
-    # Send email notification
-    person = db.query(Person).filter(Person.id == app_obj.person_id).first()
-    if person:
-        try:
-            formatted_date = app_obj.created_at.strftime("%d.%m.%Y")
-            email_service.send_loan_status_email(
-                to_address=person.email,
-                first_name=person.first_name,
-                application_date=formatted_date,
-                loan_type=app_obj.loan_type,
-                status=app_obj.status,
-                reason=app_obj.reason
-            )
-            logger.info(f"Sent loan status email to {person.email}")
-        except Exception as e:
-            logger.error(f"Failed to send email notification: {str(e)}")
 
     return RedirectResponse(url="/dashboard", status_code=303)
 @router.post("/dashboard/update-user")
@@ -297,7 +419,7 @@ def update_user_role(
     user_id: int = Form(...),
     person_type: str = Form(...),
     db: Session = Depends(get_db),
-    admin: Person = Depends(require_login)
+    admin: UserIdentity = Depends(require_login)
 ):
     # Only admin can update user roles
     if admin.person_type != "admin":
@@ -317,9 +439,10 @@ def update_user_role(
         raise HTTPException(status_code=404, detail="Benutzer nicht gefunden")
         
     # Update user role
-    user_obj.person_type = person_type
+    change_role(user_obj, person_type)
     db.commit()
     db.refresh(user_obj)
+    revoke_role_sessions(user_obj)
     
     logger.info(f"User {user_id} role updated to {person_type} by admin {admin.id}")
 
@@ -331,7 +454,7 @@ def request_manager_approval_endpoint(
     request: Request,
     application_id: int = Form(...),
     db: Session = Depends(get_db),
-    user: Person = Depends(require_login)
+    user: UserIdentity = Depends(require_login)
 ):
     # Only employees can request manager approval
     if user.person_type != "employee":
@@ -396,7 +519,7 @@ def process_manager_decision(
     decision: str = Form(...),  # "approve" or "reject"
     notes: str = Form(""),
     db: Session = Depends(get_db),
-    user: Person = Depends(require_login)
+    user: UserIdentity = Depends(require_login)
 ):
     # Only managers can make approval decisions
     if user.person_type != "manager":
@@ -427,6 +550,10 @@ def process_manager_decision(
         app.decision = "rejected"
         app.decided_at = datetime.now()
     
+    # Email to the customer, committed with the decision
+    if app.status in ("angenommen", "abgelehnt"):
+        queue_loan_status_email(db, app, app.approval_note if not app.manager_approved else app.reason)
+    
     db.commit()
     db.refresh(app)
     
@@ -444,23 +571,6 @@ def process_manager_decision(
         db.add(notification)
         db.commit()
     
-    # Send email to customer
-    person = db.query(Person).filter(Person.id == app.person_id).first()
-    if person and (app.status == "angenommen" or app.status == "abgelehnt"):
-        try:
-            formatted_date = app.created_at.strftime("%d.%m.%Y")
-            email_service.send_loan_status_email(
-                to_address=person.email,
-                first_name=person.first_name,
-                application_date=formatted_date,
-                loan_type=app.loan_type,
-                status=app.status,
-                reason=app.approval_note if not app.manager_approved else app.reason
-            )
-            logger.info(f"Sent loan status email to {person.email}")
-        except Exception as e:
-            logger.error(f"Failed to send email notification: {str(e)}")
-    
     return RedirectResponse(url="/dashboard", status_code=303)
 
 @router.post("/dashboard/manager-decision")
@@ -470,7 +580,7 @@ def process_manager_decision(
     decision: str = Form(...),  # "approve" or "reject"
     notes: str = Form(""),
     db: Session = Depends(get_db),
-    user: Person = Depends(require_login)
+    user: UserIdentity = Depends(require_login)
 ):
     # Only managers can make approval decisions
     if user.person_type != "manager":
@@ -501,6 +611,10 @@ def process_manager_decision(
         app.status = "abgelehnt"
         app.decided_at = datetime.now()
     
+    # Email to the customer, committed with the decision
+    if app.status in ("angenommen", "abgelehnt"):
+        queue_loan_status_email(db, app, app.approval_note if not app.manager_approved else app.reason)
+    
     db.commit()
     db.refresh(app)
     
@@ -518,23 +632,6 @@ def process_manager_decision(
         db.add(notification)
         db.commit()
     
-    # Send email to customer if application status changed
-    person = db.query(Person).filter(Person.id == app.person_id).first()
-    if person and (app.status == "angenommen" or app.status == "abgelehnt"):
-        try:
-            formatted_date = app.created_at.strftime("%d.%m.%Y")
-            email_service.send_loan_status_email(
-                to_address=person.email,
-                first_name=person.first_name,
-                application_date=formatted_date,
-                loan_type=app.loan_type,
-                status=app.status,
-                reason=app.approval_note if not app.manager_approved else app.reason
-            )
-            logger.info(f"Sent loan status email to {person.email}")
-        except Exception as e:
-            logger.error(f"Failed to send email notification: {str(e)}")
-    
     return RedirectResponse(url="/dashboard", status_code=303)
 
 @router.post("/mark-notification-read")
@@ -542,7 +639,7 @@ def mark_notification_read(
     request: Request,
     notification_id: int = Form(...),
     db: Session = Depends(get_db),
-    user: Person = Depends(require_login)
+    user: UserIdentity = Depends(require_login)
 ):
     # Find the notification
     notification = db.query(Notification).filter(
@@ -567,7 +664,7 @@ def process_manager_decision(
     decision: str = Form(...),  # "approve" or "reject"
     notes: str = Form(""),
     db: Session = Depends(get_db),
-    user: Person = Depends(require_login)
+    user: UserIdentity = Depends(require_login)
 ):
     # Only managers can make approval decisions
     if user.person_type != "manager":
@@ -600,6 +697,10 @@ def process_manager_decision(
     # Save decision metadata
     app.decided_at = datetime.now()
     
+    # Email to the customer, committed with the decision
+    if app.status in ("angenommen", "abgelehnt"):
+        queue_loan_status_email(db, app, app.approval_note if not app.manager_approved else app.reason)
+    
     db.commit()
     db.refresh(app)
     
@@ -617,23 +718,6 @@ def process_manager_decision(
         db.add(notification)
         db.commit()
     
-    # Send email to customer
-    person = db.query(Person).filter(Person.id == app.person_id).first()
-    if person and (app.status == "angenommen" or app.status == "abgelehnt"):
-        try:
-            formatted_date = app.created_at.strftime("%d.%m.%Y")
-            email_service.send_loan_status_email(
-                to_address=person.email,
-                first_name=person.first_name,
-                application_date=formatted_date,
-                loan_type=app.loan_type,
-                status=app.status,
-                reason=app.approval_note if not app.manager_approved else app.reason
-            )
-            logger.info(f"Sent loan status email to {person.email}")
-        except Exception as e:
-            logger.error(f"Failed to send email notification: {str(e)}")
-    
     return RedirectResponse(url="/dashboard", status_code=303)
 
 @router.post("/dashboard/create-offer")
@@ -641,7 +725,7 @@ def create_offer(
     request: Request,
     application_id: int = Form(...),
     db: Session = Depends(get_db),
-    user: Person = Depends(require_login)
+    user: UserIdentity = Depends(require_login)
 ):
     # Only employees can create offers
     if user.person_type != "employee":
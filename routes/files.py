@@ -1,12 +1,20 @@
 import logging
-from typing import List
-from fastapi import APIRouter, Depends, Request, HTTPException, Form, UploadFile, File as FastAPIFile
-from fastapi.responses import JSONResponse, StreamingResponse, HTMLResponse
+from fastapi import APIRouter, Depends, Request, HTTPException
+from fastapi.responses import JSONResponse, HTMLResponse
 from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.orm import Session, load_only
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
 
-from models import Application, File, Person
-from routes.utils import get_db, require_login
+from db import SessionLocal
+from models import Application, File, Person, FILE_METADATA_COLUMNS
+from routes.utils import get_db, get_async_db, require_login, require_login_async
+from services.identity_cache import UserIdentity
+from services.file_storage import file_storage
+from services.blob_response import BlobResponse
+from services.upload_stream import parse_streamed_upload, UploadLimitError
+from config import UPLOAD_MAX_FILE_MB, UPLOAD_MAX_REQUEST_MB, UPLOAD_MAX_FILES, UPLOAD_CHUNK_KB
 
 logger = logging.getLogger(__name__)
 
@@ -17,7 +25,7 @@ templates = Jinja2Templates(directory="templates")
 def get_upload(
     request: Request,
     application_id: int,
-    user: Person = Depends(require_login),
+    user: UserIdentity = Depends(require_login),
     db: Session = Depends(get_db)
 ):
     logger.info(f"Upload page accessed for application {application_id} by user {user.id}")
@@ -32,8 +40,10 @@ def get_upload(
         logger.warning(f"User {user.id} tried to access application {application_id} belonging to user {app_obj.person_id}")
         raise HTTPException(status_code=403, detail="You don't have permission to access this application.")
 
-    # Get files associated with this application
-    files = db.query(File).filter_by(application_id=app_obj.id).all()
+    # Get files associated with this application (metadata only)
+    files = db.query(File).options(load_only(*FILE_METADATA_COLUMNS)).filter_by(
+        application_id=app_obj.id
+    ).order_by(File.id).all()
     logger.debug(f"Found {len(files)} files for application {application_id}")
     
     return templates.TemplateResponse(
@@ -47,74 +57,128 @@ def get_upload(
         }
     )
 
+def delete_unreferenced_blobs(digests):
+    # Content this request published but whose rows never got committed
+    with SessionLocal() as db:
+        for sha256 in set(digests):
+            file_storage.delete_unreferenced(
+                sha256, lambda: db.query(File.id).filter(File.sha256 == sha256).first() is not None
+            )
+
 @router.post("/upload_temp")
 async def upload_temp(
-    application_id: int = Form(...),
-    files: List[UploadFile] = FastAPIFile(...),
-    user: Person = Depends(require_login),
-    db: Session = Depends(get_db)
+    request: Request,
+    user: UserIdentity = Depends(require_login_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    logger.info(f"File upload attempt for application {application_id} by user {user.id}")
-    
-    app_obj = db.query(Application).filter(Application.id == application_id).first()
-    if not app_obj:
-        logger.warning(f"Application {application_id} not found during upload")
-        raise HTTPException(status_code=404, detail="Application not found.")
+    # The multipart body is parsed by hand so files stream to the file store
+    # instead of being buffered, and size limits apply while bytes arrive
+    try:
+        fields, files = await parse_streamed_upload(
+            request,
+            max_file_size=UPLOAD_MAX_FILE_MB * 1024 * 1024,
+            max_request_size=UPLOAD_MAX_REQUEST_MB * 1024 * 1024,
+            max_files=UPLOAD_MAX_FILES,
+            chunk_size=UPLOAD_CHUNK_KB * 1024
+        )
+    except UploadLimitError as e:
+        logger.warning(f"Upload by user {user.id} rejected: {str(e)}")
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        logger.warning(f"Malformed upload by user {user.id}: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        application_id = int(fields.get("application_id", ""))
+        logger.info(f"File upload attempt for application {application_id} by user {user.id}")
         
-    # Check if the user is authorized to upload to this application
-    if app_obj.person_id != user.id and user.person_type not in ["admin", "employee", "manager", "director"]:
-        logger.warning(f"User {user.id} tried to upload to application {application_id} belonging to user {app_obj.person_id}")
-        raise HTTPException(status_code=403, detail="You don't have permission to upload to this application.")
+        app_obj = await db.get(Application, application_id)
+        if not app_obj:
+            logger.warning(f"Application {application_id} not found during upload")
+            raise HTTPException(status_code=404, detail="Application not found.")
+            
+        # Check if the user is authorized to upload to this application
+        if app_obj.person_id != user.id and user.person_type not in ["admin", "employee", "manager", "director"]:
+            logger.warning(f"User {user.id} tried to upload to application {application_id} belonging to user {app_obj.person_id}")
+            raise HTTPException(status_code=403, detail="You don't have permission to upload to this application.")
+    except ValueError:
+        for upload in files:
+            await upload.discard()
+        raise HTTPException(status_code=400, detail="application_id is required.")
+    except HTTPException:
+        for upload in files:
+            await upload.discard()
+        raise
 
     new_files = []
-    for upload in files:
-        try:
-            file_data = await upload.read()
-            
-            # Log file details
-            logger.debug(f"Uploading file: {upload.filename}, size: {len(file_data)} bytes, type: {upload.content_type}")
-            
-            # Create file record
-            file_record = File(
-                file_name=upload.filename,
-                file_type=upload.content_type.lower(),
-                file_data=file_data,
-                person_id=user.id,
-                application_id=app_obj.id
-            )
+    published = []  # (upload, digest) for the files getting a row
+    orphaned = []   # digests published for files that got no row
+    try:
+        for upload in files:
+            stored = None
+            try:
+                # Log file details
+                logger.debug(f"Uploading file: {upload.filename}, size: {upload.size} bytes, type: {upload.content_type}")
+
+                # Publish the streamed content, the database only keeps the digest
+                stored = await upload.commit()
+
+                # Create file record
+                file_record = File(
+                    file_name=upload.filename,
+                    file_type=upload.content_type.lower(),
+                    sha256=stored.sha256,
+                    size=stored.size,
+                    person_id=user.id,
+                    application_id=app_obj.id
+                )
+            except Exception as e:
+                logger.error(f"Error uploading file {upload.filename}: {str(e)}")
+                await upload.discard()
+                if stored is not None:
+                    orphaned.append(stored.sha256)
+                continue
+            published.append((upload, stored.sha256))
+
+            # A failed flush leaves the session to be rolled back, which
+            # loses the earlier files as well, so it ends the whole upload
             db.add(file_record)
-            db.flush()  # Get ID without committing
-            
+            await db.flush()  # Get ID without committing
+
             # Add to list for response
             new_files.append({
-                "id": file_record.id, 
+                "id": file_record.id,
                 "file_name": file_record.file_name
             })
-            
-        except Exception as e:
-            logger.error(f"Error uploading file {upload.filename}: {str(e)}")
-            continue
 
-    try:
-        db.commit()
+        await db.commit()
         logger.info(f"Successfully uploaded {len(new_files)} files to application {application_id}")
     except Exception as e:
         logger.error(f"Database error during file upload: {str(e)}")
-        db.rollback()
+        await db.rollback()
+        for upload in files:
+            await upload.discard()
+        await run_in_threadpool(delete_unreferenced_blobs, orphaned + [sha256 for _, sha256 in published])
         raise HTTPException(status_code=500, detail="Error saving files to database")
 
+    # The rows are in, from now on a delete sees them
+    for upload, _ in published:
+        await upload.release()
+    if orphaned:
+        await run_in_threadpool(delete_unreferenced_blobs, orphaned)
+
     return JSONResponse({"files": new_files})
 
 @router.get("/download/{file_id}")
-def download_file(
+async def download_file(
     file_id: int,
     request: Request,
-    user: Person = Depends(require_login),
-    db: Session = Depends(get_db)
+    user: UserIdentity = Depends(require_login_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     logger.info(f"Download request for file {file_id} by user {user.id}")
     
-    file_record = db.query(File).filter(File.id == file_id).first()
+    file_record = await db.get(File, file_id)
     if not file_record:
         logger.warning(f"File {file_id} not found")
         raise HTTPException(status_code=404, detail="File not found.")
@@ -126,21 +190,25 @@ def download_file(
             logger.warning(f"User {user.id} tried to download file {file_id} belonging to user {file_record.person_id}")
             raise HTTPException(status_code=403, detail="You don't have permission to download this file.")
 
-    # Set headers for the download
-    headers = {"Content-Disposition": f'attachment; filename="{file_record.file_name}"'}
-    
     logger.debug(f"Serving file {file_id}: {file_record.file_name}, type: {file_record.file_type}")
     
-    return StreamingResponse(
-        iter([file_record.file_data]),
-        media_type=file_record.file_type,
-        headers=headers
-    )
+    try:
+        return BlobResponse(
+            storage=file_storage,
+            sha256=file_record.sha256,
+            media_type=file_record.file_type,
+            filename=file_record.file_name,
+            request_headers=request.headers,
+            size=file_record.size
+        )
+    except FileNotFoundError:
+        logger.error(f"Content of file {file_id} ({file_record.sha256}) missing from file store")
+        raise HTTPException(status_code=404, detail="File not found.")
 
 @router.delete("/file/{file_id}")
 def delete_file(
     file_id: int,
-    user: Person = Depends(require_login),
+    user: UserIdentity = Depends(require_login),
     db: Session = Depends(get_db)
 ):
     logger.info(f"Delete request for file {file_id} by user {user.id}")
@@ -158,6 +226,7 @@ def delete_file(
         raise HTTPException(status_code=403, detail="You don't have permission to delete this file.")
 
     try:
+        sha256 = file_obj.sha256
         db.delete(file_obj)
         db.commit()
         logger.info(f"File {file_id} deleted successfully")
@@ -165,5 +234,16 @@ def delete_file(
         logger.error(f"Error deleting file {file_id}: {str(e)}")
         db.rollback()
         raise HTTPException(status_code=500, detail="Database error during file deletion")
-        
+
+    # Content is deduplicated, only remove it once no other file uses it.
+    # Checked under the store's lock so an upload of the same content
+    # can't publish in between (see BlobWriter.release). The file itself is
+    # gone at this point, so a failure here only leaves unused content behind.
+    try:
+        file_storage.delete_unreferenced(
+            sha256, lambda: db.query(File.id).filter(File.sha256 == sha256).first() is not None
+        )
+    except Exception as e:
+        logger.warning(f"File {file_id} deleted, but its content {sha256} could not be removed from the file store: {str(e)}")
+
     return {"detail": f"File {file_id} deleted successfully."}
\ No newline at end of file
@@ -1,11 +1,19 @@
+import io
+import csv
 import logging
 from fastapi import APIRouter, Request, Form, Depends, HTTPException
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.orm import load_only
+from sqlalchemy.ext.asyncio import AsyncSession
 from models import Application, Person
-from routes.utils import get_db, require_login
+from routes.utils import get_async_db, require_login, require_login_async
+from services.identity_cache import UserIdentity
 from services.calculations import LoanDecision
+from services.decision_rules import Ruleset, decision_rules
+from services.credit_scores import credit_scores, CreditScoreUnavailable
+from services.amortization import get_schedule, schedule_terms, DEFAULT_INTEREST_RATE
 from datetime import datetime
 from typing import Optional
 from services.email_service import email_service
@@ -17,12 +25,12 @@ router = APIRouter()
 templates = Jinja2Templates(directory="templates")
 
 # Validation functions
-def validate_boni_score(boni_score: float):
-    if boni_score < 579:
+def validate_boni_score(boni_score: float, ruleset: Ruleset):
+    if boni_score < ruleset.thresholds.boni_reject:
         raise ValueError("Ihr Bonitätsscore ist zu niedrig für eine Kreditvergabe.")
 
-def validate_dscr_score(dscr_score: float):
-    if dscr_score < 1:
+def validate_dscr_score(dscr_score: float, ruleset: Ruleset):
+    if dscr_score < ruleset.thresholds.dscr_min:
         raise ValueError("Ihr DSCR Score ist zu niedrig für eine Kreditvergabe.")
 
 def validate_immediate_loan(loan_subtype: str, requested_amount: float, repayment_amount: float, term_in_years: int):
@@ -55,7 +63,7 @@ def validate_building_loan(loan_subtype: str, term_in_years: int):
     return term_in_years
 
 @router.get("/loan", response_class=HTMLResponse)
-def get_loan_form(request: Request, user: Person = Depends(require_login), loan_type: str = None):
+def get_loan_form(request: Request, user: UserIdentity = Depends(require_login), loan_type: str = None):
     # Check if user is a customer - only customers can access the loan page
     if user.person_type != "customer":
         logger.warning(f"Non-customer user (id: {user.id}, type: {user.person_type}) attempted to access loan page")
@@ -73,7 +81,7 @@ def get_loan_form(request: Request, user: Person = Depends(require_login), loan_
     )
 
 @router.post("/loan_submit", response_class=HTMLResponse)
-def loan_submit(
+async def loan_submit(
     request: Request,
     loan_type: str = Form(...),
     loan_subtype: str = Form(...),
@@ -84,8 +92,8 @@ def loan_submit(
     total_debt_payments: Optional[float] = Form(None),
     collateral_value: Optional[float] = Form(None),
     total_outstanding_debt: Optional[float] = Form(None),
-    user: Person = Depends(require_login),
-    db: Session = Depends(get_db)
+    user: UserIdentity = Depends(require_login_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Check if user is a customer - only customers can submit loan applications
     if user.person_type != "customer":
@@ -94,12 +102,15 @@ def loan_submit(
     
     logger.info(f"Customer {user.id} submitted loan application: {loan_type}, {loan_subtype}, amount: {requested_amount}")
 
+    # One ruleset for the whole submission, even if it is reloaded meanwhile
+    ruleset = decision_rules.current()
+
     try:
-        # Get or generate boni score (normally would come from credit bureau)
-        bonitaet_rating = LoanDecision.get_bonitaet_score()
+        # Boni score from the credit score provider (cached per customer)
+        bonitaet_rating = await credit_scores.get_score(user.id)
         
         # Basic validation of credit score
-        validate_boni_score(bonitaet_rating)
+        validate_boni_score(bonitaet_rating, ruleset)
         
         # Different validation rules based on loan type
         if loan_type == "Sofortkredit":
@@ -132,7 +143,7 @@ def loan_submit(
             )
             
             # Validate DSCR
-            validate_dscr_score(dscr_value)
+            validate_dscr_score(dscr_value, ruleset)
         else:
             raise ValueError("Ungültige Darlehensart.")
 
@@ -141,7 +152,8 @@ def loan_submit(
             boni_score=bonitaet_rating,
             dscr=dscr_value,
             ccr=ccr_value,
-            loan_type=loan_type
+            loan_type=loan_type,
+            ruleset=ruleset
         )
         
         # Get decision result
@@ -175,12 +187,16 @@ def loan_submit(
             reason=result["reason"],
             created_at=now,
             decided_at=now if status == "abgelehnt" else None,  # Set decided_at for rejected applications
-            needs_manager_approval=needs_manager_approval
+            needs_manager_approval=needs_manager_approval,
+            ruleset_version=result["ruleset_version"],
+            available_income=available_income,
+            total_debt_payments=total_debt_payments,
+            collateral_value=collateral_value,
+            total_outstanding_debt=total_outstanding_debt
         )
 
         db.add(new_app)
-        db.commit()
-        db.refresh(new_app)
+        await db.commit()
         
         logger.info(f"New loan application {new_app.id} created by user {user.id}")
         
@@ -199,6 +215,8 @@ def loan_submit(
         # Otherwise, redirect to file upload
         return RedirectResponse(url=f"/upload?application_id={new_app.id}", status_code=303)
 
+    except CreditScoreUnavailable:
+        raise
     except ValueError as e:
         # Handle validation errors
         logger.warning(f"Loan application validation failed for user {user.id}: {str(e)}")
@@ -222,4 +240,67 @@ def loan_submit(
                 "rejected": True, 
                 "rejected_reason": "Ein unerwarteter Fehler ist aufgetreten. Bitte versuchen Sie es später erneut.",
             }
-        )
\ No newline at end of file
+        )
+
+SCHEDULE_CSV_HEADER = ["Monat", "Rate", "Zinsen", "Tilgung", "Restschuld"]
+
+def iter_schedule_csv(schedule):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(SCHEDULE_CSV_HEADER)
+    for row in schedule:
+        writer.writerow(row)
+        # Hand out roughly 8 KB at a time instead of building the whole file
+        if buffer.tell() > 8192:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+@router.get("/applications/{application_id}/schedule")
+async def get_repayment_schedule(
+    application_id: int,
+    format: str = "json",
+    user: UserIdentity = Depends(require_login_async),
+    db: AsyncSession = Depends(get_async_db)
+):
+    if format not in ("json", "csv"):
+        raise HTTPException(status_code=400, detail="Format muss json oder csv sein")
+
+    app_obj = (await db.execute(
+        select(Application)
+        .options(load_only(
+            Application.id, Application.person_id, Application.loan_subtype,
+            Application.requested_amount, Application.term_in_years, Application.repayment_amount
+        ))
+        .where(Application.id == application_id)
+    )).scalars().first()
+    if not app_obj:
+        raise HTTPException(status_code=404, detail="Antrag nicht gefunden")
+
+    # Customers only see their own applications, staff see all
+    if user.person_type == "customer" and app_obj.person_id != user.id:
+        logger.warning(f"User {user.id} attempted to access schedule of application {application_id}")
+        raise HTTPException(status_code=403, detail="Keine Berechtigung für diesen Antrag")
+
+    try:
+        schedule = get_schedule(*schedule_terms(app_obj))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if format == "csv":
+        return StreamingResponse(
+            iter_schedule_csv(schedule),
+            media_type="text/csv; charset=utf-8",
+            headers={"Content-Disposition": f'attachment; filename="tilgungsplan-{application_id}.csv"'}
+        )
+
+    return JSONResponse({
+        "application_id": app_obj.id,
+        "loan_subtype": app_obj.loan_subtype,
+        "requested_amount": app_obj.requested_amount,
+        "interest_rate": DEFAULT_INTEREST_RATE,
+        "total_interest": round(sum(row.interest for row in schedule), 2),
+        "total_payment": round(sum(row.payment for row in schedule), 2),
+        "periods": [row._asdict() for row in schedule]
+    })
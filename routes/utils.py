@@ -1,23 +1,20 @@
-import uuid
 import logging
 from fastapi import Request, HTTPException, Depends, Cookie
 from fastapi.responses import RedirectResponse
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from typing import Optional, Dict, Any
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
 from datetime import datetime, timedelta
-from db import SessionLocal
+from db import SessionLocal, AsyncSessionLocal
 from models import Person
+from config import SESSION_EXPIRY_DAYS
+from services.session_store import session_store
+from services.identity_cache import UserIdentity, identity_cache
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-# Simple in-memory session store
-# Using new format: session_id -> {user_id: id, expires: datetime}
-sessions: Dict[str, Dict[str, Any]] = {}
-
-# Session configuration
-SESSION_EXPIRY_DAYS = 7
-
 def get_db():
     db = SessionLocal()
     try:
@@ -25,103 +22,101 @@ def get_db():
     finally:
         db.close()
 
-def clean_expired_sessions():
-    now = datetime.now()
-    expired_sessions = []
-    
-    for session_id, data in sessions.items():
-        # Handle both the old format (int) and new format (dict)
-        if isinstance(data, dict) and "expires" in data:
-            if data["expires"] < now:
-                expired_sessions.append(session_id)
-        elif isinstance(data, int):
-            # Convert old format to new format
-            sessions[session_id] = {
-                "user_id": data,
-                "expires": now + timedelta(days=SESSION_EXPIRY_DAYS)
-            }
-            logger.debug(f"Converted old format session to new format: {session_id}")
-    
-    for session_id in expired_sessions:
-        del sessions[session_id]
-        
-    if expired_sessions:
-        logger.info(f"Cleaned {len(expired_sessions)} expired sessions")
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
 
-def get_current_user(
-    request: Request, 
-    db: Session = Depends(get_db),
-    session_id: Optional[str] = Cookie(None)
-) -> Optional[Person]:
-    # Clean expired sessions occasionally
-    clean_expired_sessions()
-    
-    # Debug session state
-    logger.debug(f"get_current_user called, session count: {len(sessions)}")
-    logger.debug(f"Session cookie: {session_id}")
+def resolve_session_user_id(session_id: Optional[str]) -> Optional[int]:
+    # Hot path: lazy %-formatting, so nothing is formatted unless DEBUG is on
+    logger.debug("Session cookie: %.8s...", session_id)
     
     if not session_id:
         logger.debug("No session cookie found")
         return None
     
-    if session_id not in sessions:
-        logger.debug(f"Session ID not found in sessions dictionary: {session_id}")
-        return None
-    
-    # Get session data
-    session_data = sessions[session_id]
-    logger.debug(f"Session data: {session_data}")
+    person_id = session_store.get(session_id)
+    if person_id is None:
+        logger.debug("Session not found or expired: %.8s...", session_id)
+    return person_id
+
+async def resolve_session_user_id_async(session_id: Optional[str]) -> Optional[int]:
+    logger.debug("Session cookie: %.8s...", session_id)
     
-    # Handle different session formats
-    person_id = None
-    if isinstance(session_data, int):
-        # Old format - direct user ID
-        person_id = session_data
-        # Convert to new format
-        sessions[session_id] = {
-            "user_id": person_id,
-            "expires": datetime.now() + timedelta(days=SESSION_EXPIRY_DAYS)
-        }
-        logger.debug(f"Converted old session format for {session_id}")
-    elif isinstance(session_data, dict):
-        person_id = session_data.get("user_id")
-        expires = session_data.get("expires")
-        
-        # Check if session is expired
-        if not person_id:
-            logger.debug(f"No user_id in session data")
-            del sessions[session_id]
-            return None
-            
-        if not expires:
-            logger.debug(f"No expiration in session data")
-            del sessions[session_id]
-            return None
-            
-        if expires < datetime.now():
-            logger.debug(f"Session expired: {expires}")
-            del sessions[session_id]
-            return None
-    else:
-        logger.warning(f"Invalid session data type: {type(session_data)}")
-        del sessions[session_id]
+    if not session_id:
+        logger.debug("No session cookie found")
         return None
     
-    user = db.query(Person).filter(Person.id == person_id).first()
-    
-    if user:
-        logger.debug(f"Found user: id={user.id}, type={user.person_type}")
-    else:
+    person_id = await session_store.get_async(session_id)
+    if person_id is None:
+        logger.debug("Session not found or expired: %.8s...", session_id)
+    return person_id
+
+def remember_identity(person: Optional[Person], person_id: int, session_id: str) -> Optional[UserIdentity]:
+    if person is None:
         logger.warning(f"User with ID {person_id} not found in database")
-        del sessions[session_id]
-        
+        session_store.delete(session_id)
+        return None
+    logger.debug("Found user: id=%s, type=%s", person.id, person.person_type)
+    return identity_cache.put(UserIdentity.from_person(person))
+
+def forget_identity(person_id: int):
+    # Call after changing a user's role, name, email or password
+    identity_cache.invalidate(person_id)
+
+def change_role(person: Person, new_role: str):
+    # Bumping the role version revokes signed session tokens issued for the old role
+    person.person_type = new_role
+    person.role_version = (person.role_version or 0) + 1
+
+def revoke_role_sessions(person: Person):
+    # Call after the role change is committed
+    forget_identity(person.id)
+    session_store.revoke_user(person.id, person.role_version)
+
+def get_current_user(
+    request: Request, 
+    db: Session = Depends(get_db),
+    session_id: Optional[str] = Cookie(None)
+) -> Optional[UserIdentity]:
+    # Resolved once per request; require_login and templates reuse it
+    if hasattr(request.state, "current_user"):
+        return request.state.current_user
+
+    user = None
+    person_id = resolve_session_user_id(session_id)
+    if person_id is not None:
+        user = identity_cache.get(person_id)
+        if user is None:
+            person = db.query(Person).filter(Person.id == person_id).first()
+            user = remember_identity(person, person_id, session_id)
+
+    request.state.current_user = user
+    return user
+
+async def get_current_user_async(
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    session_id: Optional[str] = Cookie(None)
+) -> Optional[UserIdentity]:
+    if hasattr(request.state, "current_user"):
+        return request.state.current_user
+
+    user = None
+    person_id = await resolve_session_user_id_async(session_id)
+    if person_id is not None:
+        user = identity_cache.get(person_id)
+        if user is None:
+            person = (await db.execute(select(Person).where(Person.id == person_id))).scalars().first()
+            user = remember_identity(person, person_id, session_id)
+
+    request.state.current_user = user
     return user
 
 def require_login(
     request: Request, 
     db: Session = Depends(get_db),
     session_id: Optional[str] = Cookie(None)
-) -> Person:
+) -> UserIdentity:
 
     logger.debug("require_login called")
     user = get_current_user(request, db, session_id)
@@ -130,14 +125,22 @@ def require_login(
         raise HTTPException(status_code=302, headers={"Location": "/login"})
     return user
 
-def create_session_cookie(response, person_id: int):
-    session_id = str(uuid.uuid4())
+async def require_login_async(
+    request: Request, 
+    db: AsyncSession = Depends(get_async_db),
+    session_id: Optional[str] = Cookie(None)
+) -> UserIdentity:
+
+    logger.debug("require_login_async called")
+    user = await get_current_user_async(request, db, session_id)
+    if not user:
+        logger.debug("User not logged in, redirecting to login page")
+        raise HTTPException(status_code=302, headers={"Location": "/login"})
+    return user
+
+def create_session_cookie(response, person_id: int, role_version: int = 0):
     expires = datetime.now() + timedelta(days=SESSION_EXPIRY_DAYS)
-    
-    sessions[session_id] = {
-        "user_id": person_id,
-        "expires": expires
-    }
+    session_id = session_store.create(person_id, expires, role_version)
     
     http_expires = expires.strftime("%a, %d %b %Y %H:%M:%S GMT")
     
@@ -152,13 +155,25 @@ def create_session_cookie(response, person_id: int):
     )
     
     logger.info(f"Created session for user {person_id}, session_id: {session_id}")
-    logger.debug(f"Current sessions after creation: {sessions}")
+    return session_id
 
-def clear_session_cookie(response, request: Request):
+def clear_session(request: Request):
     session_id = request.cookies.get("session_id")
-    if session_id and session_id in sessions:
-        del sessions[session_id]
+    if session_id:
+        session_store.delete(session_id)
         logger.info(f"Cleared session {session_id}")
+
+def clear_session_cookie(response, request: Request):
+    clear_session(request)
     
     # Ensure cookie is properly deleted with the same path
-    response.delete_cookie(key="session_id", path="/")
\ No newline at end of file
+    response.delete_cookie(key="session_id", path="/")
+
+async def rate_limit_account(request: Request, form: dict) -> Optional[str]:
+    # Account a rate-limited request counts against: the logged-in user for
+    # loan submissions, the e-mail address entered on the auth forms
+    if request.url.path == "/loan_submit":
+        person_id = await resolve_session_user_id_async(request.cookies.get("session_id"))
+        return str(person_id) if person_id is not None else None
+    email = form.get("email")
+    return email[0].strip().lower() if email else None
@@ -0,0 +1,90 @@
+# services/amortization.py
+import math
+import logging
+from functools import lru_cache
+from typing import Iterator, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Same rate LoanDecision.calculate_dscr assumes for the new loan
+DEFAULT_INTEREST_RATE = 0.05
+LOAN_SUBTYPES = ("annuitaet", "tilgung", "endfaellig")
+
+class SchedulePeriod(NamedTuple):
+    period: int
+    payment: float
+    interest: float
+    principal: float
+    balance: float
+
+def iter_schedule(
+    amount: float,
+    annual_rate: float,
+    months: int,
+    subtype: str,
+    monthly_principal: Optional[float] = None
+) -> Iterator[SchedulePeriod]:
+    # Monthly repayment plan, one period at a time, in cents:
+    #   annuitaet  - constant payment, the principal share grows
+    #   tilgung    - constant principal (monthly_principal, else amount/months),
+    #                interest on the falling balance
+    #   endfaellig - interest only, the whole amount is repaid in the last month
+    # Interest is rounded per period and the last period clears the balance,
+    # so the principal column always adds up to the amount.
+    if subtype not in LOAN_SUBTYPES:
+        raise ValueError(f"Unbekannter Darlehensuntertyp: {subtype}")
+    rate = annual_rate / 12
+    balance = round(float(amount), 2)
+
+    if subtype == "tilgung":
+        if monthly_principal:
+            months = math.ceil(balance / monthly_principal)
+        else:
+            monthly_principal = balance / months if months > 0 else 0
+    if months <= 0:
+        raise ValueError("Die Laufzeit muss mindestens einen Monat betragen.")
+
+    if subtype == "annuitaet":
+        if rate > 0:
+            annuity = round(balance * rate * (1 + rate) ** months / ((1 + rate) ** months - 1), 2)
+        else:
+            annuity = round(balance / months, 2)
+
+    for period in range(1, months + 1):
+        interest = round(balance * rate, 2) if rate > 0 else 0.0
+        if period == months:
+            principal = balance
+        elif subtype == "annuitaet":
+            principal = min(balance, round(annuity - interest, 2))
+        elif subtype == "tilgung":
+            principal = min(balance, round(monthly_principal, 2))
+        else:
+            principal = 0.0
+        balance = round(balance - principal, 2)
+        yield SchedulePeriod(period, round(interest + principal, 2), interest, principal, balance)
+
+@lru_cache(maxsize=1024)
+def get_schedule(
+    amount: float,
+    annual_rate: float,
+    months: int,
+    subtype: str,
+    monthly_principal: Optional[float] = None
+) -> Tuple[SchedulePeriod, ...]:
+    # A schedule only depends on these terms, so views and downloads of the
+    # same loan (and of identical loans) share one computation
+    return tuple(iter_schedule(amount, annual_rate, months, subtype, monthly_principal))
+
+def schedule_terms(application, annual_rate: float = DEFAULT_INTEREST_RATE) -> tuple:
+    # get_schedule() arguments for a stored application. Tilgung applications
+    # store the monthly repayment; their term_in_years is rounded down.
+    monthly_principal = None
+    if application.loan_subtype == "tilgung" and application.repayment_amount:
+        monthly_principal = float(application.repayment_amount)
+    return (
+        float(application.requested_amount),
+        annual_rate,
+        int(application.term_in_years or 0) * 12,
+        application.loan_subtype,
+        monthly_principal
+    )
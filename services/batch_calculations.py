@@ -0,0 +1,92 @@
+# services/batch_calculations.py
+#
+# NumPy versions of LoanDecision.calculate_dscr / calculate_ccr for scoring
+# many applications at once (nightly re-scoring, analytics). Every argument
+# may be a scalar or an array; they are broadcast against each other. The
+# results follow the scalar methods case by case:
+#   - no interest (rate <= 0) or no term: the annuity becomes amount / months,
+#     and 0 when there are no months at all
+#   - no payments (total <= 0): DSCR is inf
+#   - no debt at all (total <= 0): CCR is inf
+# amortization_schedules_batch is the bulk counterpart of
+# services.amortization. Request handlers keep using the scalar code;
+# numpy is only needed here.
+import numpy as np
+
+def _as_arrays(*values):
+    return np.broadcast_arrays(*(np.asarray(v, dtype=np.float64) for v in values))
+
+def monthly_annuity_batch(requested_amount, term_in_years, interest_rate=0.05) -> np.ndarray:
+    amount, term, rate = _as_arrays(requested_amount, term_in_years, interest_rate)
+    monthly_rate = rate / 12
+    total_payments = term * 12
+
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        growth = (1 + monthly_rate) ** total_payments
+        annuity = amount * (monthly_rate * growth) / (growth - 1)
+        linear = amount / total_payments
+    # np.where evaluates both branches; the warnings above come from the unused one
+    return np.where(
+        (total_payments > 0) & (monthly_rate > 0),
+        annuity,
+        np.where(total_payments > 0, linear, 0.0)
+    )
+
+def calculate_dscr_batch(available_income, total_debt_payments, requested_amount, term_in_years, interest_rate=0.05) -> np.ndarray:
+    income, debt = _as_arrays(available_income, total_debt_payments)
+    total_monthly_payments = debt / 12 + monthly_annuity_batch(requested_amount, term_in_years, interest_rate)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dscr = income / total_monthly_payments
+    return np.where(total_monthly_payments > 0, dscr, np.inf)
+
+def calculate_ccr_batch(collateral_value, total_outstanding_debt, requested_amount) -> np.ndarray:
+    collateral, outstanding, amount = _as_arrays(collateral_value, total_outstanding_debt, requested_amount)
+    total_debt = outstanding + amount
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ccr = collateral / total_debt
+    return np.where(total_debt > 0, ccr, np.inf)
+
+def amortization_schedules_batch(requested_amount, term_in_years, loan_subtype: str, interest_rate=0.05):
+    # Repayment plans of many loans of one subtype at once, unrounded (for
+    # analytics; customers get the cent-exact services.amortization plan).
+    # Returns (interest, principal, balance), each shaped (loans, months of
+    # the longest term); periods after a loan's own term are 0.
+    amount, term, rate = (a.ravel() for a in _as_arrays(requested_amount, term_in_years, interest_rate))
+    months = np.maximum(term * 12, 0).astype(np.int64)
+    monthly_rate = np.where(rate > 0, rate / 12, 0.0)[:, None]
+    principal_total = amount[:, None]
+    n = months[:, None]
+    k = np.arange(1, (months.max() if months.size else 0) + 1)[None, :]
+
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        if loan_subtype == "annuitaet":
+            payment = monthly_annuity_batch(amount, term, rate)[:, None]
+            growth = (1 + monthly_rate) ** (k - 1)
+            # Balance before period k: compounded amount minus compounded payments
+            balance_before = np.where(
+                monthly_rate > 0,
+                principal_total * growth - payment * (growth - 1) / monthly_rate,
+                principal_total - payment * (k - 1)
+            )
+            interest = balance_before * monthly_rate
+            principal = payment - interest
+        elif loan_subtype == "tilgung":
+            principal = np.broadcast_to(principal_total / n, (amount.size, k.shape[1]))
+            balance_before = principal_total - principal * (k - 1)
+            interest = balance_before * monthly_rate
+        elif loan_subtype == "endfaellig":
+            interest = np.broadcast_to(principal_total * monthly_rate, (amount.size, k.shape[1]))
+            principal = np.where(k == n, principal_total, 0.0)
+            balance_before = np.broadcast_to(principal_total, (amount.size, k.shape[1]))
+        else:
+            raise ValueError(f"Unknown loan subtype: {loan_subtype}")
+        balance = balance_before - principal
+
+    active = k <= n
+    return (
+        np.where(active, interest, 0.0),
+        np.where(active, principal, 0.0),
+        np.where(active, balance, 0.0)
+    )
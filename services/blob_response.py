@@ -0,0 +1,176 @@
+# services/blob_response.py
+import mmap
+import logging
+from typing import Optional, Tuple
+from urllib.parse import quote
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.responses import Response
+
+from services.file_storage import FileStorage
+
+logger = logging.getLogger(__name__)
+
+SEND_CHUNK_SIZE = 256 * 1024
+
+class RangeNotSatisfiable(ValueError):
+    pass
+
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    # Returns an inclusive (start, end) for a single byte range, None to send
+    # the whole body. Multi-range requests are answered with the full body.
+    if not range_header or not range_header.startswith("bytes="):
+        return None
+    spec = range_header[len("bytes="):].strip()
+    if "," in spec:
+        return None
+    start_text, sep, end_text = spec.partition("-")
+    if not sep:
+        return None
+    try:
+        if start_text == "":
+            # Suffix range: the last N bytes
+            length = int(end_text)
+            if length <= 0:
+                raise RangeNotSatisfiable(range_header)
+            return max(0, size - length), size - 1
+        start = int(start_text)
+        end = int(end_text) if end_text else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        raise RangeNotSatisfiable(range_header)
+    return start, min(end, size - 1)
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    candidates = [tag.strip() for tag in header.split(",")]
+    # If-None-Match uses weak comparison
+    return "*" in candidates or any(tag.removeprefix("W/") == etag for tag in candidates)
+
+def content_disposition(filename: str) -> str:
+    # ASCII fallback for old clients plus the RFC 5987 form for umlauts etc.
+    fallback = filename.encode("ascii", "replace").decode("ascii").replace("\\", "_").replace('"', "_")
+    return f"attachment; filename=\"{fallback}\"; filename*=utf-8''{quote(filename)}"
+
+class BlobResponse(Response):
+    # Serves a blob from the file store. Content is addressed by SHA-256 and
+    # never changes, so the digest is a strong ETag: revalidations answer 304
+    # without touching the file, and byte ranges are cheap to serve. Local
+    # blobs go out via the server's zero-copy (sendfile) extension when it has
+    # one, otherwise via mmap without reading the whole file into Python.
+
+    def __init__(
+        self,
+        storage: FileStorage,
+        sha256: str,
+        media_type: str,
+        filename: str,
+        request_headers: Headers,
+        size: Optional[int] = None,
+        max_age: int = 3600
+    ):
+        self.storage = storage
+        self.sha256 = sha256
+        self.media_type = media_type
+        self.background = None
+        self.body = b""
+        self.range: Optional[Tuple[int, int]] = None
+
+        etag = f'"{sha256}"'
+        headers = {
+            "etag": etag,
+            "cache-control": f"private, max-age={max_age}",
+            "accept-ranges": "bytes",
+            "content-disposition": content_disposition(filename),
+        }
+
+        if etag_matches(request_headers.get("if-none-match"), etag):
+            self.status_code = 304
+            self.init_headers(headers)
+            return
+
+        if size is None:
+            size = storage.size(sha256)
+        self.size = size
+
+        range_header = request_headers.get("range")
+        if_range = request_headers.get("if-range")
+        if range_header and (not if_range or if_range == etag):
+            try:
+                self.range = parse_range(range_header, size)
+            except RangeNotSatisfiable:
+                self.status_code = 416
+                headers["content-range"] = f"bytes */{size}"
+                self.init_headers(headers)
+                return
+
+        if self.range:
+            start, end = self.range
+            self.status_code = 206
+            headers["content-range"] = f"bytes {start}-{end}/{size}"
+        else:
+            self.range = (0, size - 1)
+            self.status_code = 200
+        headers["content-length"] = str(self.range[1] - self.range[0] + 1)
+        self.init_headers(headers)
+
+    async def __call__(self, scope, receive, send):
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+
+        if self.status_code not in (200, 206) or scope.get("method") == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        start, end = self.range
+        count = end - start + 1
+        path = self.storage.local_path(self.sha256)
+
+        if count <= 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        elif path and "http.response.zerocopy" in scope.get("extensions", {}):
+            with open(path, "rb") as f:
+                await send({
+                    "type": "http.response.zerocopy",
+                    "file": f.fileno(),
+                    "offset": start,
+                    "count": count,
+                    "more_body": False,
+                })
+        elif path:
+            await self._send_mmap(path, start, count, send)
+        else:
+            await self._send_stream(start, count, send)
+
+    async def _send_mmap(self, path: str, start: int, count: int, send):
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            offset = start
+            remaining = count
+            while remaining > 0:
+                n = min(SEND_CHUNK_SIZE, remaining)
+                # Page faults happen off the event loop
+                chunk = await run_in_threadpool(mapped.__getitem__, slice(offset, offset + n))
+                offset += n
+                remaining -= n
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+
+    async def _send_stream(self, start: int, count: int, send):
+        f = await run_in_threadpool(self.storage.open, self.sha256)
+        try:
+            await run_in_threadpool(f.seek, start)
+            remaining = count
+            while remaining > 0:
+                chunk = await run_in_threadpool(f.read, min(SEND_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            await run_in_threadpool(f.close)
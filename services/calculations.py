@@ -1,18 +1,17 @@
-import random
 import logging
-import time 
+from typing import Optional
+from services.decision_rules import Ruleset, decision_rules
 
 logger = logging.getLogger(__name__)
 
 class LoanDecision:
-    def __init__(self, boni_score: float, dscr: float, ccr: float, loan_type: str):
+    def __init__(self, boni_score: float, dscr: float, ccr: float, loan_type: str, ruleset: Optional[Ruleset] = None):
         self.boni_score = boni_score
         self.dscr = dscr
         self.ccr = ccr
         self.loan_type = loan_type
-        self.decision = None
-        self.reason = None
-        self.needs_manager_approval = False
+        # None: the configured ruleset in use right now
+        self.ruleset = ruleset or decision_rules.current()
 
     @staticmethod
     def calculate_dscr(available_income: float, total_debt_payments: float, requested_amount: float, term_in_years: int, interest_rate: float = 0.05) -> float:
@@ -32,7 +31,7 @@ class LoanDecision:
         # Calculate DSCR
         dscr = available_income / total_monthly_payments if total_monthly_payments > 0 else float('inf')
         
-        logger.debug(f"DSCR calculation: income={available_income}, total_payments={total_monthly_payments}, dscr={dscr}")
+        logger.debug("DSCR calculation: income=%s, total_payments=%s, dscr=%s", available_income, total_monthly_payments, dscr)
         return dscr
 
     @staticmethod
@@ -43,83 +42,12 @@ class LoanDecision:
         # Calculate CCR
         ccr = collateral_value / total_debt if total_debt > 0 else float('inf')
         
-        logger.debug(f"CCR calculation: collateral={collateral_value}, total_debt={total_debt}, ccr={ccr}")
+        logger.debug("CCR calculation: collateral=%s, total_debt=%s, ccr=%s", collateral_value, total_debt, ccr)
         return ccr
 
-    @staticmethod
-    def get_bonitaet_score() -> float:
-        # Use current timestamp as seed for truly varied scores
-        random.seed(int(time.time() * 1000))
-        return round(random.uniform(651, 999), 2)
-
-    def evaluate(self):       
+    def evaluate(self):
         logger.info(f"Evaluating loan application: type={self.loan_type}, boni={self.boni_score}, dscr={self.dscr}, ccr={self.ccr}")
-        
-        # Check for manager approval thresholds - still track this for reference
-        if self.boni_score < 670 or (self.dscr is not None and self.dscr < 1.4):
-            self.needs_manager_approval = True
+        result = self.ruleset.evaluate(self.boni_score, self.dscr, self.ccr, self.loan_type)
+        if result["needs_manager_approval"]:
             logger.info(f"Application needs manager approval: boni={self.boni_score}, dscr={self.dscr}")
-        
-        # Immediate rejection for very poor boni score
-        if self.boni_score < 579:
-            return self._reject("Boni zu niedrig")
-
-        # For all other cases, set as pending with an appropriate recommendation
-        loan_checks = {
-            "Sofortkredit": self._check_sofortkredit,
-            "Baudarlehen": self._check_baudarlehen
-        }
-        check_method = loan_checks.get(self.loan_type, self._unknown_loan_type)
-        result = check_method()
-        
-        # Always set to pending for employee review
-        if result["decision"] == "approved":
-            # Convert "approved" recommendations to "pending" with recommendation
-            result = self._pending(f"Empfehlung: {result['reason']}")
-        
-        result["needs_manager_approval"] = self.needs_manager_approval
         return result
-
-    def _check_sofortkredit(self):
-        return self._recommend_approval("")
-
-    def _check_baudarlehen(self):
-        if self.dscr < 1:
-            return self._reject("DSCR zu niedrig für Baudarlehen (< 1)")
-        
-        if self.dscr >= 2 and self.ccr >= 0.75:
-            return self._recommend_approval("Genehmigung empfohlen")
-        
-        if 1 <= self.dscr < 2 and self.ccr >= 1:
-            return self._recommend_approval("Genehmigung empfohlen")
-        
-        if (1 <= self.dscr < 2 and self.ccr < 1) or (self.dscr >= 2 and self.ccr < 0.75):
-            return self._pending("Zusätzliche Sicherheit erforderlich (1 Monat Verzögerung)")
-        
-        return self._reject("Ungenügende DSCR oder CCR Werte")
-
-    def _unknown_loan_type(self):
-        return self._reject("Unbekannter Kredittyp")
-
-    def _recommend_approval(self, reason):
-        # This doesn't approve, just stores a recommendation
-        self.decision = "pending"  # Still pending for employee review
-        self.reason = reason
-        return self.get_result()
-
-    def _reject(self, reason):
-        self.decision = "rejected"
-        self.reason = reason
-        return self.get_result()
-
-    def _pending(self, reason):
-        self.decision = "pending"
-        self.reason = reason
-        return self.get_result()
-
-    def get_result(self):
-        return {
-            "decision": self.decision, 
-            "reason": self.reason,
-            "needs_manager_approval": self.needs_manager_approval
-        }
\ No newline at end of file
@@ -0,0 +1,212 @@
+# services/credit_scores.py
+#
+# Bonität lookups. A provider fetches a customer's score from somewhere (a
+# credit bureau in production); CreditScoreService wraps it with a timeout
+# per attempt, retries with backoff, a per-customer TTL cache and coalescing
+# of concurrent lookups for the same customer. Repeated applications from one
+# customer therefore cost one bureau call per TTL.
+#
+# For development the stub provider derives a fixed score from the customer
+# id, and the same scores can be served over HTTP to exercise the http
+# backend, timeouts included:
+#
+#   python services/credit_scores.py [--port 8099] [--delay-ms 0] [--fail-rate 0]
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import (
+    CREDIT_SCORE_BACKEND, CREDIT_SCORE_URL, CREDIT_SCORE_FIXTURE, CREDIT_SCORE_STUB_SEED,
+    CREDIT_SCORE_TIMEOUT, CREDIT_SCORE_RETRIES, CREDIT_SCORE_BACKOFF_MS,
+    CREDIT_SCORE_CACHE_TTL, CREDIT_SCORE_CACHE_SIZE
+)
+
+logger = logging.getLogger(__name__)
+
+class CreditScoreUnavailable(Exception):
+    pass
+
+class CreditScoreProvider(ABC):
+    @abstractmethod
+    async def fetch(self, customer_id: int) -> float:
+        pass
+
+    async def close(self):
+        pass
+
+class StubCreditScoreProvider(CreditScoreProvider):
+    # Same range as the old random placeholder, but a fixed score per customer
+    # (own Random instance, nothing global is reseeded)
+    def __init__(self, seed: str = "", low: float = 651, high: float = 999):
+        self.seed = seed
+        self.low = low
+        self.high = high
+
+    def score(self, customer_id: int) -> float:
+        return round(random.Random(f"{self.seed}:{customer_id}").uniform(self.low, self.high), 2)
+
+    async def fetch(self, customer_id: int) -> float:
+        return self.score(customer_id)
+
+class FixtureCreditScoreProvider(StubCreditScoreProvider):
+    # Scores from a JSON file {"<customer id>": score}; customers not listed
+    # get the stub score
+    def __init__(self, path: str, seed: str = ""):
+        super().__init__(seed)
+        with open(path, encoding="utf-8") as f:
+            self.scores = {int(customer_id): float(score) for customer_id, score in json.load(f).items()}
+
+    async def fetch(self, customer_id: int) -> float:
+        if customer_id in self.scores:
+            return self.scores[customer_id]
+        return self.score(customer_id)
+
+class HttpCreditScoreProvider(CreditScoreProvider):
+    # GET <url>/scores/<customer id> -> {"score": 712.5}; one pooled client
+    def __init__(self, url: str, timeout: float):
+        import httpx
+        self.http_error = httpx.HTTPError
+        self.client = httpx.AsyncClient(base_url=url.rstrip("/"), timeout=timeout)
+
+    async def fetch(self, customer_id: int) -> float:
+        try:
+            response = await self.client.get(f"/scores/{customer_id}")
+            if response.status_code != 200:
+                raise CreditScoreUnavailable(f"HTTP {response.status_code}")
+            return float(response.json()["score"])
+        except (self.http_error, KeyError, TypeError, ValueError) as e:
+            raise CreditScoreUnavailable(f"{type(e).__name__}: {e}") from e
+
+    async def close(self):
+        await self.client.aclose()
+
+class CreditScoreService:
+    # Only used from the event loop, so the cache needs no lock
+    def __init__(self, provider: CreditScoreProvider, timeout: float, retries: int,
+                 backoff_ms: int, cache_ttl: int, cache_size: int):
+        self.provider = provider
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff_ms / 1000
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        # customer id -> (score, fetched_at)
+        self.cache: "OrderedDict[int, Tuple[float, float]]" = OrderedDict()
+        self.in_flight: Dict[int, asyncio.Future] = {}
+
+    def cached(self, customer_id: int) -> Optional[float]:
+        entry = self.cache.get(customer_id)
+        if entry is None:
+            return None
+        score, fetched_at = entry
+        if time.monotonic() - fetched_at > self.cache_ttl:
+            del self.cache[customer_id]
+            return None
+        self.cache.move_to_end(customer_id)
+        return score
+
+    def remember(self, customer_id: int, score: float):
+        if self.cache_size <= 0:
+            return
+        self.cache[customer_id] = (score, time.monotonic())
+        self.cache.move_to_end(customer_id)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def invalidate(self, customer_id: int):
+        self.cache.pop(customer_id, None)
+
+    async def get_score(self, customer_id: int) -> float:
+        score = self.cached(customer_id)
+        if score is not None:
+            return score
+
+        # A second application while the first lookup is running waits for it
+        pending = self.in_flight.get(customer_id)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight[customer_id] = future
+        try:
+            score = await self._fetch_with_retries(customer_id)
+            self.remember(customer_id, score)
+            future.set_result(score)
+            return score
+        except BaseException as e:
+            future.set_exception(e if isinstance(e, CreditScoreUnavailable) else CreditScoreUnavailable(str(e)))
+            # Nobody else may be waiting; don't log "exception never retrieved"
+            future.exception()
+            raise
+        finally:
+            del self.in_flight[customer_id]
+
+    async def _fetch_with_retries(self, customer_id: int) -> float:
+        for attempt in range(self.retries + 1):
+            try:
+                return await asyncio.wait_for(self.provider.fetch(customer_id), self.timeout)
+            except (asyncio.TimeoutError, CreditScoreUnavailable) as e:
+                reason = "timeout" if isinstance(e, asyncio.TimeoutError) else str(e)
+                if attempt == self.retries:
+                    logger.error(f"Credit score lookup for customer {customer_id} failed after {attempt + 1} attempts: {reason}")
+                    raise CreditScoreUnavailable(reason) from e
+                logger.warning(f"Credit score lookup for customer {customer_id} failed ({reason}), retrying")
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    async def close(self):
+        await self.provider.close()
+
+def build_credit_score_provider() -> CreditScoreProvider:
+    if CREDIT_SCORE_BACKEND == "stub":
+        return StubCreditScoreProvider(CREDIT_SCORE_STUB_SEED)
+    if CREDIT_SCORE_BACKEND == "fixture":
+        return FixtureCreditScoreProvider(CREDIT_SCORE_FIXTURE, CREDIT_SCORE_STUB_SEED)
+    if CREDIT_SCORE_BACKEND == "http":
+        return HttpCreditScoreProvider(CREDIT_SCORE_URL, CREDIT_SCORE_TIMEOUT)
+    raise ValueError(f"Unknown credit score backend: {CREDIT_SCORE_BACKEND}")
+
+credit_scores = CreditScoreService(
+    build_credit_score_provider(),
+    timeout=CREDIT_SCORE_TIMEOUT,
+    retries=CREDIT_SCORE_RETRIES,
+    backoff_ms=CREDIT_SCORE_BACKOFF_MS,
+    cache_ttl=CREDIT_SCORE_CACHE_TTL,
+    cache_size=CREDIT_SCORE_CACHE_SIZE
+)
+
+def create_stub_app(delay_ms: int = 0, fail_rate: float = 0.0, seed: str = CREDIT_SCORE_STUB_SEED):
+    # Stand-in bureau for the http backend, optionally slow or flaky
+    from fastapi import FastAPI, HTTPException
+
+    stub = StubCreditScoreProvider(seed)
+    failures = random.Random()
+    app = FastAPI(title="Credit score stub")
+
+    @app.get("/scores/{customer_id}")
+    async def get_score(customer_id: int):
+        if delay_ms:
+            await asyncio.sleep(delay_ms / 1000)
+        if failures.random() < fail_rate:
+            raise HTTPException(status_code=503, detail="Stub failure")
+        return {"customer_id": customer_id, "score": stub.score(customer_id)}
+
+    return app
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve stub credit scores for the http backend")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--delay-ms", type=int, default=0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    import uvicorn
+    uvicorn.run(create_stub_app(args.delay_ms, args.fail_rate), host=args.host, port=args.port)
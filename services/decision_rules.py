@@ -0,0 +1,236 @@
+# services/decision_rules.py
+#
+# The loan decision rules. The thresholds are configured once in the
+# [DECISION_RULES] section of App.ini and compiled into a decision table: an
+# ordered list of rows, each a loan type plus value ranges for Bonität, DSCR
+# and CCR. The first matching row decides. Separately, the manager rules say
+# when a manager has to approve, whatever the decision.
+#
+# The same table scores a single application (loan_submit) or whole arrays of
+# them (what-if re-scoring). Every compiled ruleset has a version, label plus
+# a digest of the thresholds; applications store the version that decided
+# them, and decision_rulesets keeps the thresholds behind each version.
+#
+# App.ini is checked for changes every reload_interval_seconds; a changed
+# section is compiled and swapped in without a restart. A section that does
+# not compile is logged and the previous ruleset stays in use.
+import os
+import sys
+import json
+import asyncio
+import hashlib
+import logging
+import threading
+import configparser
+from datetime import datetime
+from typing import Any, NamedTuple, Optional, Tuple
+from sqlalchemy import text
+from starlette.concurrency import run_in_threadpool
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import CONFIG_FILE
+from db import engine
+
+logger = logging.getLogger(__name__)
+
+SECTION = "DECISION_RULES"
+
+class DecisionThresholds(NamedTuple):
+    boni_reject: float = 579     # below: rejected outright
+    boni_manager: float = 670    # below: a manager has to approve
+    dscr_manager: float = 1.4    # below: a manager has to approve
+    dscr_min: float = 1          # Baudarlehen below: rejected
+    dscr_strong: float = 2       # Baudarlehen from here on ccr_strong is enough
+    ccr_strong: float = 0.75
+    ccr_min: float = 1           # collateral needed with a DSCR below dscr_strong
+
+DEFAULT_THRESHOLDS = DecisionThresholds()
+
+# A value range low <= x < high; None leaves that side open (so inf is above
+# any bound). A row without a range for a value does not look at it.
+Range = Tuple[Optional[float], Optional[float]]
+
+class Rule(NamedTuple):
+    loan_type: Optional[str]    # None: any loan type
+    boni: Optional[Range]
+    dscr: Optional[Range]
+    ccr: Optional[Range]
+    decision: str               # "pending" or "rejected"
+    reason: str
+
+def in_range(value, bounds: Optional[Range]) -> bool:
+    # None (no value) and NaN are in no range
+    if bounds is None:
+        return True
+    if value is None:
+        return False
+    low, high = bounds
+    return (low is None or value >= low) and (high is None or value < high) and value == value
+
+def build_table(t: DecisionThresholds) -> Tuple[Rule, ...]:
+    # Approvals are only ever recommended: an employee makes the final
+    # decision, so a positive row is "pending" with the recommendation as reason
+    return (
+        Rule(None, (None, t.boni_reject), None, None, "rejected", "Boni zu niedrig"),
+        Rule("Sofortkredit", None, None, None, "pending", ""),
+        Rule("Baudarlehen", None, (None, t.dscr_min), None,
+             "rejected", f"DSCR zu niedrig für Baudarlehen (< {t.dscr_min:g})"),
+        Rule("Baudarlehen", None, (t.dscr_strong, None), (t.ccr_strong, None), "pending", "Genehmigung empfohlen"),
+        Rule("Baudarlehen", None, (t.dscr_min, t.dscr_strong), (t.ccr_min, None), "pending", "Genehmigung empfohlen"),
+        Rule("Baudarlehen", None, (t.dscr_min, t.dscr_strong), (None, t.ccr_min),
+             "pending", "Zusätzliche Sicherheit erforderlich (1 Monat Verzögerung)"),
+        Rule("Baudarlehen", None, (t.dscr_strong, None), (None, t.ccr_strong),
+             "pending", "Zusätzliche Sicherheit erforderlich (1 Monat Verzögerung)"),
+        Rule("Baudarlehen", None, None, None, "rejected", "Ungenügende DSCR oder CCR Werte"),
+        Rule(None, None, None, None, "rejected", "Unbekannter Kredittyp"),
+    )
+
+class DecisionBatch(NamedTuple):
+    rules: Any                   # array: index of the deciding row per application
+    needs_manager_approval: Any  # array: bool per application
+
+class Ruleset:
+    def __init__(self, thresholds: DecisionThresholds = DEFAULT_THRESHOLDS, label: str = "default"):
+        values = [float(v) for v in thresholds]
+        if any(v != v or v in (float("inf"), float("-inf")) for v in values):
+            raise ValueError("Decision thresholds must be finite numbers")
+        if thresholds.dscr_min > thresholds.dscr_strong:
+            raise ValueError("dscr_min must not be above dscr_strong")
+        self.thresholds = DecisionThresholds(*values)
+        digest = hashlib.sha256(json.dumps(self.thresholds._asdict(), sort_keys=True).encode("utf-8")).hexdigest()
+        self.version = f"{label}-{digest[:12]}"
+        self.rules = build_table(self.thresholds)
+
+    def needs_manager_approval(self, boni_score: Optional[float], dscr: Optional[float]) -> bool:
+        t = self.thresholds
+        return (
+            (boni_score is not None and boni_score < t.boni_manager)
+            or (dscr is not None and dscr < t.dscr_manager)
+        )
+
+    def match(self, boni_score: Optional[float], dscr: Optional[float], ccr: Optional[float], loan_type: str) -> Rule:
+        for rule in self.rules:
+            if (
+                (rule.loan_type is None or rule.loan_type == loan_type)
+                and in_range(boni_score, rule.boni)
+                and in_range(dscr, rule.dscr)
+                and in_range(ccr, rule.ccr)
+            ):
+                return rule
+        # The last row matches everything
+        raise AssertionError("Decision table without a catch-all row")
+
+    def evaluate(self, boni_score: Optional[float], dscr: Optional[float], ccr: Optional[float], loan_type: str) -> dict:
+        rule = self.match(boni_score, dscr, ccr, loan_type)
+        return {
+            "decision": rule.decision,
+            "reason": rule.reason,
+            "needs_manager_approval": self.needs_manager_approval(boni_score, dscr),
+            "ruleset_version": self.version
+        }
+
+    def evaluate_batch(self, boni_scores, dscrs, ccrs, loan_types) -> DecisionBatch:
+        # The table applied to whole arrays at once; None becomes NaN, which
+        # (like None above) is in no range
+        import numpy as np
+        boni = np.asarray(boni_scores, dtype=np.float64)
+        dscr = np.asarray(dscrs, dtype=np.float64)
+        ccr = np.asarray(ccrs, dtype=np.float64)
+        loan_types = np.asarray(loan_types, dtype=object)
+
+        def range_mask(values, bounds):
+            if bounds is None:
+                return np.ones(values.shape, dtype=bool)
+            mask = ~np.isnan(values)
+            low, high = bounds
+            if low is not None:
+                mask &= values >= low
+            if high is not None:
+                mask &= values < high
+            return mask
+
+        chosen = np.full(boni.shape, -1, dtype=np.int64)
+        open_rows = np.ones(boni.shape, dtype=bool)
+        for index, rule in enumerate(self.rules):
+            mask = open_rows & range_mask(boni, rule.boni) & range_mask(dscr, rule.dscr) & range_mask(ccr, rule.ccr)
+            if rule.loan_type is not None:
+                mask &= loan_types == rule.loan_type
+            chosen[mask] = index
+            open_rows &= ~mask
+
+        t = self.thresholds
+        needs_manager = (boni < t.boni_manager) | (dscr < t.dscr_manager)
+        return DecisionBatch(chosen, needs_manager)
+
+def read_ruleset(path: str = CONFIG_FILE) -> Ruleset:
+    parser = configparser.ConfigParser()
+    parser.read(path, encoding="utf-8-sig")
+    if not parser.has_section(SECTION):
+        return Ruleset()
+    unknown = set(parser.options(SECTION)) - set(DecisionThresholds._fields) - {"version", "reload_interval_seconds"}
+    if unknown:
+        raise ValueError(f"Unknown decision rule settings: {', '.join(sorted(unknown))}")
+    thresholds = DecisionThresholds(**{
+        field: parser.getfloat(SECTION, field, fallback=default)
+        for field, default in DEFAULT_THRESHOLDS._asdict().items()
+    })
+    return Ruleset(thresholds, parser.get(SECTION, "version", fallback="default"))
+
+def register_ruleset(ruleset: Ruleset):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO decision_rulesets (version, thresholds, created_at) VALUES (:version, :thresholds, :now) "
+            "ON CONFLICT (version) DO NOTHING"
+        ), {"version": ruleset.version, "thresholds": json.dumps(ruleset.thresholds._asdict()), "now": datetime.utcnow()})
+
+class DecisionRules:
+    # Holds the ruleset in use. current() is a plain attribute read; reload()
+    # does the file and database work and is run from a background task.
+    def __init__(self, path: str = CONFIG_FILE):
+        self.path = path
+        self.ruleset: Optional[Ruleset] = None
+        self.mtime: Optional[float] = None
+        self.lock = threading.Lock()
+
+    def current(self) -> Ruleset:
+        ruleset = self.ruleset
+        if ruleset is None:
+            ruleset = self.reload()
+        return ruleset
+
+    def reload(self, force: bool = False) -> Ruleset:
+        with self.lock:
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                mtime = None
+            if self.ruleset is not None and mtime == self.mtime and not force:
+                return self.ruleset
+
+            try:
+                ruleset = read_ruleset(self.path)
+            except (ValueError, configparser.Error) as e:
+                if self.ruleset is None:
+                    raise
+                logger.error(f"Invalid decision rules in {self.path}, keeping {self.ruleset.version}: {str(e)}")
+                self.mtime = mtime
+                return self.ruleset
+
+            self.mtime = mtime
+            if force or self.ruleset is None or ruleset.version != self.ruleset.version:
+                try:
+                    register_ruleset(ruleset)
+                except Exception as e:
+                    logger.warning(f"Could not record decision ruleset {ruleset.version}: {str(e)}")
+                logger.info(f"Decision ruleset {ruleset.version} in use")
+            self.ruleset = ruleset
+            return ruleset
+
+decision_rules = DecisionRules()
+
+async def reload_decision_rules_periodically(interval: int):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_in_threadpool(decision_rules.reload)
+        except Exception as e:
+            logger.error(f"Reloading decision rules failed: {str(e)}")
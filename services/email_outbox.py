@@ -0,0 +1,181 @@
+# services/email_outbox.py
+#
+# Transactional outbox for e-mails. Routes don't talk to SMTP: they add the
+# mail to email_outbox with enqueue_email() on their own session, so it is
+# committed (or rolled back) together with the change it reports. Worker
+# threads pick due mails up and send them; a failed send is retried with
+# exponential backoff until max_attempts.
+#
+# A worker claims up to batch_size due mails and sends them over one pooled
+# SMTP session (EmailService.deliver_many).
+#
+# Several workers (and several app processes) can poll the same table. A mail
+# is claimed by moving its next_attempt_at a lease into the future, which only
+# one UPDATE can do; the claim expires by itself if the worker dies, so a mail
+# is sent at least once.
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+from sqlalchemy import delete, select, update
+from starlette.concurrency import run_in_threadpool
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import (
+    EMAIL_OUTBOX_WORKERS, EMAIL_OUTBOX_POLL_INTERVAL, EMAIL_OUTBOX_BATCH_SIZE, EMAIL_OUTBOX_MAX_ATTEMPTS,
+    EMAIL_OUTBOX_BACKOFF, EMAIL_OUTBOX_MAX_BACKOFF, EMAIL_OUTBOX_LEASE, EMAIL_OUTBOX_KEEP_SENT_DAYS
+)
+from db import engine
+from models import EmailOutbox
+from services.email_service import email_service, OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+def enqueue_email(db, email: OutboundEmail):
+    # Works with Session and AsyncSession alike; the caller commits
+    db.add(EmailOutbox(
+        to_address=email.to_address,
+        subject=email.subject,
+        template=email.template,
+        context=json.dumps(email.context or {}, ensure_ascii=False),
+        status="pending",
+        attempts=0,
+        next_attempt_at=datetime.utcnow()
+    ))
+
+class EmailOutboxWorkers:
+    def __init__(
+        self,
+        send_many: Callable[[List[OutboundEmail]], List[Optional[Exception]]],
+        workers: int = EMAIL_OUTBOX_WORKERS,
+        poll_interval: float = EMAIL_OUTBOX_POLL_INTERVAL,
+        batch_size: int = EMAIL_OUTBOX_BATCH_SIZE,
+        max_attempts: int = EMAIL_OUTBOX_MAX_ATTEMPTS,
+        backoff: int = EMAIL_OUTBOX_BACKOFF,
+        max_backoff: int = EMAIL_OUTBOX_MAX_BACKOFF,
+        lease: int = EMAIL_OUTBOX_LEASE
+    ):
+        self.send_many = send_many
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.lease = lease
+        self.stopping = threading.Event()
+        self.threads: List[threading.Thread] = []
+
+    def retry_delay(self, attempts: int) -> float:
+        return min(self.backoff * 2 ** (attempts - 1), self.max_backoff)
+
+    def due_ids(self) -> List[int]:
+        with engine.connect() as conn:
+            return list(conn.execute(
+                select(EmailOutbox.id)
+                .where(EmailOutbox.status == "pending", EmailOutbox.next_attempt_at <= datetime.utcnow())
+                .order_by(EmailOutbox.next_attempt_at)
+                .limit(self.batch_size)
+            ).scalars())
+
+    def claim(self, mail_id: int) -> Optional[EmailOutbox]:
+        # Another worker may have taken it since due_ids(); rowcount tells
+        now = datetime.utcnow()
+        with engine.begin() as conn:
+            claimed = conn.execute(
+                update(EmailOutbox)
+                .where(EmailOutbox.id == mail_id, EmailOutbox.status == "pending", EmailOutbox.next_attempt_at <= now)
+                .values(next_attempt_at=now + timedelta(seconds=self.lease), attempts=EmailOutbox.attempts + 1)
+            ).rowcount
+            if not claimed:
+                return None
+            return conn.execute(select(EmailOutbox.__table__).where(EmailOutbox.id == mail_id)).first()
+
+    def record(self, row, error: Optional[Exception]):
+        if error is None:
+            # The context can hold a live reset link, so it is not kept once sent
+            with engine.begin() as conn:
+                conn.execute(update(EmailOutbox).where(EmailOutbox.id == row.id).values(
+                    status="sent", sent_at=datetime.utcnow(), context=None, last_error=None
+                ))
+            return
+
+        message = f"{type(error).__name__}: {error}"[:500]
+        with engine.begin() as conn:
+            if row.attempts >= self.max_attempts:
+                conn.execute(update(EmailOutbox).where(EmailOutbox.id == row.id).values(status="failed", last_error=message))
+                logger.error(f"Giving up on email {row.id} to {row.to_address} after {row.attempts} attempts: {message}")
+            else:
+                delay = self.retry_delay(row.attempts)
+                conn.execute(update(EmailOutbox).where(EmailOutbox.id == row.id).values(
+                    next_attempt_at=datetime.utcnow() + timedelta(seconds=delay), last_error=message
+                ))
+                logger.warning(f"Email {row.id} to {row.to_address} failed (attempt {row.attempts}), retrying in {delay:g}s: {message}")
+
+    def run_once(self) -> int:
+        # Sends what is due now as one batch; returns the number of mails handled
+        rows = [row for row in map(self.claim, self.due_ids()) if row is not None]
+        if not rows:
+            return 0
+        emails = [
+            OutboundEmail(row.to_address, row.subject, row.template, json.loads(row.context or "{}"))
+            for row in rows
+        ]
+        try:
+            errors = self.send_many(emails)
+        except Exception as e:
+            errors = [e] * len(rows)
+        for row, error in zip(rows, errors):
+            self.record(row, error)
+        return len(rows)
+
+    def _run(self):
+        while not self.stopping.is_set():
+            try:
+                handled = self.run_once()
+            except Exception as e:
+                logger.error(f"Email outbox worker error: {str(e)}")
+                handled = 0
+            # A full batch means there is probably more waiting
+            if handled < self.batch_size:
+                self.stopping.wait(self.poll_interval)
+
+    def start(self):
+        self.stopping.clear()
+        for n in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"email-outbox-{n}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        logger.info(f"Started {self.workers} email outbox workers")
+
+    def stop(self, timeout: float = 10):
+        # Mails being sent are finished; the rest stays in the table
+        self.stopping.set()
+        deadline = time.monotonic() + timeout
+        for thread in self.threads:
+            thread.join(max(0, deadline - time.monotonic()))
+        self.threads = []
+
+email_outbox = EmailOutboxWorkers(email_service.deliver_many)
+
+def purge_sent_emails(keep_days: int = EMAIL_OUTBOX_KEEP_SENT_DAYS) -> int:
+    cutoff = datetime.utcnow() - timedelta(days=keep_days)
+    with engine.begin() as conn:
+        purged = conn.execute(
+            delete(EmailOutbox).where(EmailOutbox.status == "sent", EmailOutbox.sent_at < cutoff)
+        ).rowcount
+    if purged:
+        logger.info(f"Cleaned {purged} sent emails from the outbox")
+    return purged
+
+async def purge_email_outbox_periodically(interval: int):
+    while True:
+        try:
+            await run_in_threadpool(purge_sent_emails)
+        except Exception as e:
+            logger.error(f"Purging the email outbox failed: {str(e)}")
+        await asyncio.sleep(interval)
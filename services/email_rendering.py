@@ -0,0 +1,233 @@
+# services/email_rendering.py
+#
+# Build-time work for the e-mail templates, done once per template instead of
+# once per mail:
+#
+# - inline_css() copies the rules of the template's <style> blocks into
+#   style="" attributes, since many mail clients ignore <style>. It works on
+#   the Jinja source, before compiling, so a rendered mail already carries the
+#   inlined styles. Simple selectors only (tag, .class, #id, combinations and
+#   descendants); others stay in the <style> block, which is kept as well.
+# - InlineCssLoader hands Jinja the inlined source; with a bytecode cache the
+#   compiled result is reused by later processes too.
+# - PlainTextLoader derives the text/plain alternative from the same template:
+#   html_to_text() is applied to the Jinja source, which leaves the Jinja tags
+#   in place, and the result is compiled as a template of its own. A
+#   hand-written <name>.txt next to the .html is used instead if there is one.
+import re
+import html
+from html.parser import HTMLParser
+from typing import Dict, List, Optional, Tuple
+from jinja2 import FileSystemLoader, TemplateNotFound
+
+VOID_ELEMENTS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+# One compound selector: optional tag, then any #id / .class parts
+COMPOUND = re.compile(r"^([a-z][a-z0-9]*)?((?:[.#][\w-]+)*)$", re.IGNORECASE)
+
+class Selector:
+    def __init__(self, parts: List[Tuple[Optional[str], Optional[str], Tuple[str, ...]]]):
+        self.parts = parts  # (tag, id, classes) per compound, outermost first
+        self.specificity = sum(
+            (100 if element_id else 0) + 10 * len(classes) + (1 if tag else 0)
+            for tag, element_id, classes in parts
+        )
+
+    @staticmethod
+    def matches_one(part, tag: str, attrs: Dict[str, str]) -> bool:
+        want_tag, want_id, want_classes = part
+        classes = attrs.get("class", "").split()
+        return (
+            (want_tag is None or want_tag == tag)
+            and (want_id is None or want_id == attrs.get("id"))
+            and all(c in classes for c in want_classes)
+        )
+
+    def matches(self, stack: List[Tuple[str, Dict[str, str]]]) -> bool:
+        # Last part on the element itself, the others on some ancestors in order
+        if not stack or not self.matches_one(self.parts[-1], *stack[-1]):
+            return False
+        remaining = list(self.parts[:-1])
+        for tag, attrs in reversed(stack[:-1]):
+            if not remaining:
+                break
+            if self.matches_one(remaining[-1], tag, attrs):
+                remaining.pop()
+        return not remaining
+
+def parse_selector(text: str) -> Optional[Selector]:
+    parts = []
+    for compound in text.split():
+        match = COMPOUND.match(compound)
+        if not match:
+            return None
+        tag, rest = match.group(1), re.findall(r"[.#][\w-]+", match.group(2))
+        element_id = next((p[1:] for p in rest if p[0] == "#"), None)
+        classes = tuple(p[1:] for p in rest if p[0] == ".")
+        parts.append((tag.lower() if tag else None, element_id, classes))
+    return Selector(parts) if parts else None
+
+def parse_css(css: str) -> List[Tuple[Selector, int, str]]:
+    # (selector, source order, declarations); @-rules are left alone
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.DOTALL)
+    css = re.sub(r"@[^{]+\{(?:[^{}]*\{[^{}]*\})*[^{}]*\}", "", css)
+    rules = []
+    for selectors, body in re.findall(r"([^{}]+)\{([^{}]*)\}", css):
+        declarations = "; ".join(d.strip() for d in body.split(";") if d.strip())
+        for text in selectors.split(","):
+            selector = parse_selector(text.strip())
+            if selector is not None and declarations:
+                rules.append((selector, len(rules), declarations))
+    # Least specific first, so more specific declarations come later and win
+    return sorted(rules, key=lambda rule: (rule[0].specificity, rule[1]))
+
+class _StyleCollector(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.in_style = False
+        self.css: List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        self.in_style = tag == "style"
+
+    def handle_endtag(self, tag):
+        if tag == "style":
+            self.in_style = False
+
+    def handle_data(self, data):
+        if self.in_style:
+            self.css.append(data)
+
+class _StyleInliner(HTMLParser):
+    def __init__(self, source: str, rules):
+        super().__init__(convert_charrefs=False)
+        self.rules = rules
+        self.line_offsets = [0]
+        for line in source.splitlines(keepends=True):
+            self.line_offsets.append(self.line_offsets[-1] + len(line))
+        self.stack: List[Tuple[str, Dict[str, str]]] = []
+        self.replacements: List[Tuple[int, str, str]] = []  # (offset, old tag text, new tag text)
+
+    def source_offset(self) -> int:
+        line, column = self.getpos()
+        return self.line_offsets[line - 1] + column
+
+    def styled_tag(self, tag: str, attrs: Dict[str, str]) -> Optional[str]:
+        declarations = [d for selector, _, d in self.rules if selector.matches(self.stack)]
+        if not declarations:
+            return None
+        text = self.get_starttag_text()
+        style = "; ".join(declarations)
+        existing = re.search(r"""\sstyle\s*=\s*(["'])(.*?)\1""", text, re.IGNORECASE | re.DOTALL)
+        if existing:
+            # The element's own style attribute wins
+            quote = existing.group(1)
+            merged = f' style={quote}{html.escape(style)}; {existing.group(2)}{quote}'
+            return text[:existing.start()] + merged + text[existing.end():]
+        end = len(text) - (2 if text.endswith("/>") else 1)
+        return f'{text[:end].rstrip()} style="{html.escape(style)}"{text[end:]}'
+
+    def handle_starttag(self, tag, attr_list):
+        attrs = {name: value or "" for name, value in attr_list}
+        self.stack.append((tag, attrs))
+        if tag not in ("html", "head", "style", "title", "meta", "link", "script"):
+            new_text = self.styled_tag(tag, attrs)
+            if new_text is not None:
+                self.replacements.append((self.source_offset(), self.get_starttag_text(), new_text))
+        if tag in VOID_ELEMENTS:
+            self.stack.pop()
+
+    def handle_startendtag(self, tag, attr_list):
+        self.handle_starttag(tag, attr_list)
+        if tag not in VOID_ELEMENTS:
+            self.stack.pop()
+
+    def handle_endtag(self, tag):
+        # Pop back to the matching element; stray end tags are ignored
+        for i in range(len(self.stack) - 1, -1, -1):
+            if self.stack[i][0] == tag:
+                del self.stack[i:]
+                break
+
+def inline_css(source: str) -> str:
+    collector = _StyleCollector()
+    collector.feed(source)
+    collector.close()
+    rules = parse_css("\n".join(collector.css))
+    if not rules:
+        return source
+
+    inliner = _StyleInliner(source, rules)
+    inliner.feed(source)
+    inliner.close()
+    for offset, old_text, new_text in reversed(inliner.replacements):
+        if source[offset:offset + len(old_text)] != old_text:
+            raise ValueError(f"Could not inline CSS at offset {offset}")
+        source = source[:offset] + new_text + source[offset + len(old_text):]
+    return source
+
+class InlineCssLoader(FileSystemLoader):
+    def get_source(self, environment, template):
+        source, filename, uptodate = super().get_source(environment, template)
+        if template.endswith(".html"):
+            source = inline_css(source)
+        return source, filename, uptodate
+
+class PlainTextLoader(FileSystemLoader):
+    # Loaded by the .html name, so both parts of a mail use the same name
+    def get_source(self, environment, template):
+        if template.endswith(".html"):
+            try:
+                return super().get_source(environment, template[:-len(".html")] + ".txt")
+            except TemplateNotFound:
+                source, filename, uptodate = super().get_source(environment, template)
+                return html_to_text(source), filename, uptodate
+        return super().get_source(environment, template)
+
+BLOCK_ELEMENTS = {"p", "div", "h1", "h2", "h3", "h4", "h5", "h6", "ul", "ol", "table", "tr", "blockquote", "section"}
+SKIPPED_ELEMENTS = {"head", "style", "script", "title"}
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self.skipping = 0
+        self.link: Optional[str] = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_ELEMENTS:
+            self.skipping += 1
+        elif tag in BLOCK_ELEMENTS:
+            self.parts.append("\n\n")
+        elif tag == "br":
+            self.parts.append("\n")
+        elif tag == "li":
+            self.parts.append("\n- ")
+        elif tag == "a":
+            self.link = dict(attrs).get("href")
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_ELEMENTS:
+            self.skipping = max(0, self.skipping - 1)
+        elif tag in BLOCK_ELEMENTS:
+            self.parts.append("\n\n")
+        elif tag == "a" and self.link:
+            # Links keep their target; a link showing its own URL only once
+            if not "".join(self.parts).rstrip().endswith(self.link):
+                self.parts.append(f" ({self.link})")
+            self.link = None
+
+    def handle_data(self, data):
+        if not self.skipping:
+            self.parts.append(re.sub(r"\s+", " ", data))
+
+def tidy_text(text: str) -> str:
+    # At most one blank line in a row, e.g. where a Jinja block rendered empty
+    lines = [line.strip() for line in text.split("\n")]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip() + "\n"
+
+def html_to_text(markup: str) -> str:
+    extractor = _TextExtractor()
+    extractor.feed(markup)
+    extractor.close()
+    return tidy_text("".join(extractor.parts))
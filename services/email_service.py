@@ -1,16 +1,33 @@
 # services/email_service.py
 import os
 import sys
-import smtplib
+import secrets
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from jinja2 import Environment, FileSystemLoader, select_autoescape
+from typing import List, NamedTuple, Optional, Union
+from jinja2 import Environment, FileSystemBytecodeCache, select_autoescape
 import logging
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from config import SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASS, SMTP_TLS
+from config import (
+    SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASS, SMTP_TLS,
+    SMTP_POOL_SIZE, SMTP_TIMEOUT, SMTP_CHECK_AFTER, SMTP_MAX_MESSAGES,
+    EMAIL_TEMPLATE_CACHE_DIR, EMAIL_RENDER_WORKERS, EMAIL_RENDER_POOL_MIN
+)
+from services.smtp_pool import SmtpConnectionPool
+from services.email_rendering import InlineCssLoader, PlainTextLoader, tidy_text
 
 
 logger = logging.getLogger(__name__)
+
+class OutboundEmail(NamedTuple):
+    to_address: str
+    subject: str
+    template: str               # email_templates/<template>.html
+    context: Optional[dict]     # template variables, JSON-serialisable
+
 class EmailService:
     def __init__(self):
         # Create templates directory if it doesn't exist
@@ -18,72 +35,156 @@ class EmailService:
         self.root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         self.templates_dir = os.path.join(self.root_dir, "email_templates")
             
-        # Set up Jinja2 environment for email templates
+        # Set up Jinja2 environment for email templates: CSS is inlined when a
+        # template is loaded, compiled templates stay in memory and on disk
+        html_cache = text_cache = None
+        if EMAIL_TEMPLATE_CACHE_DIR:
+            # Own directories: both kinds are cached under the same template name
+            os.makedirs(os.path.join(EMAIL_TEMPLATE_CACHE_DIR, "html"), exist_ok=True)
+            os.makedirs(os.path.join(EMAIL_TEMPLATE_CACHE_DIR, "text"), exist_ok=True)
+            html_cache = FileSystemBytecodeCache(os.path.join(EMAIL_TEMPLATE_CACHE_DIR, "html"))
+            text_cache = FileSystemBytecodeCache(os.path.join(EMAIL_TEMPLATE_CACHE_DIR, "text"))
         self.env = Environment(
-            loader=FileSystemLoader(self.templates_dir),
-            autoescape=select_autoescape(['html', 'xml'])
+            loader=InlineCssLoader(self.templates_dir),
+            autoescape=select_autoescape(['html', 'xml']),
+            bytecode_cache=html_cache
+        )
+        # The text/plain part, derived from the same templates; nothing to escape
+        self.text_env = Environment(
+            loader=PlainTextLoader(self.templates_dir),
+            autoescape=False,
+            bytecode_cache=text_cache
         )
+        self.render_workers = EMAIL_RENDER_WORKERS
+        self.render_pool_min = EMAIL_RENDER_POOL_MIN
+        self.render_pool: Optional[ProcessPoolExecutor] = None
+        self.render_pool_lock = threading.Lock()
         
         # Check if SMTP is configured
         self.is_configured = bool(SMTP_HOST and SMTP_USER and SMTP_PASS)
         if not self.is_configured:
             logger.error("SMTP not fully configured. Emails will not be sent.")
+        # No connection is opened until the first mail
+        self.pool = SmtpConnectionPool(
+            SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASS, SMTP_TLS,
+            size=SMTP_POOL_SIZE,
+            timeout=SMTP_TIMEOUT,
+            check_after=SMTP_CHECK_AFTER,
+            max_messages=SMTP_MAX_MESSAGES
+        )
+
+    def precompile(self) -> int:
+        # Called at startup, so no mail pays for inlining and compiling
+        names = [name for name in self.env.list_templates() if name.endswith(".html")]
+        for name in names:
+            self.env.get_template(name)
+            self.text_env.get_template(name)
+        logger.info(f"Compiled {len(names)} email templates")
+        return len(names)
+
+    def render(self, email: OutboundEmail) -> MIMEMultipart:
+        # Get templates and render with context
+        name = f"{email.template}.html"
+        context = email.context or {}
+        html_content = self.env.get_template(name).render(**context)
+        text_content = tidy_text(self.text_env.get_template(name).render(**context))
+        
+        # Create multipart message
+        # A random boundary of our own: the generator would otherwise compile
+        # a regex per mail to check that its boundary is not in the body
+        msg = MIMEMultipart("alternative", boundary=f"=={secrets.token_hex(16)}==")
+        msg["Subject"] = email.subject
+        msg["From"] = SMTP_USER
+        msg["To"] = email.to_address
+        
+        # Plain text first: clients show the last part they can display
+        msg.attach(MIMEText(text_content, "plain", "utf-8"))
+        msg.attach(MIMEText(html_content, "html", "utf-8"))
+        return msg
+
+    def render_many(self, emails: List[OutboundEmail]) -> List[Union[str, Exception]]:
+        # The finished message text per mail, or the error rendering it
+        if self.render_workers <= 0 or len(emails) < self.render_pool_min:
+            return [_render_message(email) for email in emails]
+        with self.render_pool_lock:
+            if self.render_pool is None:
+                # Spawned, not forked: the app process has threads and open sockets
+                self.render_pool = ProcessPoolExecutor(
+                    max_workers=self.render_workers, mp_context=multiprocessing.get_context("spawn")
+                )
+        chunk_size = -(-len(emails) // self.render_workers)
+        chunks = [emails[i:i + chunk_size] for i in range(0, len(emails), chunk_size)]
+        try:
+            return [result for chunk in self.render_pool.map(_render_messages, chunks) for result in chunk]
+        except Exception as e:
+            # A broken pool is replaced on the next batch; this one renders here
+            logger.error(f"Email render workers failed, rendering {len(emails)} emails in-process: {str(e)}")
+            with self.render_pool_lock:
+                self.render_pool.shutdown(wait=False, cancel_futures=True)
+                self.render_pool = None
+            return [_render_message(email) for email in emails]
+
+    def deliver(self, email: OutboundEmail):
+        # Raises on any failure; the outbox workers retry
+        if not self.is_configured:
+            raise RuntimeError("SMTP not configured")
+        msg = self.render(email)
+        self.pool.send(SMTP_USER, [email.to_address], msg.as_string())
+        logger.info(f"Email sent to {email.to_address}: {email.subject}")
+
+    def deliver_many(self, emails: List[OutboundEmail]) -> List[Optional[Exception]]:
+        # One SMTP session for the whole list; None or the error per mail
+        if not self.is_configured:
+            return [RuntimeError("SMTP not configured")] * len(emails)
+        results: List[Optional[Exception]] = [None] * len(emails)
+        messages, indexes = [], []
+        for i, (email, rendered) in enumerate(zip(emails, self.render_many(emails))):
+            if isinstance(rendered, Exception):
+                results[i] = rendered
+            else:
+                messages.append((SMTP_USER, [email.to_address], rendered))
+                indexes.append(i)
+        for i, error in zip(indexes, self.pool.send_many(messages)):
+            results[i] = error
+        sent = sum(1 for error in results if error is None)
+        logger.info(f"Sent {sent} of {len(emails)} emails in one SMTP session")
+        return results
+
+    def close(self):
+        self.pool.close()
+        if self.render_pool is not None:
+            self.render_pool.shutdown(wait=False, cancel_futures=True)
 
     def send_email(self, to_address, subject, template_name, context=None):
+        # Synchronous send, bypassing the outbox
         if not self.is_configured:
             logger.warning(f"Email to {to_address} not sent: SMTP not configured")
             return False
             
-        if context is None:
-            context = {}
-            
         try:
-            # Get template and render with context
-            template = self.env.get_template(f"{template_name}.html")
-            html_content = template.render(**context)
-            
-            # Create multipart message
-            msg = MIMEMultipart("alternative")
-            msg["Subject"] = subject
-            msg["From"] = SMTP_USER
-            msg["To"] = to_address
-            
-            # Add HTML part
-            part = MIMEText(html_content, "html")
-            msg.attach(part)
-            
-            # Connect to SMTP and send
-            server = smtplib.SMTP(SMTP_HOST, SMTP_PORT)
-            try:
-                if SMTP_TLS:
-                    server.starttls()
-                server.login(SMTP_USER, SMTP_PASS)
-                server.sendmail(SMTP_USER, [to_address], msg.as_string())
-                logger.info(f"Email sent to {to_address}: {subject}")
-                return True
-            finally:
-                server.quit()
-                
+            self.deliver(OutboundEmail(to_address, subject, template_name, context or {}))
+            return True
         except Exception as e:
             logger.error(f"Failed to send email to {to_address}: {str(e)}")
             return False
-            
-    def send_welcome_email(self, to_address, first_name):
+
+    # Message builders; routes put these into the outbox (services.email_outbox)
+    def welcome_email(self, to_address, first_name) -> OutboundEmail:
         subject = "Willkommen bei Kreditbank - Ihr Konto wurde erstellt"
         context = {"first_name": first_name}
-        return self.send_email(to_address, subject, "welcome", context)
+        return OutboundEmail(to_address, subject, "welcome", context)
         
-    def send_password_reset_email(self, to_address, first_name, reset_link):
+    def password_reset_email(self, to_address, first_name, reset_link) -> OutboundEmail:
         subject = "Kreditbank - Link zum Zurücksetzen Ihres Passworts"
         context = {"first_name": first_name, "reset_link": reset_link}
-        return self.send_email(to_address, subject, "password_reset", context)
+        return OutboundEmail(to_address, subject, "password_reset", context)
         
-    def send_password_changed_email(self, to_address, first_name):
+    def password_changed_email(self, to_address, first_name) -> OutboundEmail:
         subject = "Kreditbank - Ihr Passwort wurde geändert"
         context = {"first_name": first_name}
-        return self.send_email(to_address, subject, "password_changed", context)
+        return OutboundEmail(to_address, subject, "password_changed", context)
         
-    def send_loan_status_email(self, to_address, first_name, application_date, loan_type, status, reason=None):
+    def loan_status_email(self, to_address, first_name, application_date, loan_type, status, reason=None) -> OutboundEmail:
         subject = "Kreditbank - Update zu Ihrem Kreditantrag"
         context = {
             "first_name": first_name,
@@ -92,7 +193,19 @@ class EmailService:
             "status": status,
             "reason": reason
         }
-        return self.send_email(to_address, subject, "loan_status", context)
+        return OutboundEmail(to_address, subject, "loan_status", context)
+
+    def send_welcome_email(self, to_address, first_name):
+        return self.send_email(*self.welcome_email(to_address, first_name))
+        
+    def send_password_reset_email(self, to_address, first_name, reset_link):
+        return self.send_email(*self.password_reset_email(to_address, first_name, reset_link))
+        
+    def send_password_changed_email(self, to_address, first_name):
+        return self.send_email(*self.password_changed_email(to_address, first_name))
+        
+    def send_loan_status_email(self, to_address, first_name, application_date, loan_type, status, reason=None):
+        return self.send_email(*self.loan_status_email(to_address, first_name, application_date, loan_type, status, reason))
         
     def send_custom_email(self, to_address, subject, html_content):
         if not self.is_configured:
@@ -110,20 +223,23 @@ class EmailService:
             part = MIMEText(html_content, "html")
             msg.attach(part)
             
-            # Connect to SMTP and send
-            server = smtplib.SMTP(SMTP_HOST, SMTP_PORT)
-            try:
-                if SMTP_TLS:
-                    server.starttls()
-                server.login(SMTP_USER, SMTP_PASS)
-                server.sendmail(SMTP_USER, [to_address], msg.as_string())
-                print(f"Custom email sent to {to_address}: {subject}")
-                return True
-            finally:
-                server.quit()
+            self.pool.send(SMTP_USER, [to_address], msg.as_string())
+            print(f"Custom email sent to {to_address}: {subject}")
+            return True
                 
         except Exception as e:
             logger.error(f"Failed to send custom email to {to_address}: {str(e)}")
             return False
 
-email_service = EmailService()
\ No newline at end of file
+email_service = EmailService()
+
+def _render_message(email: OutboundEmail) -> Union[str, Exception]:
+    try:
+        return email_service.render(email).as_string()
+    except Exception as e:
+        logger.error(f"Failed to render email {email.template} to {email.to_address}: {str(e)}")
+        return e
+
+def _render_messages(emails: List[OutboundEmail]) -> List[Union[str, Exception]]:
+    # Runs in a render worker, which loads the templates from the bytecode cache
+    return [_render_message(email) for email in emails]
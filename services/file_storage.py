@@ -0,0 +1,242 @@
+# services/file_storage.py
+import os
+import sys
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import BinaryIO, Callable, Iterable, Iterator, NamedTuple, Optional
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import STORAGE_BACKEND, STORAGE_PATH
+
+try:
+    import fcntl
+except ImportError:  # Windows: the in-process lock has to do
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+class StoredBlob(NamedTuple):
+    sha256: str
+    size: int
+
+# Incremental writer: hashes while writing so content never has to be held
+# in memory. Nothing is visible in the store until commit(). The writer keeps
+# its own copy until release(), which the caller does once the row that
+# references the blob is committed: a delete of the same content running in
+# between may have removed the blob again, and release() puts it back.
+class BlobWriter(ABC):
+    @abstractmethod
+    def write(self, chunk: bytes) -> None:
+        pass
+
+    @property
+    @abstractmethod
+    def size(self) -> int:
+        pass
+
+    @abstractmethod
+    def commit(self) -> StoredBlob:
+        pass
+
+    @abstractmethod
+    def release(self) -> None:
+        pass
+
+    @abstractmethod
+    def discard(self) -> None:
+        pass
+
+# Content-addressed storage for uploaded documents, keyed by SHA-256.
+# Identical content is stored once; File rows only keep the digest, so a blob
+# may only go once no row references it. delete_unreferenced() checks that and
+# deletes under lock(), which BlobWriter.release() takes as well.
+class FileStorage(ABC):
+    @abstractmethod
+    def open_writer(self) -> BlobWriter:
+        pass
+
+    def save(self, chunks: Iterable[bytes]) -> StoredBlob:
+        writer = self.open_writer()
+        try:
+            for chunk in chunks:
+                writer.write(chunk)
+        except BaseException:
+            writer.discard()
+            raise
+        # For callers that don't race deletes (migrations); routes release
+        # only after their row is committed
+        stored = writer.commit()
+        writer.release()
+        return stored
+
+    def save_bytes(self, data: bytes) -> StoredBlob:
+        return self.save([data])
+
+    @abstractmethod
+    def open(self, sha256: str) -> BinaryIO:
+        pass
+
+    def iter_chunks(self, sha256: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        with self.open(sha256) as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def local_path(self, sha256: str) -> Optional[str]:
+        # Backends that keep blobs on local disk return a path so responses can use sendfile
+        return None
+
+    @abstractmethod
+    def size(self, sha256: str) -> int:
+        pass
+
+    @abstractmethod
+    def exists(self, sha256: str) -> bool:
+        pass
+
+    @abstractmethod
+    def delete(self, sha256: str) -> None:
+        pass
+
+    @abstractmethod
+    def lock(self, sha256: str):
+        pass
+
+    def delete_unreferenced(self, sha256: str, is_referenced: Callable[[], bool]) -> bool:
+        # is_referenced must see committed rows only, e.g. a fresh query
+        with self.lock(sha256):
+            if is_referenced():
+                return False
+            self.delete(sha256)
+            return True
+
+class LocalBlobWriter(BlobWriter):
+    def __init__(self, storage: "LocalFileStorage"):
+        self.storage = storage
+        self.digest = hashlib.sha256()
+        self._size = 0
+        fd, self.tmp_path = tempfile.mkstemp(dir=storage.root, prefix=".upload-")
+        self.tmp = os.fdopen(fd, "wb")
+
+    def write(self, chunk: bytes) -> None:
+        self.digest.update(chunk)
+        self._size += len(chunk)
+        self.tmp.write(chunk)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def commit(self) -> StoredBlob:
+        self.tmp.close()
+        self.sha256 = self.digest.hexdigest()
+        return self.storage._commit(self.tmp_path, self.sha256, self._size)
+
+    def release(self) -> None:
+        self.storage._release(self.tmp_path, self.sha256)
+
+    def discard(self) -> None:
+        self.tmp.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+class LocalFileStorage(FileStorage):
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+        # One lock for the whole store: it is only held for a few file system
+        # operations and a reference query. The lock file covers the other
+        # worker processes, the thread lock the threads of this one.
+        self.lock_path = os.path.join(self.root, ".lock")
+        self.thread_lock = threading.Lock()
+
+    def _path(self, sha256: str) -> str:
+        if len(sha256) != 64 or any(c not in "0123456789abcdef" for c in sha256):
+            raise ValueError(f"Invalid SHA-256 digest: {sha256}")
+        # Two-level fan-out keeps directories small
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def open_writer(self) -> BlobWriter:
+        return LocalBlobWriter(self)
+
+    @contextmanager
+    def lock(self, sha256: str):
+        with self.thread_lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.lock_path, "a") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _publish(self, tmp_path: str, path: str) -> None:
+        # Links instead of moving, the writer's copy stays until release()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.link(tmp_path, path)
+        except FileExistsError:
+            pass
+        except OSError:
+            # No hard links on this file system
+            shutil.copyfile(tmp_path, path + ".part")
+            os.replace(path + ".part", path)
+
+    def _commit(self, tmp_path: str, sha256: str, size: int) -> StoredBlob:
+        path = self._path(sha256)
+        with self.lock(sha256):
+            if os.path.exists(path):
+                logger.debug(f"Blob {sha256} already stored, deduplicated")
+            else:
+                self._publish(tmp_path, path)
+                logger.debug(f"Stored blob {sha256} ({size} bytes)")
+        return StoredBlob(sha256, size)
+
+    def _release(self, tmp_path: str, sha256: str) -> None:
+        path = self._path(sha256)
+        with self.lock(sha256):
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+                logger.warning(f"Blob {sha256} was deleted during the upload, stored it again")
+                return
+        os.remove(tmp_path)
+
+    def open(self, sha256: str) -> BinaryIO:
+        return open(self._path(sha256), "rb")
+
+    def local_path(self, sha256: str) -> Optional[str]:
+        return self._path(sha256)
+
+    def size(self, sha256: str) -> int:
+        return os.path.getsize(self._path(sha256))
+
+    def exists(self, sha256: str) -> bool:
+        return os.path.exists(self._path(sha256))
+
+    def delete(self, sha256: str) -> None:
+        try:
+            os.remove(self._path(sha256))
+            logger.debug(f"Deleted blob {sha256}")
+        except FileNotFoundError:
+            pass
+
+def build_file_storage() -> FileStorage:
+    if STORAGE_BACKEND == "local":
+        root = STORAGE_PATH
+        if not os.path.isabs(root):
+            root = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), root)
+        return LocalFileStorage(root)
+    raise ValueError(f"Unknown storage backend: {STORAGE_BACKEND}")
+
+file_storage = build_file_storage()
@@ -0,0 +1,75 @@
+# services/identity_cache.py
+import os
+import sys
+import time
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import IDENTITY_CACHE_SIZE, IDENTITY_CACHE_TTL
+
+logger = logging.getLogger(__name__)
+
+# What request handlers need to know about the logged-in user. Handlers only
+# read these fields, so a detached snapshot is enough and saves a Person query.
+@dataclass(frozen=True)
+class UserIdentity:
+    id: int
+    person_type: str
+    first_name: str
+    second_name: str
+    email: str
+
+    @classmethod
+    def from_person(cls, person) -> "UserIdentity":
+        return cls(
+            id=person.id,
+            person_type=person.person_type,
+            first_name=person.first_name,
+            second_name=person.second_name,
+            email=person.email
+        )
+
+class IdentityCache:
+    # Bounded LRU of identity snapshots by person id. Entries expire after
+    # ttl seconds so changes made by another worker are picked up.
+    def __init__(self, max_size: int, ttl: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, person_id: int) -> Optional[UserIdentity]:
+        with self.lock:
+            entry = self.entries.get(person_id)
+            if entry is None:
+                return None
+            identity, stored_at = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self.entries[person_id]
+                return None
+            self.entries.move_to_end(person_id)
+            return identity
+
+    def put(self, identity: UserIdentity) -> UserIdentity:
+        if self.max_size <= 0:
+            return identity
+        with self.lock:
+            self.entries[identity.id] = (identity, time.monotonic())
+            self.entries.move_to_end(identity.id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return identity
+
+    def invalidate(self, person_id: int) -> None:
+        with self.lock:
+            self.entries.pop(person_id, None)
+        logger.debug(f"Invalidated cached identity of user {person_id}")
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+identity_cache = IdentityCache(max_size=IDENTITY_CACHE_SIZE, ttl=IDENTITY_CACHE_TTL)
@@ -0,0 +1,141 @@
+# services/log_pipeline.py
+#
+# Logging off the request path. Loggers hand records to a bounded in-memory
+# queue (QueueHandler); one background thread (QueueListener) formats them
+# and writes JSON lines to a size-rotated file and, optionally, plain text to
+# the console. A full queue drops records instead of blocking a request; the
+# number dropped is reported once there is room again.
+#
+# Debug records of chatty loggers can be sampled: "routes.utils = 0.01" keeps
+# one in a hundred of that logger's (and its children's) DEBUG records.
+# INFO and above are never sampled.
+import os
+import sys
+import json
+import queue
+import logging
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import LOG_LEVEL, LOG_FILE, LOG_MAX_MB, LOG_BACKUPS, LOG_CONSOLE, LOG_QUEUE_SIZE, LOG_SAMPLING
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+def parse_sampling(spec: str) -> Dict[str, float]:
+    # "main = 0.01, routes.utils = 0.1"
+    rates = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        name, _, rate = part.partition("=")
+        rate = float(rate)
+        if not 0 <= rate <= 1:
+            raise ValueError(f"Invalid log sampling rate: {part.strip()}")
+        rates[name.strip()] = rate
+    return rates
+
+class SamplingFilter(logging.Filter):
+    # Keeps every n-th DEBUG record per configured logger (n = 1 / rate);
+    # counting instead of random draws keeps the output evenly spread
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        # Longest name first, so "routes.utils" wins over "routes"
+        self.rates = sorted(rates.items(), key=lambda item: -len(item[0]))
+        self.counters: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or not self.rates:
+            return True
+        for name, rate in self.rates:
+            if record.name == name or record.name.startswith(name + "."):
+                if rate <= 0:
+                    return False
+                every = round(1 / rate)
+                with self.lock:
+                    count = self.counters.get(name, 0)
+                    self.counters[name] = count + 1
+                return count % every == 0
+        return True
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+        }
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+class DroppingQueueHandler(QueueHandler):
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resolve message and traceback to text here, so the record carries no
+        # references across to the writer thread; exc_text stays separate for
+        # the JSON "exception" field. The queue handler sits on the root
+        # logger and runs last, so the record can be changed in place.
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg, record.args, record.exc_info = record.message, None, None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            notice = logging.makeLogRecord({
+                "name": __name__, "levelno": logging.WARNING, "levelname": "WARNING",
+                "msg": f"Log queue was full, dropped {dropped} records",
+            })
+            try:
+                self.queue.put_nowait(notice)
+            except queue.Full:
+                self.dropped += dropped
+
+def setup_logging(
+    level: str = LOG_LEVEL,
+    log_file: str = LOG_FILE,
+    max_mb: int = LOG_MAX_MB,
+    backups: int = LOG_BACKUPS,
+    console: bool = LOG_CONSOLE,
+    queue_size: int = LOG_QUEUE_SIZE,
+    sampling: str = LOG_SAMPLING
+) -> QueueListener:
+    # Replaces the root logger's handlers; call stop() on the returned
+    # listener at shutdown to flush what is still queued
+    handlers = []
+    if log_file:
+        file_handler = RotatingFileHandler(log_file, maxBytes=max_mb * 1024 * 1024, backupCount=backups, encoding="utf-8")
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+    if console:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+        handlers.append(console_handler)
+
+    queue_handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    queue_handler.addFilter(SamplingFilter(parse_sampling(sampling)))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level.upper())
+
+    listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -0,0 +1,115 @@
+# services/password_hasher.py
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+import bcrypt
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import PASSWORD_BCRYPT_ROUNDS, PASSWORD_TARGET_MS, PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_QUEUE
+
+logger = logging.getLogger(__name__)
+
+# Never calibrate below this cost, whatever the hardware
+MIN_ROUNDS = 10
+MAX_ROUNDS = 16
+DEFAULT_ROUNDS = 12
+
+class PasswordHasherBusy(Exception):
+    pass
+
+def bcrypt_cost(password_hash: str) -> Optional[int]:
+    # "$2b$12$<salt+hash>" -> 12
+    try:
+        return int(password_hash.split("$")[2])
+    except (IndexError, ValueError):
+        return None
+
+def time_rounds(rounds: int) -> float:
+    start = time.perf_counter()
+    bcrypt.hashpw(b"calibration", bcrypt.gensalt(rounds))
+    return time.perf_counter() - start
+
+def calibrate_rounds(target_ms: int, min_rounds: int = MIN_ROUNDS, max_rounds: int = MAX_ROUNDS) -> int:
+    # Highest cost whose hash still takes at most target_ms here. Each extra
+    # round doubles the work, so stop as soon as the next one would overshoot.
+    rounds = min_rounds
+    elapsed = time_rounds(rounds)
+    while rounds < max_rounds and elapsed * 2 * 1000 <= target_ms:
+        rounds += 1
+        elapsed = time_rounds(rounds)
+    if elapsed * 1000 > target_ms and rounds > min_rounds:
+        rounds -= 1
+    return rounds
+
+class PasswordHasher:
+    # bcrypt is slow on purpose and releases the GIL, so it runs on its own
+    # small executor rather than in the request threadpool: a login burst
+    # queues here without starving other requests. Once max_queue jobs are
+    # waiting, further requests are refused straight away (503) instead of
+    # piling up behind each other.
+    def __init__(self, rounds: Optional[int], target_ms: int, workers: int, max_queue: int):
+        # rounds=None: calibrate for target_ms at startup
+        self.auto_rounds = rounds is None
+        self.rounds = rounds or DEFAULT_ROUNDS
+        self.target_ms = target_ms
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self.capacity = workers + max_queue
+        self.pending = 0
+
+    def calibrate(self) -> int:
+        self.rounds = calibrate_rounds(self.target_ms)
+        logger.info(f"bcrypt cost calibrated to {self.rounds} for a target of {self.target_ms} ms")
+        return self.rounds
+
+    async def _run(self, fn, *args):
+        # Only touched from the event loop, no lock needed for the counter
+        if self.pending >= self.capacity:
+            logger.warning(f"Password hashing queue full ({self.pending} pending), rejecting request")
+            raise PasswordHasherBusy()
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        hashed = await self._run(bcrypt.hashpw, password.encode("utf-8"), bcrypt.gensalt(self.rounds))
+        return hashed.decode("utf-8")
+
+    async def verify(self, password: str, password_hash: str) -> bool:
+        return await self._run(bcrypt.checkpw, password.encode("utf-8"), password_hash.encode("utf-8"))
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        # Only upgrade: a hash stronger than the current (possibly calibrated
+        # lower) cost is kept as it is
+        cost = bcrypt_cost(password_hash)
+        return cost is not None and cost < self.rounds
+
+def build_password_hasher() -> PasswordHasher:
+    rounds = None if PASSWORD_BCRYPT_ROUNDS == "auto" else int(PASSWORD_BCRYPT_ROUNDS)
+    return PasswordHasher(
+        rounds=rounds,
+        target_ms=PASSWORD_TARGET_MS,
+        workers=PASSWORD_HASH_WORKERS,
+        max_queue=PASSWORD_HASH_MAX_QUEUE
+    )
+
+password_hasher = build_password_hasher()
+
+if __name__ == "__main__":
+    # python services/password_hasher.py --target-ms 250
+    parser = argparse.ArgumentParser(description="Find the bcrypt cost for a target hashing time on this machine")
+    parser.add_argument("--target-ms", type=int, default=PASSWORD_TARGET_MS)
+    args = parser.parse_args()
+
+    for rounds in range(MIN_ROUNDS, MAX_ROUNDS + 1):
+        elapsed_ms = time_rounds(rounds) * 1000
+        print(f"cost {rounds:2d}: {elapsed_ms:8.1f} ms")
+        if elapsed_ms > args.target_ms * 2:
+            break
+    rounds = calibrate_rounds(args.target_ms)
+    print(f"\nRecommended for {args.target_ms} ms: [PASSWORDS] bcrypt_rounds = {rounds}")
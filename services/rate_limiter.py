@@ -0,0 +1,238 @@
+# services/rate_limiter.py
+import os
+import sys
+import time
+import logging
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import parse_qs
+from sqlalchemy import text
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import RATE_LIMIT_ENABLED, RATE_LIMIT_BACKEND, RATE_LIMIT_TRUST_FORWARDED, RATE_LIMIT_RULES
+from db import engine
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600}
+# Login and registration forms are small; bigger bodies are not parsed for the account
+MAX_FORM_BODY = 64 * 1024
+
+class Limit(NamedTuple):
+    scope: str        # "ip" or "account"
+    capacity: float   # burst size
+    rate: float       # tokens per second
+
+def parse_limits(spec: str) -> List[Limit]:
+    # "ip:20/minute, account:5/minute"
+    limits = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        scope, _, amount = part.partition(":")
+        count, _, period = amount.partition("/")
+        scope, period = scope.strip(), period.strip()
+        if scope not in ("ip", "account") or period not in PERIODS:
+            raise ValueError(f"Invalid rate limit: {part}")
+        capacity = float(count)
+        limits.append(Limit(scope, capacity, capacity / PERIODS[period]))
+    return limits
+
+# A token bucket per key: take() spends one token if one is available and
+# otherwise says how many seconds until the next one. O(1) per call.
+class RateLimitBackend(ABC):
+    # Backends doing I/O are called from a worker thread
+    blocking = False
+
+    @abstractmethod
+    def take(self, key: str, limit: Limit, now: float) -> Tuple[bool, float]:
+        pass
+
+class MemoryRateLimitBackend(RateLimitBackend):
+    # Per worker. The lock only guards a few arithmetic operations. Buckets
+    # that have refilled completely are the same as absent ones and are
+    # dropped in an occasional sweep, so memory follows the active clients.
+    def __init__(self, sweep_interval: int = 60):
+        # key -> (tokens, updated, full_at)
+        self.buckets: Dict[str, Tuple[float, float, float]] = {}
+        self.lock = threading.Lock()
+        self.sweep_interval = sweep_interval
+        self.last_sweep = time.time()
+
+    def take(self, key: str, limit: Limit, now: float) -> Tuple[bool, float]:
+        with self.lock:
+            tokens, updated, _ = self.buckets.get(key, (limit.capacity, now, now))
+            tokens = min(limit.capacity, tokens + (now - updated) * limit.rate)
+            if tokens >= 1:
+                tokens -= 1
+                allowed, retry_after = True, 0.0
+            else:
+                allowed, retry_after = False, (1 - tokens) / limit.rate
+            full_at = now + (limit.capacity - tokens) / limit.rate
+            self.buckets[key] = (tokens, now, full_at)
+            if now - self.last_sweep >= self.sweep_interval:
+                self._sweep_locked(now)
+        return allowed, retry_after
+
+    def _sweep_locked(self, now: float):
+        self.last_sweep = now
+        for key in [k for k, bucket in self.buckets.items() if bucket[2] <= now]:
+            del self.buckets[key]
+
+    def __len__(self):
+        return len(self.buckets)
+
+class DatabaseRateLimitBackend(RateLimitBackend):
+    # Buckets in the rate_limit_buckets table, shared by all workers. Refill
+    # and spend happen in one upsert, so concurrent workers can't both spend
+    # the last token.
+    blocking = True
+
+    TAKE_SQL = text(
+        "INSERT INTO rate_limit_buckets (bucket_key, tokens, updated_at) "
+        "VALUES (:key, :capacity - 1, :now) "
+        "ON CONFLICT (bucket_key) DO UPDATE SET "
+        "tokens = (CASE WHEN rate_limit_buckets.tokens + (:now - rate_limit_buckets.updated_at) * :rate > :capacity "
+        "THEN :capacity "
+        "ELSE rate_limit_buckets.tokens + (:now - rate_limit_buckets.updated_at) * :rate END) - 1, "
+        "updated_at = :now "
+        "WHERE rate_limit_buckets.tokens + (:now - rate_limit_buckets.updated_at) * :rate >= 1"
+    )
+
+    def __init__(self, purge_interval: int = 3600):
+        self.purge_interval = purge_interval
+        self.last_purge = 0.0
+
+    def take(self, key: str, limit: Limit, now: float) -> Tuple[bool, float]:
+        params = {"key": key, "capacity": limit.capacity, "rate": limit.rate, "now": now}
+        with engine.begin() as conn:
+            if conn.execute(self.TAKE_SQL, params).rowcount:
+                allowed, retry_after = True, 0.0
+            else:
+                tokens, updated = conn.execute(
+                    text("SELECT tokens, updated_at FROM rate_limit_buckets WHERE bucket_key = :key"), {"key": key}
+                ).one()
+                allowed, retry_after = False, (1 - tokens - (now - updated) * limit.rate) / limit.rate
+        if now - self.last_purge >= self.purge_interval:
+            self.purge(now)
+        return allowed, retry_after
+
+    def purge(self, now: float) -> int:
+        # Anything untouched for a day has long refilled
+        self.last_purge = now
+        with engine.begin() as conn:
+            purged = conn.execute(
+                text("DELETE FROM rate_limit_buckets WHERE updated_at < :cutoff"), {"cutoff": now - 86400}
+            ).rowcount
+        if purged:
+            logger.info(f"Cleaned {purged} idle rate limit buckets")
+        return purged
+
+class RateLimiter:
+    def __init__(self, backend: RateLimitBackend, rules: Dict[str, str], trust_forwarded_for: bool = False):
+        self.backend = backend
+        self.rules = {path: parse_limits(spec) for path, spec in rules.items()}
+        self.trust_forwarded_for = trust_forwarded_for
+
+    def client_ip(self, scope) -> str:
+        if self.trust_forwarded_for:
+            for name, value in scope.get("headers", []):
+                if name == b"x-forwarded-for":
+                    return value.decode("latin-1").split(",")[0].strip()
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    async def check(self, path: str, ip: str, account: Optional[str]) -> Tuple[bool, float]:
+        # All of the route's buckets must have a token; returns the longest wait
+        now = time.time()
+        allowed, retry_after = True, 0.0
+        for limit in self.rules[path]:
+            subject = ip if limit.scope == "ip" else account
+            if subject is None:
+                continue
+            key = f"{path}:{limit.scope}:{subject}"
+            if self.backend.blocking:
+                ok, wait = await run_in_threadpool(self.backend.take, key, limit, now)
+            else:
+                ok, wait = self.backend.take(key, limit, now)
+            if not ok:
+                allowed, retry_after = False, max(retry_after, wait)
+        return allowed, retry_after
+
+def build_rate_limiter() -> Optional[RateLimiter]:
+    if not RATE_LIMIT_ENABLED:
+        return None
+    if RATE_LIMIT_BACKEND == "memory":
+        backend = MemoryRateLimitBackend()
+    elif RATE_LIMIT_BACKEND == "database":
+        backend = DatabaseRateLimitBackend()
+    else:
+        raise ValueError(f"Unknown rate limit backend: {RATE_LIMIT_BACKEND}")
+    return RateLimiter(backend, RATE_LIMIT_RULES, RATE_LIMIT_TRUST_FORWARDED)
+
+rate_limiter = build_rate_limiter()
+
+class RateLimitMiddleware:
+    # Plain ASGI middleware: requests to other paths pass straight through
+    # after one dict lookup. For limited routes the (small) form body is read
+    # to find the account, then replayed to the route unchanged.
+    def __init__(self, app, limiter: Optional[RateLimiter], on_limited: Callable, account_resolver: Callable):
+        self.app = app
+        self.limiter = limiter
+        # on_limited(request, retry_after) -> Response
+        self.on_limited = on_limited
+        # account_resolver(request, form) -> awaitable account key or None
+        self.account_resolver = account_resolver
+
+    async def __call__(self, scope, receive, send):
+        if (
+            self.limiter is None
+            or scope["type"] != "http"
+            or scope["method"] != "POST"
+            or scope["path"] not in self.limiter.rules
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        body, receive = await self._buffer_form(scope, receive)
+        form = parse_qs(body.decode("utf-8", "replace")) if body is not None else {}
+        request = Request(scope)
+        account = await self.account_resolver(request, form)
+
+        allowed, retry_after = await self.limiter.check(scope["path"], self.limiter.client_ip(scope), account)
+        if not allowed:
+            logger.warning(f"Rate limit hit on {scope['path']} from {self.limiter.client_ip(scope)} (account {account})")
+            response = self.on_limited(request, retry_after)
+            await response(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+    async def _buffer_form(self, scope, receive):
+        # Returns the url-encoded body (or None) and a receive that replays it
+        headers = dict(scope.get("headers", []))
+        content_type = headers.get(b"content-type", b"").split(b";")[0].strip()
+        length = headers.get(b"content-length", b"")
+        if content_type != b"application/x-www-form-urlencoded" or not length.isdigit() or int(length) > MAX_FORM_BODY:
+            return None, receive
+
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] != "http.request":
+                # Client went away; let the app see it
+                return None, _replay([message], receive)
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        body = b"".join(chunks)
+        return body, _replay([{"type": "http.request", "body": body, "more_body": False}], receive)
+
+def _replay(messages, receive):
+    async def replay_receive():
+        if messages:
+            return messages.pop(0)
+        return await receive()
+    return replay_receive
@@ -0,0 +1,52 @@
+# services/reset_tokens.py
+import os
+import sys
+import asyncio
+import hashlib
+import logging
+import secrets
+from datetime import datetime, timedelta
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import RESET_TOKEN_HOURS
+from db import SessionLocal
+from models import PasswordResetToken
+
+logger = logging.getLogger(__name__)
+
+# Reset tokens are 256 random bits, so a plain SHA-256 is enough to make a
+# leaked table useless while keeping the lookup a single index probe.
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+def issue_reset_token(db: Session, person_id: int) -> str:
+    # A new link replaces any earlier one; the caller commits
+    db.execute(delete(PasswordResetToken).where(PasswordResetToken.person_id == person_id))
+    token = secrets.token_urlsafe(32)
+    db.add(PasswordResetToken(
+        token_hash=hash_token(token),
+        person_id=person_id,
+        expires_at=datetime.now() + timedelta(hours=RESET_TOKEN_HOURS)
+    ))
+    return token
+
+def reset_token_query(token: str):
+    return select(PasswordResetToken).where(PasswordResetToken.token_hash == hash_token(token))
+
+def purge_expired_reset_tokens() -> int:
+    with SessionLocal() as db:
+        purged = db.execute(delete(PasswordResetToken).where(PasswordResetToken.expires_at < datetime.now())).rowcount
+        db.commit()
+    if purged:
+        logger.info(f"Cleaned {purged} expired password reset tokens")
+    return purged
+
+async def purge_reset_tokens_periodically(interval: int):
+    while True:
+        try:
+            await run_in_threadpool(purge_expired_reset_tokens)
+        except Exception as e:
+            logger.error(f"Purging password reset tokens failed: {str(e)}")
+        await asyncio.sleep(interval)
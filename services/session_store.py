@@ -0,0 +1,358 @@
+# services/session_store.py
+import os
+import sys
+import heapq
+import hmac
+import uuid
+import base64
+import hashlib
+import secrets
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import delete, select
+from starlette.concurrency import run_in_threadpool
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import SESSION_BACKEND, SESSION_EXPIRY_DAYS, SESSION_SECRET_KEY, SESSION_REVOCATION_REFRESH
+from db import SessionLocal, AsyncSessionLocal
+from models import UserSession, SessionRevocation
+
+logger = logging.getLogger(__name__)
+
+# Server-side login sessions: session_id -> (user_id, expires).
+# Lookups are O(1); expired sessions are purged lazily, never by scanning
+# every session on each request.
+class SessionStore(ABC):
+    @abstractmethod
+    def create(self, user_id: int, expires: datetime, role_version: int = 0) -> str:
+        pass
+
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[int]:
+        pass
+
+    async def get_async(self, session_id: str) -> Optional[int]:
+        return self.get(session_id)
+
+    @abstractmethod
+    def delete(self, session_id: str) -> None:
+        pass
+
+    @abstractmethod
+    def purge_expired(self) -> int:
+        pass
+
+    def revoke_user(self, user_id: int, role_version: int) -> None:
+        # Server-side sessions need nothing here: the role is read from the database
+        pass
+
+    @staticmethod
+    def new_session_id() -> str:
+        return str(uuid.uuid4())
+
+class MemorySessionStore(SessionStore):
+    # Per-process store. Expiry uses a min-heap ordered by expiry time, so a
+    # purge only looks at sessions that actually expired: O(log n) each.
+    def __init__(self):
+        self.sessions: Dict[str, Tuple[int, datetime]] = {}
+        self.expiry_heap: List[Tuple[datetime, str]] = []
+        self.lock = threading.Lock()
+
+    def create(self, user_id: int, expires: datetime, role_version: int = 0) -> str:
+        session_id = self.new_session_id()
+        with self.lock:
+            self._purge_locked(datetime.now())
+            self.sessions[session_id] = (user_id, expires)
+            heapq.heappush(self.expiry_heap, (expires, session_id))
+        return session_id
+
+    def get(self, session_id: str) -> Optional[int]:
+        entry = self.sessions.get(session_id)
+        if entry is None:
+            return None
+        user_id, expires = entry
+        if expires < datetime.now():
+            self.delete(session_id)
+            return None
+        return user_id
+
+    def delete(self, session_id: str) -> None:
+        # The heap entry stays behind and is skipped when it comes up
+        with self.lock:
+            self.sessions.pop(session_id, None)
+
+    def purge_expired(self) -> int:
+        with self.lock:
+            return self._purge_locked(datetime.now())
+
+    def _purge_locked(self, now: datetime) -> int:
+        purged = 0
+        while self.expiry_heap and self.expiry_heap[0][0] < now:
+            expires, session_id = heapq.heappop(self.expiry_heap)
+            entry = self.sessions.get(session_id)
+            # Only drop it if this heap entry is still the live one
+            if entry is not None and entry[1] == expires:
+                del self.sessions[session_id]
+                purged += 1
+        if purged:
+            logger.info(f"Cleaned {purged} expired sessions")
+        return purged
+
+    def __len__(self):
+        return len(self.sessions)
+
+class DatabaseSessionStore(SessionStore):
+    # Shared store in the application database: every worker sees the same
+    # sessions. Lookups hit the primary key; expired rows are deleted through
+    # the expires_at index at most once per purge_interval seconds.
+    def __init__(self, purge_interval: int = 60):
+        self.purge_interval = purge_interval
+        self.last_purge = 0.0
+
+    def create(self, user_id: int, expires: datetime, role_version: int = 0) -> str:
+        session_id = self.new_session_id()
+        with SessionLocal() as db:
+            db.add(UserSession(id=session_id, person_id=user_id, expires_at=expires))
+            db.commit()
+        self._maybe_purge()
+        return session_id
+
+    def get(self, session_id: str) -> Optional[int]:
+        with SessionLocal() as db:
+            row = db.execute(
+                select(UserSession.person_id, UserSession.expires_at).where(UserSession.id == session_id)
+            ).first()
+        return self._check(session_id, row)
+
+    async def get_async(self, session_id: str) -> Optional[int]:
+        async with AsyncSessionLocal() as db:
+            row = (await db.execute(
+                select(UserSession.person_id, UserSession.expires_at).where(UserSession.id == session_id)
+            )).first()
+            if row is None:
+                return None
+            if self._expired(row):
+                # On this session, delete() would block the event loop
+                await db.execute(delete(UserSession).where(UserSession.id == session_id))
+                await db.commit()
+                return None
+            return row.person_id
+
+    def _check(self, session_id: str, row) -> Optional[int]:
+        if row is None:
+            return None
+        if self._expired(row):
+            self.delete(session_id)
+            return None
+        return row.person_id
+
+    @staticmethod
+    def _expired(row) -> bool:
+        return row.expires_at < datetime.now()
+
+    def delete(self, session_id: str) -> None:
+        with SessionLocal() as db:
+            db.execute(delete(UserSession).where(UserSession.id == session_id))
+            db.commit()
+
+    def purge_expired(self) -> int:
+        self.last_purge = time.monotonic()
+        with SessionLocal() as db:
+            purged = db.execute(delete(UserSession).where(UserSession.expires_at < datetime.now())).rowcount
+            db.commit()
+        if purged:
+            logger.info(f"Cleaned {purged} expired sessions")
+        return purged
+
+    def _maybe_purge(self):
+        if time.monotonic() - self.last_purge >= self.purge_interval:
+            self.purge_expired()
+
+class RevocationSet:
+    # Revoked signed tokens, kept only until the tokens would have expired
+    # anyway: single token ids (logout) and a minimum role version per person
+    # (role change). Revocations are written to session_revocations; every
+    # worker reloads the unexpired rows at most once per refresh seconds, so
+    # checking a token normally costs no I/O at all. All of them, not just ids
+    # above the last one seen: ids are assigned at insert but become visible at
+    # commit, possibly out of order. The table only holds rows until their
+    # tokens expire, so it stays small.
+    def __init__(self, refresh: int):
+        self.refresh = refresh
+        self.tokens: Dict[str, datetime] = {}
+        self.min_role_versions: Dict[int, Tuple[int, datetime]] = {}
+        self.last_sync = 0.0
+        self.lock = threading.Lock()
+
+    def revoke_token(self, token_id: str, expires: datetime) -> None:
+        self._store(SessionRevocation(token_id=token_id, expires_at=expires))
+
+    def revoke_person(self, person_id: int, role_version: int, expires: datetime) -> None:
+        self._store(SessionRevocation(person_id=person_id, role_version=role_version, expires_at=expires))
+
+    def is_revoked(self, token_id: str, person_id: int, role_version: int) -> bool:
+        if self.sync_due():
+            self.sync()
+        if token_id in self.tokens:
+            return True
+        entry = self.min_role_versions.get(person_id)
+        return entry is not None and role_version < entry[0]
+
+    def _store(self, revocation: SessionRevocation):
+        with self.lock:
+            self._add(revocation.token_id, revocation.person_id, revocation.role_version, revocation.expires_at)
+        with SessionLocal() as db:
+            db.add(revocation)
+            db.commit()
+
+    def _add(self, token_id, person_id, role_version, expires):
+        if token_id:
+            self.tokens[token_id] = expires
+        elif person_id is not None:
+            current = self.min_role_versions.get(person_id)
+            # Reloads see the same rows again; a later expiry for the same
+            # version extends it
+            if current is None or (role_version, expires) > current:
+                self.min_role_versions[person_id] = (role_version, expires)
+
+    def sync_due(self) -> bool:
+        return time.monotonic() - self.last_sync >= self.refresh
+
+    def sync(self) -> None:
+        self.last_sync = time.monotonic()
+        now = datetime.now()
+        try:
+            with SessionLocal() as db:
+                rows = db.execute(
+                    select(
+                        SessionRevocation.token_id, SessionRevocation.person_id,
+                        SessionRevocation.role_version, SessionRevocation.expires_at
+                    ).where(SessionRevocation.expires_at >= now)
+                ).all()
+        except Exception as e:
+            # Keep serving with what we have, try again next interval
+            logger.error(f"Could not load session revocations: {str(e)}")
+            return
+        with self.lock:
+            for row in rows:
+                self._add(row.token_id, row.person_id, row.role_version, row.expires_at)
+            self._prune_locked(now)
+
+    def purge_expired(self) -> int:
+        now = datetime.now()
+        with self.lock:
+            self._prune_locked(now)
+        with SessionLocal() as db:
+            purged = db.execute(delete(SessionRevocation).where(SessionRevocation.expires_at < now)).rowcount
+            db.commit()
+        return purged
+
+    def _prune_locked(self, now: datetime):
+        self.tokens = {k: exp for k, exp in self.tokens.items() if exp >= now}
+        self.min_role_versions = {k: v for k, v in self.min_role_versions.items() if v[1] >= now}
+
+    def __len__(self):
+        return len(self.tokens) + len(self.min_role_versions)
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+class SignedSessionStore(SessionStore):
+    # Stateless sessions: the cookie is "<payload>.<hmac>" where the payload
+    # is "user_id:role_version:expires:token_id". Verifying it needs only the
+    # secret key, so no worker has to share or look up session state; only
+    # revocations (see RevocationSet) are shared.
+    def __init__(self, secret_key: str, max_age: timedelta, revocation_refresh: int):
+        if not secret_key:
+            # Sessions will not survive a restart and workers won't accept each other's tokens
+            logger.warning("No session secret_key configured, using a random key for this process")
+            secret_key = secrets.token_hex(32)
+        self.key = secret_key.encode("utf-8")
+        self.max_age = max_age
+        self.revocations = RevocationSet(revocation_refresh)
+        self.purge_interval = 3600
+        self.last_purge = 0.0
+
+    def _signature(self, payload: bytes) -> str:
+        return _b64encode(hmac.new(self.key, payload, hashlib.sha256).digest())
+
+    def create(self, user_id: int, expires: datetime, role_version: int = 0) -> str:
+        self._maybe_purge()
+        token_id = secrets.token_urlsafe(12)
+        payload = f"{user_id}:{role_version}:{int(expires.timestamp())}:{token_id}".encode("ascii")
+        return f"{_b64encode(payload)}.{self._signature(payload)}"
+
+    def _decode(self, session_id: str) -> Optional[Tuple[int, int, datetime, str]]:
+        # Returns (user_id, role_version, expires, token_id) for a genuine token
+        try:
+            encoded, signature = session_id.split(".")
+            payload = _b64decode(encoded)
+            if not hmac.compare_digest(signature, self._signature(payload)):
+                return None
+            user_id, role_version, expires, token_id = payload.decode("ascii").split(":")
+            return int(user_id), int(role_version), datetime.fromtimestamp(int(expires)), token_id
+        except (ValueError, UnicodeDecodeError):
+            return None
+
+    def get(self, session_id: str) -> Optional[int]:
+        token = self._decode(session_id)
+        if token is None:
+            logger.debug("Rejected session token with an invalid signature")
+            return None
+        user_id, role_version, expires, token_id = token
+        if expires < datetime.now():
+            return None
+        if self.revocations.is_revoked(token_id, user_id, role_version):
+            return None
+        return user_id
+
+    async def get_async(self, session_id: str) -> Optional[int]:
+        # The periodic revocation refresh is the only I/O, keep it off the event loop
+        if self.revocations.sync_due():
+            await run_in_threadpool(self.revocations.sync)
+        return self.get(session_id)
+
+    def delete(self, session_id: str) -> None:
+        token = self._decode(session_id)
+        if token is None:
+            return
+        user_id, role_version, expires, token_id = token
+        if expires >= datetime.now():
+            self.revocations.revoke_token(token_id, expires)
+
+    def revoke_user(self, user_id: int, role_version: int) -> None:
+        # Every token issued with an older role version is rejected until the
+        # longest-lived of them has expired
+        self.revocations.revoke_person(user_id, role_version, datetime.now() + self.max_age)
+
+    def purge_expired(self) -> int:
+        self.last_purge = time.monotonic()
+        purged = self.revocations.purge_expired()
+        if purged:
+            logger.info(f"Cleaned {purged} expired session revocations")
+        return purged
+
+    def _maybe_purge(self):
+        if time.monotonic() - self.last_purge >= self.purge_interval:
+            self.purge_expired()
+
+def build_session_store() -> SessionStore:
+    if SESSION_BACKEND == "memory":
+        return MemorySessionStore()
+    if SESSION_BACKEND == "database":
+        return DatabaseSessionStore()
+    if SESSION_BACKEND == "signed":
+        return SignedSessionStore(
+            secret_key=SESSION_SECRET_KEY,
+            max_age=timedelta(days=SESSION_EXPIRY_DAYS),
+            revocation_refresh=SESSION_REVOCATION_REFRESH
+        )
+    raise ValueError(f"Unknown session backend: {SESSION_BACKEND}")
+
+session_store = build_session_store()
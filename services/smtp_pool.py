@@ -0,0 +1,156 @@
+# services/smtp_pool.py
+#
+# A small pool of logged-in SMTP connections. Opening one costs a TCP
+# connect, STARTTLS and AUTH, which used to be paid for every single mail;
+# now a connection is kept and reused for as many mails as the server allows.
+#
+# A connection that has been idle for a while gets a NOOP before use, and one
+# that fails either way is closed and replaced. send_many() sends a whole list
+# over one connection, reconnecting in the middle if the server drops it.
+import ssl
+import time
+import queue
+import logging
+import smtplib
+import threading
+from typing import Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Errors after which the connection cannot be trusted any more; a mail that
+# was refused (SMTPRecipientsRefused, SMTPDataError, ...) leaves it usable
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError)
+
+class PooledConnection:
+    def __init__(self, smtp: smtplib.SMTP):
+        self.smtp = smtp
+        self.sent = 0
+        self.last_used = time.monotonic()
+
+class SmtpConnectionPool:
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        username: str = "",
+        password: str = "",
+        use_tls: bool = True,
+        size: int = 2,
+        timeout: float = 30,
+        check_after: float = 30,
+        max_messages: int = 100
+    ):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.timeout = timeout
+        self.check_after = check_after        # seconds idle before a NOOP check
+        self.max_messages = max_messages      # per connection, then reconnect (0: no limit)
+        self.idle: "queue.LifoQueue[PooledConnection]" = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+        self.closed = False
+
+    def connect(self) -> PooledConnection:
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.use_tls:
+                smtp.starttls(context=ssl.create_default_context())
+            if self.username:
+                smtp.login(self.username, self.password)
+        except BaseException:
+            self.discard(PooledConnection(smtp))
+            raise
+        logger.debug("Opened SMTP connection to %s:%s", self.host, self.port)
+        return PooledConnection(smtp)
+
+    def discard(self, conn: PooledConnection):
+        try:
+            conn.smtp.quit()
+        except Exception:
+            conn.smtp.close()
+
+    def healthy(self, conn: PooledConnection) -> bool:
+        if self.max_messages and conn.sent >= self.max_messages:
+            return False
+        if time.monotonic() - conn.last_used < self.check_after:
+            return True
+        try:
+            return conn.smtp.noop()[0] == 250
+        except CONNECTION_ERRORS + (smtplib.SMTPException,):
+            return False
+
+    def acquire(self) -> PooledConnection:
+        # Most recently used first, so surplus connections go idle and time out
+        while True:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                return self.connect()
+            if self.healthy(conn):
+                return conn
+            self.discard(conn)
+
+    def release(self, conn: PooledConnection):
+        conn.last_used = time.monotonic()
+        if self.closed:
+            self.discard(conn)
+        else:
+            self.idle.put(conn)
+
+    def _send(self, conn: PooledConnection, from_address: str, to_addresses: List[str], message: str):
+        conn.smtp.sendmail(from_address, to_addresses, message)
+        conn.sent += 1
+        conn.last_used = time.monotonic()
+
+    def send(self, from_address: str, to_addresses: List[str], message: str):
+        error = self.send_many([(from_address, to_addresses, message)])[0]
+        if error is not None:
+            raise error
+
+    def send_many(self, messages: Iterable[Tuple[str, List[str], str]]) -> List[Optional[Exception]]:
+        # Sends (from, to, message) tuples over one connection and returns None
+        # or the error per message. A refused message does not stop the rest; a
+        # dropped connection is replaced and the message tried once more. If no
+        # connection can be opened, the remaining messages all get that error.
+        messages = list(messages)
+        results: List[Optional[Exception]] = []
+        conn = None
+        with self.slots:
+            try:
+                for from_address, to_addresses, message in messages:
+                    for attempt in range(2):
+                        if conn is not None and not self.healthy(conn):
+                            self.discard(conn)
+                            conn = None
+                        if conn is None:
+                            try:
+                                conn = self.acquire()
+                            except Exception as e:
+                                logger.error(f"Could not connect to SMTP server {self.host}:{self.port}: {str(e)}")
+                                return results + [e] * (len(messages) - len(results))
+                        try:
+                            self._send(conn, from_address, to_addresses, message)
+                            results.append(None)
+                            break
+                        except CONNECTION_ERRORS as e:
+                            self.discard(conn)
+                            conn = None
+                            if attempt:
+                                results.append(e)
+                        except smtplib.SMTPException as e:
+                            results.append(e)
+                            break
+            finally:
+                if conn is not None:
+                    self.release(conn)
+        return results
+
+    def close(self):
+        self.closed = True
+        while True:
+            try:
+                self.discard(self.idle.get_nowait())
+            except queue.Empty:
+                break
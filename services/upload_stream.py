@@ -0,0 +1,168 @@
+# services/upload_stream.py
+import logging
+from typing import Dict, List, Optional
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # older python-multipart releases
+    from multipart.multipart import MultipartParser, parse_options_header
+
+from services.file_storage import BlobWriter, StoredBlob, file_storage
+
+logger = logging.getLogger(__name__)
+
+# Plain form fields are small (ids, flags), cap them so they can't be abused
+MAX_FIELD_SIZE = 64 * 1024
+
+class UploadLimitError(ValueError):
+    pass
+
+class StreamedFile:
+    # A file part written to a pending blob. Nothing is visible in the
+    # file store until commit(), so a rejected request leaves no trace.
+    def __init__(self, filename: str, content_type: str, writer: BlobWriter):
+        self.filename = filename
+        self.content_type = content_type
+        self.writer = writer
+        self.buffer = bytearray()
+
+    @property
+    def size(self) -> int:
+        return self.writer.size + len(self.buffer)
+
+    async def commit(self) -> StoredBlob:
+        return await run_in_threadpool(self.writer.commit)
+
+    async def release(self) -> None:
+        await run_in_threadpool(self.writer.release)
+
+    async def discard(self) -> None:
+        await run_in_threadpool(self.writer.discard)
+
+class _Part:
+    def __init__(self):
+        self.headers: Dict[bytes, bytes] = {}
+        self.name: Optional[str] = None
+        self.file: Optional[StreamedFile] = None
+        self.value = bytearray()
+
+async def parse_streamed_upload(
+    request: Request,
+    max_file_size: int,
+    max_request_size: int,
+    max_files: int,
+    chunk_size: int
+):
+    # Parses a multipart/form-data body as it arrives. File parts go straight
+    # to the file store in chunk_size writes, hashed incrementally, so memory
+    # per upload stays at roughly one chunk whatever the document size.
+    # Limits are checked as bytes arrive, not after the body is buffered.
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise ValueError("Expected a multipart/form-data request")
+
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_request_size:
+        raise UploadLimitError(f"Request exceeds {max_request_size} bytes")
+
+    fields: Dict[str, str] = {}
+    files: List[StreamedFile] = []
+    events = []
+    state = {"part": None, "header_field": b"", "header_value": b""}
+
+    def on_part_begin():
+        events.append(("begin", None))
+
+    def on_header_field(data, start, end):
+        state["header_field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        state["header_value"] += data[start:end]
+
+    def on_header_end():
+        events.append(("header", (state["header_field"].lower(), state["header_value"])))
+        state["header_field"] = b""
+        state["header_value"] = b""
+
+    def on_headers_finished():
+        events.append(("headers_finished", None))
+
+    def on_part_data(data, start, end):
+        events.append(("data", bytes(data[start:end])))
+
+    def on_part_end():
+        events.append(("end", None))
+
+    parser = MultipartParser(options[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+
+    async def flush(streamed: StreamedFile, final: bool = False):
+        while len(streamed.buffer) >= chunk_size or (final and streamed.buffer):
+            chunk = bytes(streamed.buffer[:chunk_size])
+            del streamed.buffer[:chunk_size]
+            await run_in_threadpool(streamed.writer.write, chunk)
+
+    async def process_events():
+        for kind, payload in events:
+            part = state["part"]
+            if kind == "begin":
+                state["part"] = _Part()
+            elif kind == "header":
+                part.headers[payload[0]] = payload[1]
+            elif kind == "headers_finished":
+                _, disposition = parse_options_header(part.headers.get(b"content-disposition", b""))
+                part.name = disposition.get(b"name", b"").decode("utf-8", "replace")
+                if b"filename" in disposition:
+                    if len(files) >= max_files:
+                        raise UploadLimitError(f"More than {max_files} files in one request")
+                    writer = await run_in_threadpool(file_storage.open_writer)
+                    part.file = StreamedFile(
+                        filename=disposition[b"filename"].decode("utf-8", "replace"),
+                        content_type=part.headers.get(b"content-type", b"application/octet-stream").decode("latin-1"),
+                        writer=writer
+                    )
+                    files.append(part.file)
+            elif kind == "data":
+                if part.file:
+                    part.file.buffer.extend(payload)
+                    if part.file.size > max_file_size:
+                        raise UploadLimitError(f"{part.file.filename} exceeds {max_file_size} bytes")
+                    await flush(part.file)
+                else:
+                    part.value.extend(payload)
+                    if len(part.value) > MAX_FIELD_SIZE:
+                        raise UploadLimitError(f"Form field {part.name} is too large")
+            elif kind == "end":
+                if part.file:
+                    await flush(part.file, final=True)
+                else:
+                    fields[part.name] = part.value.decode("utf-8", "replace")
+                state["part"] = None
+        events.clear()
+
+    received = 0
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > max_request_size:
+                raise UploadLimitError(f"Request exceeds {max_request_size} bytes")
+            parser.write(chunk)
+            await process_events()
+        parser.finalize()
+        await process_events()
+    except BaseException:
+        for streamed in files:
+            await streamed.discard()
+        raise
+
+    logger.debug(f"Streamed {len(files)} file(s), {received} bytes")
+    return fields, files
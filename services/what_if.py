@@ -0,0 +1,163 @@
+# services/what_if.py
+#
+# What-if re-scoring: runs the loan decision rules over every stored
+# application under other thresholds and/or another interest rate and
+# reports how the decisions would change. The book is split into id ranges;
+# worker processes read and score one range at a time over their own
+# database connection, so nothing is replayed through the web app.
+#
+#   python services/what_if.py --boni-manager 700 --interest-rate 0.06 [--workers 4] [--chunk-size 5000]
+import os
+import sys
+import time
+import logging
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from sqlalchemy import func, select
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db import engine
+from models import Application
+from services.decision_rules import Ruleset, DecisionThresholds, DEFAULT_THRESHOLDS, decision_rules
+from services.batch_calculations import calculate_dscr_batch
+
+logger = logging.getLogger(__name__)
+
+SCORE_COLUMNS = (
+    Application.id, Application.loan_type, Application.bonitaet, Application.dscr, Application.ccr,
+    Application.requested_amount, Application.term_in_years,
+    Application.available_income, Application.total_debt_payments
+)
+
+class Scenario(NamedTuple):
+    thresholds: DecisionThresholds = DEFAULT_THRESHOLDS
+    # None keeps the stored DSCR; a rate recalculates it where the inputs are stored
+    interest_rate: Optional[float] = None
+
+def outcomes(ruleset: Ruleset, batch) -> List[str]:
+    labels = [rule.decision for rule in ruleset.rules]
+    return [
+        f"{labels[rule]} (Manager)" if manager else labels[rule]
+        for rule, manager in zip(batch.rules.tolist(), batch.needs_manager_approval.tolist())
+    ]
+
+def scenario_dscr(rows, scenario: Scenario) -> Tuple[List[Optional[float]], int]:
+    # DSCR per row under the scenario, and how many rows had to keep the stored value
+    dscr = [row.dscr for row in rows]
+    if scenario.interest_rate is None:
+        return dscr, 0
+    indexes = [
+        i for i, row in enumerate(rows)
+        if row.loan_type == "Baudarlehen" and row.available_income is not None and row.total_debt_payments is not None
+    ]
+    if indexes:
+        recalculated = calculate_dscr_batch(
+            [rows[i].available_income for i in indexes],
+            [rows[i].total_debt_payments for i in indexes],
+            [rows[i].requested_amount for i in indexes],
+            [rows[i].term_in_years for i in indexes],
+            scenario.interest_rate
+        )
+        for i, value in zip(indexes, recalculated.tolist()):
+            dscr[i] = value
+    kept = sum(1 for row in rows if row.loan_type == "Baudarlehen") - len(indexes)
+    return dscr, kept
+
+def score_chunk(first_id: int, last_id: int, baseline: Scenario, scenario: Scenario) -> dict:
+    with engine.connect() as conn:
+        rows = conn.execute(
+            select(*SCORE_COLUMNS).where(Application.id.between(first_id, last_id))
+        ).all()
+
+    scored, boni = [], []
+    for row in rows:
+        try:
+            boni.append(float(row.bonitaet))
+            scored.append(row)
+        except (TypeError, ValueError):
+            pass
+    skipped = len(rows) - len(scored)
+
+    base_dscr, _ = scenario_dscr(scored, baseline)
+    new_dscr, dscr_kept = scenario_dscr(scored, scenario)
+    ccr = [row.ccr for row in scored]
+    loan_types = [row.loan_type for row in scored]
+    base_rules, new_rules = Ruleset(baseline.thresholds), Ruleset(scenario.thresholds)
+    before = outcomes(base_rules, base_rules.evaluate_batch(boni, base_dscr, ccr, loan_types))
+    after = outcomes(new_rules, new_rules.evaluate_batch(boni, new_dscr, ccr, loan_types))
+    transitions = Counter(zip(loan_types, before, after))
+
+    return {"rows": len(rows), "skipped": skipped, "dscr_kept": dscr_kept, "transitions": transitions}
+
+def _init_worker():
+    # Connections inherited from the parent must not be shared
+    engine.dispose(close=False)
+
+def _score_chunk_task(args):
+    return score_chunk(*args)
+
+def id_ranges(chunk_size: int) -> List[Tuple[int, int]]:
+    with engine.connect() as conn:
+        first, last = conn.execute(select(func.min(Application.id), func.max(Application.id))).one()
+    if first is None:
+        return []
+    return [(start, min(start + chunk_size - 1, last)) for start in range(first, last + 1, chunk_size)]
+
+def run_what_if(scenario: Scenario, baseline: Scenario = Scenario(), workers: int = None, chunk_size: int = 5000) -> dict:
+    started = time.perf_counter()
+    tasks = [(first, last, baseline, scenario) for first, last in id_ranges(chunk_size)]
+    summary = {"rows": 0, "skipped": 0, "dscr_kept": 0, "transitions": Counter()}
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        for part in pool.map(_score_chunk_task, tasks):
+            summary["rows"] += part["rows"]
+            summary["skipped"] += part["skipped"]
+            summary["dscr_kept"] += part["dscr_kept"]
+            summary["transitions"].update(part["transitions"])
+
+    summary["seconds"] = time.perf_counter() - started
+    logger.info(f"What-if over {summary['rows']} applications in {summary['seconds']:.1f}s ({len(tasks)} chunks)")
+    return summary
+
+def format_summary(summary: dict) -> str:
+    transitions: Dict[tuple, int] = summary["transitions"]
+    scored = sum(transitions.values())
+    changed = {key: n for key, n in transitions.items() if key[1] != key[2]}
+    lines = [
+        f"{summary['rows']} applications in {summary['seconds']:.1f}s, "
+        f"{scored} scored, {summary['skipped']} without a valid Bonität",
+    ]
+    if summary["dscr_kept"]:
+        lines.append(f"{summary['dscr_kept']} Baudarlehen without stored inputs kept their DSCR")
+    lines.append(f"{sum(changed.values())} decisions change:")
+    for (loan_type, before, after), n in sorted(changed.items(), key=lambda item: -item[1]):
+        lines.append(f"  {n:8d}  {loan_type}: {before} -> {after}")
+
+    before_totals, after_totals = Counter(), Counter()
+    for (_, before, after), n in transitions.items():
+        before_totals[before] += n
+        after_totals[after] += n
+    lines.append("Totals (current -> what-if):")
+    for label in sorted(set(before_totals) | set(after_totals)):
+        lines.append(f"  {label:22s} {before_totals[label]:8d} -> {after_totals[label]:8d}")
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    # Thresholds not given stay as configured in App.ini
+    configured = decision_rules.current().thresholds
+    parser = argparse.ArgumentParser(description="Re-score all applications under alternative decision rules")
+    for field in DecisionThresholds._fields:
+        parser.add_argument(f"--{field.replace('_', '-')}", type=float, default=getattr(configured, field))
+    parser.add_argument("--interest-rate", type=float, default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    scenario = Scenario(
+        thresholds=DecisionThresholds(**{field: getattr(args, field) for field in DecisionThresholds._fields}),
+        interest_rate=args.interest_rate
+    )
+    baseline = Scenario(thresholds=configured)
+    print(format_summary(run_what_if(scenario, baseline, workers=args.workers, chunk_size=args.chunk_size)))